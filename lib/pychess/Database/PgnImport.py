@@ -4,10 +4,12 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import re
 import sys
 import zipfile
 from datetime import date
 from array import array
+from multiprocessing import Pool
 
 from .profilehooks import profile
 
@@ -19,13 +21,19 @@ from pychess.compat import unicode
 from pychess.Utils.const import *
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Savers.ChessFile import LoadingError
-from pychess.Savers.pgnbase import pgn_load
+from pychess.Savers.pgnbase import PgnBase, PgnGames, map_games, scan_games
 from pychess.Database.dbwalk import walk
 from pychess.Database.model import engine, metadata, collection, event,\
                             site, player, game, annotator, ini_collection
 
 CHUNK = 1000
 
+# Games parsed by a process at a time
+GAMES_CHUNK = 200
+
+# The variations, comments and nags of movetext
+annotated = re.compile(r"[(){};$!?]")
+
 EVENT, SITE, PLAYER, ANNOTATOR, COLLECTION = range(5)
 
 removeDic = {
@@ -39,6 +47,137 @@ removeDic = {
 LBoard_FEN_START = LBoard()
 LBoard_FEN_START.applyFen(FEN_START)
 
+def game_rows(cf, first=0):
+    """ Parses the games of the PgnBase cf into a (names, row) per game,
+        where row is a dict of the game table without the ids of the names:
+        event, site, white, black and annotator. Games that can't be parsed
+        are skipped. first is the number of games before the ones of cf in
+        their file. """
+    rows = []
+    for i in range(len(cf.games)):
+        movelist = array("H")
+        comments = []
+        cf.error = None
+
+        fenstr = cf._getTag(i, "FEN")
+        variant = cf.get_variant(i)
+
+        # Fixes for some non statndard Chess960 .pgn
+        if variant==0 and (fenstr is not None) and "Chess960" in cf._getTag(i,"Event"):
+            cf.tagcache[i]["Variant"] = "Fischerandom"
+            variant = 1
+            parts = fenstr.split()
+            parts[0] = parts[0].replace(".", "/").replace("0", "")
+            if len(parts) == 1:
+                parts.append("w")
+                parts.append("-")
+                parts.append("-")
+            fenstr = " ".join(parts)
+        
+        if variant:
+            board = LBoard(FISCHERRANDOMCHESS)
+        else:
+            board = LBoard()
+
+        if fenstr:
+            try:
+                board.applyFen(fenstr)
+            except SyntaxError as e:
+                print(_("The game #%s can't be loaded, because of an error parsing FEN") % (first+i+1), e.args[0])
+                continue
+        else:
+            board = LBoard_FEN_START.clone()
+
+        movetext = cf.get_movetext(i)
+        if annotated.search(movetext) is None:
+            # Without variations, comments and nags the moves are all there
+            # is to walk, so they are parsed without a board per move
+            movelist = cf.parse_mainline(movetext, board)
+            boards = None
+        else:
+            boards = cf.parse_string(movetext, board, -1)
+
+        if cf.error is not None:
+            print("ERROR in game #%s" % (first+i+1), cf.error.args[0])
+            continue
+
+        if boards is not None:
+            walk(boards[0], movelist, comments)
+        
+        if not movelist:
+            if (not comments) and (cf._getTag(i, 'White') is None) and (cf._getTag(i, 'Black') is None):
+                print("empty game")
+                continue
+
+        game_date = cf._getTag(i, 'Date')
+        if game_date and not '?' in game_date:
+            ymd = game_date.split('.')
+            if len(ymd) == 3:
+                game_year, game_month, game_day = map(int, ymd)
+            else:
+                game_year, game_month, game_day = int(game_date[:4]), None, None
+        elif game_date and not '?' in game_date[:4]:
+            game_year, game_month, game_day = int(game_date[:4]), None, None
+        else:
+            game_year, game_month, game_day = None, None, None
+
+        white, black = cf.get_player_names(i)
+
+        white_elo = cf._getTag(i, 'WhiteElo')
+        white_elo = int(white_elo) if white_elo and white_elo.isdigit() else None
+        
+        black_elo = cf._getTag(i, 'BlackElo')
+        black_elo = int(black_elo) if black_elo and black_elo.isdigit() else None
+
+        eco = cf._getTag(i, "ECO")
+        eco = eco[:3] if eco else None
+
+        names = (cf._getTag(i, 'Event'), cf._getTag(i, 'Site'), white, black,
+                 cf._getTag(i, "Annotator"))
+        rows.append((names, {
+            'date_year': game_year,
+            'date_month': game_month,
+            'date_day': game_day,
+            'round': cf._getTag(i, 'Round'),
+            'result': cf.get_result(i),
+            'white_elo': white_elo,
+            'black_elo': black_elo,
+            'ply_count': cf._getTag(i, "PlyCount"),
+            'eco': eco,
+            'fen': cf._getTag(i, "FEN"),
+            'variant': cf.get_variant(i),
+            'board': cf._getTag(i, "Board"),
+            'movelist': movelist.tobytes() if hasattr(movelist, "tobytes") else movelist.tostring(),
+            'comments': unicode("|".join(comments)),
+            }))
+    return rows
+
+def pgn_jobs(games, path=None):
+    """ Yields a job for parse_chunk per GAMES_CHUNK of the PgnGames games.
+        With the path of their file, the jobs hold the byte ranges of the
+        games in it, otherwise their bytes. """
+    for i in range(0, len(games), GAMES_CHUNK):
+        start = int(games.offsets[i])
+        if i + GAMES_CHUNK < len(games):
+            end = int(games.offsets[i + GAMES_CHUNK])
+        else:
+            end = len(games.data)
+        if path is None:
+            yield None, games.data[start:end], i
+        else:
+            yield path, (start, end), i
+
+def parse_chunk(job):
+    """ The game_rows of a job of pgn_jobs """
+    path, data, first = job
+    if isinstance(data, tuple):
+        start, end = data
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+    cf = PgnBase(PgnGames(data, scan_games(data)))
+    return game_rows(cf, first)
+
 class PgnImport():
     def __init__(self):
         self.conn = engine.connect()
@@ -126,9 +265,56 @@ class PgnImport():
 
         return next_id
 
+    def add_game(self, pgnfile, names, row):
+        """ Adds the row of a game from game_rows to game_data, with the ids
+            of its names """
+        event_name, site_name, white, black, annotator_name = names
+        row['event_id'] = self.get_id(event_name, event, EVENT)
+        row['site_id'] = self.get_id(site_name, site, SITE)
+        row['white_id'] = self.get_id(white, player, PLAYER)
+        row['black_id'] = self.get_id(black, player, PLAYER)
+        row['annotator_id'] = self.get_id(annotator_name, annotator, ANNOTATOR)
+        row['collection_id'] = self.get_id(unicode(pgnfile), collection, COLLECTION)
+        self.game_data.append(row)
+
+    def flush(self):
+        """ Inserts the new names and games collected """
+        if self.collection_data:
+            self.conn.execute(self.ins_collection, self.collection_data)
+            self.collection_data = []
+
+        if self.event_data:
+            self.conn.execute(self.ins_event, self.event_data)
+            self.event_data = []
+
+        if self.site_data:
+            self.conn.execute(self.ins_site, self.site_data)
+            self.site_data = []
+
+        if self.player_data:
+            self.conn.execute(self.ins_player, self.player_data)
+            self.player_data = []
+
+        if self.annotator_data:
+            self.conn.execute(self.ins_annotator, self.annotator_data)
+            self.annotator_data = []
+
+        if self.game_data:
+            self.conn.execute(self.ins_game, self.game_data)
+            self.game_data = []
+
     #@profile
-    def do_import(self, filename):
+    def do_import(self, filename, processes=1, progress=None):
+        """ Imports the games of a PGN file, or of the PGN files in a zip
+            file. With more than one process, chunks of GAMES_CHUNK games are
+            parsed by a pool of processes, while this one resolves the names
+            and inserts the games, in the order of the file, CHUNK at a
+            time. progress is called with the file, the number of games
+            done and the number of games of the file after each insert. """
         print(filename)
+        if progress is None:
+            progress = lambda pgnfile, done, total: print(pgnfile, done)
+
         # collect new names not in they dict yet
         self.collection_data = []
         self.event_data = []
@@ -145,192 +331,51 @@ class PgnImport():
         else:
             zf = None
             files = [filename]
-        
-        for pgnfile in files:
-            if zf is None:
-                cf = pgn_load(open(pgnfile, "rU"))
-            else:
-                cf = pgn_load(zf.open(pgnfile, "rU"))
-             
-            # use transaction to avoid autocommit slowness
-            trans = self.conn.begin()
-            try:
-                for i, game in enumerate(cf.games):
-                    #print i+1#, cf.get_player_names(i)
-                    movelist = array("H")
-                    comments = []
-                    cf.error = None
-
-                    fenstr = cf._getTag(i, "FEN")
-                    variant = cf.get_variant(i)
-
-                    # Fixes for some non statndard Chess960 .pgn
-                    if variant==0 and (fenstr is not None) and "Chess960" in cf._getTag(i,"Event"):
-                        cf.tagcache[i]["Variant"] = "Fischerandom"
-                        variant = 1
-                        parts = fenstr.split()
-                        parts[0] = parts[0].replace(".", "/").replace("0", "")
-                        if len(parts) == 1:
-                            parts.append("w")
-                            parts.append("-")
-                            parts.append("-")
-                        fenstr = " ".join(parts)
-                    
-                    if variant:
-                        board = LBoard(FISCHERRANDOMCHESS)
-                    else:
-                        board = LBoard()
-
-                    if fenstr:
-                        try:
-                            board.applyFen(fenstr)
-                        except SyntaxError as e:
-                            print(_("The game #%s can't be loaded, because of an error parsing FEN") % (i+1), e.args[0])
-                            continue
-                    else:
-                        board = LBoard_FEN_START.clone()
-
-                    boards = [board]
-                    movetext = cf.get_movetext(i)
-                    boards = cf.parse_string(movetext, boards[0], -1)
-
-                    if cf.error is not None:
-                        print("ERROR in game #%s" % (i+1), cf.error.args[0])
-                        continue
-
-                    walk(boards[0], movelist, comments)
-                    
-                    if not movelist:
-                        if (not comments) and (cf._getTag(i, 'White') is None) and (cf._getTag(i, 'Black') is None):
-                            print("empty game")
-                            continue
-                    
-                    event_id = self.get_id(cf._getTag(i, 'Event'), event, EVENT)
-
-                    site_id = self.get_id(cf._getTag(i, 'Site'), site, SITE)
-
-                    game_date = cf._getTag(i, 'Date')
-                    if game_date and not '?' in game_date:
-                        ymd = game_date.split('.')
-                        if len(ymd) == 3:
-                            game_year, game_month, game_day = map(int, ymd)
-                        else:
-                            game_year, game_month, game_day = int(game_date[:4]), None, None
-                    elif game_date and not '?' in game_date[:4]:
-                        game_year, game_month, game_day = int(game_date[:4]), None, None
-                    else:
-                        game_year, game_month, game_day = None, None, None
-
-                    game_round = cf._getTag(i, 'Round')
-
-                    white, black = cf.get_player_names(i)
-                    white_id = self.get_id(white, player, PLAYER)
-                    black_id = self.get_id(black, player, PLAYER)
-
-                    result = cf.get_result(i)
-     
-                    white_elo = cf._getTag(i, 'WhiteElo')
-                    white_elo = int(white_elo) if white_elo and white_elo.isdigit() else None
-                    
-                    black_elo = cf._getTag(i, 'BlackElo')
-                    black_elo = int(black_elo) if black_elo and black_elo.isdigit() else None
-     
-                    ply_count = cf._getTag(i, "PlyCount")
-     
-                    event_date = cf._getTag(i, 'EventDate')
-     
-                    eco = cf._getTag(i, "ECO")
-                    eco = eco[:3] if eco else None
-
-                    fen = cf._getTag(i, "FEN")
-     
-                    variant = cf.get_variant(i)
-                    
-                    board = cf._getTag(i, "Board")
-                    
-                    annotator = cf._getTag(i, "Annotator")
-                    annotator_id = self.get_id(annotator, annotator, ANNOTATOR)
-
-                    collection_id = self.get_id(unicode(pgnfile), collection, COLLECTION)
-
-                    self.game_data.append({
-                        'event_id': event_id,
-                        'site_id': site_id,
-                        'date_year': game_year,
-                        'date_month': game_month,
-                        'date_day': game_day,
-                        'round': game_round,
-                        'white_id': white_id,
-                        'black_id': black_id,
-                        'result': result,
-                        'white_elo': white_elo,
-                        'black_elo': black_elo,
-                        'ply_count': ply_count,
-                        'eco': eco,
-                        'fen': fen,
-                        'variant': variant,
-                        'board': board,
-                        'annotator_id': annotator_id,
-                        'collection_id': collection_id,
-                        'movelist': movelist.tostring(),
-                        'comments': unicode("|".join(comments)),
-                        })
-
-                    if len(self.game_data) >= CHUNK:
-                        if self.collection_data:
-                            self.conn.execute(self.ins_collection, self.collection_data)
-                            self.collection_data = []
-
-                        if self.event_data:
-                            self.conn.execute(self.ins_event, self.event_data)
-                            self.event_data = []
-
-                        if self.site_data:
-                            self.conn.execute(self.ins_site, self.site_data)
-                            self.site_data = []
 
-                        if self.player_data:
-                            self.conn.execute(self.ins_player, self.player_data)
-                            self.player_data = []
-
-                        if self.annotator_data:
-                            self.conn.execute(self.ins_annotator, self.annotator_data)
-                            self.annotator_data = []
-
-                        self.conn.execute(self.ins_game, self.game_data)
-                        self.game_data = []
-                        print(pgnfile, i+1)
-                    
-                if self.collection_data:
-                    self.conn.execute(self.ins_collection, self.collection_data)
-                    self.collection_data = []
-
-                if self.event_data:
-                    self.conn.execute(self.ins_event, self.event_data)
-                    self.event_data = []
-
-                if self.site_data:
-                    self.conn.execute(self.ins_site, self.site_data)
-                    self.site_data = []
-
-                if self.player_data:
-                    self.conn.execute(self.ins_player, self.player_data)
-                    self.player_data = []
-
-                if self.annotator_data:
-                    self.conn.execute(self.ins_annotator, self.annotator_data)
-                    self.annotator_data = []
-
-                if self.game_data:
-                    self.conn.execute(self.ins_game, self.game_data)
-                    self.game_data = []
-
-                print(pgnfile, i+1)
-                trans.commit()
-
-            except ProgrammingError as e:
-                trans.rollback()
-                print("Importing %s failed! %s" % (file, e))
+        pool = Pool(processes) if processes > 1 else None
+        try:
+            for pgnfile in files:
+                if zf is None:
+                    # Only the offsets of the games are needed, so the file
+                    # isn't indexed
+                    with open(pgnfile, "rb") as f:
+                        games = map_games(f, index=False)
+                    jobs = pgn_jobs(games, pgnfile)
+                else:
+                    data = zf.read(pgnfile)
+                    games = PgnGames(data, scan_games(data))
+                    jobs = pgn_jobs(games)
+
+                if pool is not None:
+                    chunks = pool.imap(parse_chunk, jobs)
+                else:
+                    chunks = (parse_chunk(job) for job in jobs)
+
+                # use transaction to avoid autocommit slowness
+                trans = self.conn.begin()
+                try:
+                    done = 0
+                    for rows in chunks:
+                        for names, row in rows:
+                            self.add_game(pgnfile, names, row)
+                        done = min(done + GAMES_CHUNK, len(games))
+                        if len(self.game_data) >= CHUNK:
+                            self.flush()
+                            progress(pgnfile, done, len(games))
+
+                    self.flush()
+                    progress(pgnfile, len(games), len(games))
+                    trans.commit()
+
+                except ProgrammingError as e:
+                    trans.rollback()
+                    print("Importing %s failed! %s" % (pgnfile, e))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if zf is not None:
+                zf.close()
 
     def import_FIDE_players(self):
         #print 'drop index'
@@ -417,14 +462,16 @@ if __name__ == "__main__":
     from .timer import Timer
     if len(sys.argv) > 1:
         arg = sys.argv[1]
+        # The number of processes parsing the games
+        processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
         with Timer() as t:
             if arg[-4:].lower() in (".pgn", ".zip"):
                 if os.path.isfile(arg):
-                    imp.do_import(arg)
+                    imp.do_import(arg, processes)
             elif os.path.exists(arg):
                 for file in sorted(os.listdir(arg)):
                     if file[-4:].lower() in (".pgn", ".zip"):
-                        imp.do_import(os.path.join(arg, file))
+                        imp.do_import(os.path.join(arg, file), processes)
         print("Elapsed time (secs): %s" % t.elapsed_secs)
     else:
         path = os.path.abspath(os.path.dirname(__file__))
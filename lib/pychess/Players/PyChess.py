@@ -17,9 +17,9 @@ from pychess.compat import PY2
 from pychess.Utils import const
 from pychess.Utils.book import getOpenings
 from pychess.Utils.const import *
-from pychess.Utils.lutils import lsearch
+from pychess.Utils.lutils import lsearch, lsmp
 from pychess.Utils.lutils.ldata import MAXPLY
-from pychess.Utils.lutils.lsearch import alphaBeta
+from pychess.Utils.lutils.lsearch import alphaBeta, getPV
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.lmove import listToSan, toSAN
 from pychess.System.Log import log
@@ -36,7 +36,9 @@ class PyChess (object):
         self.searchtime = 0
         self.scr = 0 # The current predicted score. Used when accepting draw offers
         self.playingAs = WHITE
-        self.ponder = False # Currently unused
+        self.ponder = False # Think on the opponents time
+        self.pondering = False # A search without time limit is running
+        self.expectedMove = None # The reply we expect to our last move
         self.post = False
         self.debug = True
         self.outOfBook = False
@@ -82,67 +84,97 @@ class PyChess (object):
             self.outOfBook = True
         return choice
     
-    def __go (self, ondone=None):
-        """ Finds and prints the best move from the current position """
+    def __startClock (self):
+        """ Plans the time to use for the move, and starts the clock """
         
-        mv = False if self.outOfBook else self.__getBestOpening()
+        if self.searchtime > 0:
+            usetime = self.searchtime
+        else:
+            usetime = self.clock[self.playingAs] / self.__remainingMovesA()
+            if self.clock[self.playingAs] > 10:
+                # If we have time, we assume 40 moves rather than 80
+                usetime *= 2
+            # The increment is a constant. We'll use this always
+            usetime += self.increment[self.playingAs]
+        
+        timed = self.basetime > 0
+        self.usetime = usetime
+        self.starttime = time()
+        lsearch.endtime = self.starttime + usetime if timed else sys.maxsize
+        if self.debug:
+            if timed:
+                self.print("# Time left: %3.2f s; Planing to think for %3.2f s" % (self.clock[self.playingAs], usetime))
+            else:
+                self.print("# Searching to depth %d without timelimit" % self.sd)
+    
+    def __ponderhit (self):
+        """ The opponent played the move we are pondering on. The ponder search
+            gets a time limit, and so becomes the search for our next move """
+        
+        self.__startClock()
+        self.pondering = False
+    
+    def __go (self, ondone=None, board=None):
+        """ Finds and prints the best move from the current position. If board
+            is given, we ponder: board is the position after the expected
+            reply, and it is searched without time limit until __ponderhit """
+        
+        pondering = board is not None
+        if not pondering:
+            board = self.board
+        
+        mv = False if self.outOfBook or pondering else self.__getBestOpening()
         if mv:
             mvs = [mv]
         
         if not mv:
                
             lsearch.skipPruneChance = self.skipPruneChance
-            lsearch.searching = True
-            
-            timed = self.basetime > 0
+            # When pondering, the caller sets up searching, lsearch.endtime
+            # and self.pondering, as the search may be stopped or hit before
+            # this thread gets going
+            if not pondering:
+                lsearch.searching = True
+                self.__startClock()
             
-            if self.searchtime > 0:
-                usetime = self.searchtime
-            else:
-                usetime = self.clock[self.playingAs] / self.__remainingMovesA()
-                if self.clock[self.playingAs] > 10:
-                    # If we have time, we assume 40 moves rather than 80
-                    usetime *= 2
-                # The increment is a constant. We'll use this always
-                usetime += self.increment[self.playingAs]
-
             prevtime = 0
-            starttime = time()
-            lsearch.endtime = starttime + usetime if timed else sys.maxsize
-            if self.debug:
-                if timed:
-                    self.print("# Time left: %3.2f s; Planing to think for %3.2f s" % (self.clock[self.playingAs], usetime))
-                else:
-                    self.print("# Searching to depth %d without timelimit" % self.sd)
-
+            searchstart = time()
+            
             for depth in range(1, self.sd+1):
                 # Heuristic time saving
                 # Don't waste time, if the estimated isn't enough to complete next depth
-                if timed and usetime <= prevtime*4 and usetime > 1:
+                timed = self.basetime > 0 and not self.pondering
+                if timed and self.usetime <= prevtime*4 and self.usetime > 1:
                     break
                 lsearch.timecheck_counter = lsearch.TIMECHECK_FREQ
-                search_result = alphaBeta(self.board, depth)
+                lsmp.startHelpers(board, depth)
+                scr = alphaBeta(board, depth)
+                lsmp.stopHelpers()
                 if lsearch.searching:
-                    mvs, self.scr = search_result
+                    mvs, self.scr = getPV(), scr
                     if time() > lsearch.endtime:
                         break
                     if self.post:
-                        pv = " ".join(listToSan(self.board, mvs))
-                        time_cs = int(100 * (time()-starttime))
-                        self.print("%s %s %s %s %s" % (depth, self.scr, time_cs, lsearch.nodes, pv))
+                        pv = " ".join(listToSan(board, mvs))
+                        time_cs = int(100 * (time()-searchstart))
+                        nodes = lsearch.nodes + lsmp.getHelperNodes()
+                        self.print("%s %s %s %s %s" % (depth, self.scr, time_cs, nodes, pv))
+                        self.print("# hashfull %d" % lsearch.table.hashfull())
                 else:
                     # We were interrupted
                     if depth == 1:
-                        mvs, self.scr = search_result
+                        mvs, self.scr = getPV(), scr
                     break
-                prevtime = time()-starttime - prevtime
+                prevtime = time()-searchstart - prevtime
                 
-                self.clock[self.playingAs] -= time() - starttime - self.increment[self.playingAs]
+                if not self.pondering:
+                    self.clock[self.playingAs] -= time() - self.starttime - self.increment[self.playingAs]
             
             if not mvs:
-                if not lsearch.searching:
-                    # We were interupted
-                    lsearch.nodes = 0
+                if not lsearch.searching or self.pondering:
+                    # We were interupted, or the expected reply ends the game
+                    lsearch.resetNodes()
+                    lsmp.resetHelperNodes()
                     return
                 
                 # This should only happen in terminal mode
@@ -150,20 +182,22 @@ class PyChess (object):
                 if self.scr == 0:
                     self.print("result %s" % reprResult[DRAW])
                 elif self.scr < 0:
-                    if self.board.color == WHITE:
+                    if board.color == WHITE:
                         self.print("result %s" % reprResult[BLACKWON])
                     else: self.print("result %s" % reprResult[WHITEWON])
                 else:
-                    if self.board.color == WHITE:
+                    if board.color == WHITE:
                         self.print("result %s" % reprResult[WHITEWON])
                     else: self.print("result %s" % reprResult[BLACKWON])
                 return
             
-            lsearch.nodes = 0
+            lsearch.resetNodes()
+            lsmp.resetHelperNodes()
             lsearch.searching = False
         
         move = mvs[0]
-        sanmove = toSAN(self.board, move)
+        sanmove = toSAN(board, move)
+        self.expectedMove = mvs[1] if len(mvs) > 1 else None
         if ondone: ondone(sanmove)
         return sanmove
     
@@ -180,13 +214,18 @@ class PyChess (object):
                 break
             t = time()
             board = self.board.clone()
-            mvs, scr = alphaBeta (board, depth)
+            lsmp.startHelpers(board, depth)
+            scr = alphaBeta (board, depth)
+            lsmp.stopHelpers()
             
-            pv = " ".join(listToSan(board, mvs))
+            pv = " ".join(listToSan(board, getPV()))
             time_cs = int(100 * (time() - start))
-            self.print("%s %s %s %s %s" % (depth, scr, time_cs, lsearch.nodes, pv))
+            nodes = lsearch.nodes + lsmp.getHelperNodes()
+            self.print("%s %s %s %s %s" % (depth, scr, time_cs, nodes, pv))
+            self.print("# hashfull %d" % lsearch.table.hashfull())
             
-            lsearch.nodes = 0
+            lsearch.resetNodes()
+            lsmp.resetHelperNodes()
 
 ################################################################################
 # main                                                                         #
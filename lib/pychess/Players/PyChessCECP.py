@@ -4,7 +4,7 @@ import re
 import readline
 import signal
 import sys
-from threading import Thread
+from threading import Lock, Thread
 
 import pychess
 from pychess.compat import raw_input
@@ -16,7 +16,7 @@ from pychess.Utils.lutils.Benchmark import benchmark
 from pychess.Utils.lutils.perft import perft
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.ldata import MAXPLY
-from pychess.Utils.lutils import lsearch, leval
+from pychess.Utils.lutils import lsearch, leval, lsmp
 from pychess.Utils.lutils.lmove import parseSAN, parseAny, toSAN, ParsingError
 from pychess.Utils.lutils import lsearch
 from pychess.Utils.lutils.lmovegen import genAllMoves, genCaptures, genCheckEvasions
@@ -35,9 +35,16 @@ class PyChessCECP(PyChess):
         self.forced = False
         self.analyzing = False
         self.thread = None
+        # Guards the handover of a ponder search, which ends by itself
+        self.ponderLock = Lock()
+        self.ponderMove = None
+        self.ponderResult = None
 
         self.basetime = 0
         
+        # Transposition table size in megabytes, until set by "memory"
+        lsearch.setHashSize(conf.get("hash_size", lsearch.HASH_SIZE))
+        
         self.features = {
             "ping": 1,
             "setboard": 1,
@@ -59,8 +66,8 @@ class PyChessCECP(PyChess):
             "pause": 0, # Unimplemented
             "nps": 0, # Unimplemented
             "debug": 1,
-            "memory": 0, # Unimplemented
-            "smp": 0, # Unimplemented
+            "memory": 1,
+            "smp": 1,
             "egt": "gaviota",
             "option": "skipPruneChance -slider 0 0 100"
         }
@@ -134,7 +141,6 @@ class PyChessCECP(PyChess):
                             self.board.variant = SUICIDECHESS
                         elif lines[1] == "atomic":
                             self.board.variant = ATOMICCHESS
-                            self.board.iniAtomic()
                         elif lines[1] == "3check":
                             self.board.variant = THREECHECKCHESS
                         elif lines[1] == "kingofthehill":
@@ -177,14 +183,15 @@ class PyChessCECP(PyChess):
                         self.__stopSearching()
                 
                 elif lines[0] == "go":
+                    self.__stopPondering()
                     self.playingAs = self.board.color
                     self.forced = False
                     self.__go()
                 
                 elif lines[0] == "playother":
+                    self.__stopPondering()
                     self.playingAs = 1-self.board.color
                     self.forced = False
-                    # TODO: start pondering, if possible
                 
                 elif lines[0] in ("black", "white"):
                     newColor = lines[0] == "black" and BLACK or WHITE
@@ -224,7 +231,10 @@ class PyChessCECP(PyChess):
                     self.clock[1-self.playingAs] = float(lines[1])/100.
                 
                 elif lines[0] == "usermove":
-                    self.__stopSearching()
+                    # A ponder search doesn't touch self.board, so it can
+                    # run on, until we know if the move is the expected one
+                    if not self.pondering:
+                        self.__stopSearching()
                     try:
                         move = parseAny (self.board, lines[1])
                     except ParsingError as e:
@@ -235,16 +245,13 @@ class PyChessCECP(PyChess):
                         self.print("Illegal move: %s" % lines[1])
                         self.print(self.board)
                         continue
-                    self.board.applyMove(move)
-                    self.playingAs = self.board.color
-                    if not self.forced and not self.analyzing:
-                        self.__go()
-                    if self.analyzing:
-                        self.__analyze()
+                    self.__usermove(move)
                 
                 elif lines[0] == "?":
-                    if not self.forced and not self.analyzing:
-                        self.__stopSearching()
+                    if not self.forced and not self.analyzing and not self.pondering:
+                        # The search thread plays the move, and may go on
+                        # to ponder
+                        lsearch.searching = False
                 
                 elif lines[0] == "ping":
                     self.print("pong %s" % lines[1])
@@ -255,7 +262,7 @@ class PyChessCECP(PyChess):
                 
                 elif lines[0] == "result":
                     # We don't really care what the result is at the moment.
-                    pass
+                    self.__stopPondering()
                     
                 elif lines[0] == "setboard":
                     self.__stopSearching()
@@ -269,7 +276,9 @@ class PyChessCECP(PyChess):
                 # "edit" is unimplemented. See docs. Exiting edit mode returns to analyze mode.
      
                 elif lines[0] == "hint":
-                    pass # TODO: Respond "Hint: MOVE" if we have an expected reply
+                    move = self.expectedMove
+                    if move is not None and validateMove(self.board, move, legal=True):
+                        self.print("Hint: %s" % toSAN(self.board, move))
                 
                 elif lines[0] == "bk":
                     entries = getOpenings(self.board)
@@ -293,11 +302,14 @@ class PyChessCECP(PyChess):
                 
                 elif lines[0] in ("hard", "easy"):
                     self.ponder = (lines[0] == "hard")
+                    if not self.ponder:
+                        self.__stopPondering()
                 
                 elif lines[0] in ("post", "nopost"):
                     self.post = (lines[0] == "post")
                 
                 elif lines[0] == "analyze":
+                    self.__stopPondering()
                     self.analyzing = True
                     self.__analyze()
      
@@ -309,18 +321,24 @@ class PyChessCECP(PyChess):
                 elif lines[0] == "memory":
                     # FIXME: this is supposed to control the *total* memory use.
                     if lsearch.searching:
-                        self.print("Error (already searching):", line)
+                        self.print("Error (already searching): %s" % line)
                     else:
                         limit = int(lines[1])
                         if limit < 1:
-                            self.print("Error (limit too low):", line)
+                            self.print("Error (limit too low): %s" % line)
                         else:
-                            pass
-                            # TODO implement
-                            #lsearch.setHashSize(limit)
+                            lsearch.setHashSize(limit)
+                            lsmp.setCores(lsmp.getCores())
      
                 elif lines[0] == "cores":
-                    pass # We aren't SMP-capable.
+                    if lsearch.searching:
+                        self.print("Error (already searching): %s" % line)
+                    else:
+                        cores = int(lines[1])
+                        if cores < 1:
+                            self.print("Error (too few cores): %s" % line)
+                        else:
+                            lsmp.setCores(cores)
      
                 elif lines[0] == "egtpath":
                     if len(lines) >= 3 and lines[1] == "gaviota":
@@ -371,6 +389,25 @@ class PyChessCECP(PyChess):
                     else:
                         self.print("Usage: profile outputfilename")
 
+                elif lines[0] == "stats":
+                    # Usage: stats [on|off|reset]
+                    if len(lines) > 1:
+                        if lsearch.searching:
+                            self.print("Error (already searching): %s" % line)
+                        elif lines[1] in ("on", "off"):
+                            lsearch.enableStats(lines[1] == "on")
+                        elif lines[1] == "reset":
+                            lsearch.resetStats()
+                        else:
+                            self.print("Error (unknown argument): %s" % line)
+                    else:
+                        stats = lsearch.getStats()
+                        if stats is None:
+                            self.print("# Search statistics are off. Use: stats on")
+                        else:
+                            for key in sorted(stats):
+                                self.print("# %s %s" % (key, stats[key]))
+
                 elif lines[0] == "perft":
                     root = "0" if len(lines) < 3 else lines[2]
                     depth = "1" if len(lines) == 1 else lines[1]
@@ -390,13 +427,7 @@ class PyChessCECP(PyChess):
                         self.print("Illegal move: %s" % lines[0])
                         self.print(self.board)
                         continue
-                    self.__stopSearching()
-                    self.board.applyMove(move)
-                    self.playingAs = self.board.color
-                    if not self.forced and not self.analyzing:
-                        self.__go()
-                    if self.analyzing:
-                        self.__analyze()
+                    self.__usermove(move)
 
                 else:
                     self.print("Error (unknown command): %s" % line)
@@ -404,19 +435,80 @@ class PyChessCECP(PyChess):
                 self.print("Error (missing argument): %s" % line)
     
     def __stopSearching(self):
-        lsearch.searching = False
-        if self.thread:
-            self.thread.join()
+        # A search, which is done, may have started pondering meanwhile
+        while True:
+            thread = self.thread
+            lsearch.searching = False
+            if thread:
+                thread.join()
+            if self.thread is thread:
+                break
+        if self.pondering:
+            # The ponder search was in vain
+            self.pondering = False
+            self.expectedMove = None
+    
+    def __stopPondering(self):
+        if self.pondering:
+            self.__stopSearching()
+    
+    def __usermove (self, move):
+        if self.pondering and move == self.ponderMove:
+            # Ponder hit. The search goes on, now on our own clock
+            self.board.applyMove(move)
+            self.playingAs = self.board.color
+            with self.ponderLock:
+                PyChess._PyChess__ponderhit(self)
+                result = self.ponderResult
+            if result is not None:
+                # The ponder search had finished already
+                self.__ondone(result)
+            return
+        
+        self.__stopSearching()
+        self.board.applyMove(move)
+        self.playingAs = self.board.color
+        if not self.forced and not self.analyzing:
+            self.__go()
+        if self.analyzing:
+            self.__analyze()
+    
+    def __ondone (self, result):
+        with self.ponderLock:
+            if self.pondering:
+                # Keep the move, until we know if the opponent plays the
+                # expected reply
+                self.ponderResult = result
+                return
+        if not self.forced:
+            self.board.applyMove(parseSAN(self.board,result))
+            self.print("move %s" % result)
+            if self.ponder:
+                self.__ponder()
     
     def __go (self):
-        def ondone (result):
-            if not self.forced:
-                self.board.applyMove(parseSAN(self.board,result))
-                self.print("move %s" % result)
-            # TODO: start pondering, if enabled
         self.thread = Thread(target=PyChess._PyChess__go,
                              name=fident(PyChess._PyChess__go),
-                             args=(self,ondone))
+                             args=(self,self.__ondone))
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def __ponder (self):
+        """ Searches the position after the expected reply on the opponents
+            time. The transposition table stays warm either way. """
+        move = self.expectedMove
+        if move is None or not validateMove(self.board, move, legal=True):
+            return
+        board = self.board.clone()
+        board.applyMove(move)
+        self.ponderMove = move
+        self.ponderResult = None
+        self.pondering = True
+        lsearch.searching = True
+        lsearch.endtime = sys.maxsize
+        self.thread = Thread(target=PyChess._PyChess__go,
+                             name=fident(PyChess._PyChess__go),
+                             args=(self,self.__ondone,board))
         self.thread.daemon = True
         self.thread.start()
     
@@ -2,8 +2,18 @@
 
 from __future__ import print_function
 
+import os
 import re
-
+import sys
+import mmap
+import zlib
+import tempfile
+from array import array
+from struct import Struct
+from collections import OrderedDict
+
+from pychess.compat import basestring
+from pychess.System.protoopen import PGN_ENCODING
 from pychess.Utils.const import *
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.lmove import parseSAN, ParsingError
@@ -34,11 +44,14 @@ pattern = re.compile(r"""
     """, re.VERBOSE | re.DOTALL)
 
 
+# The number of games PgnBase keeps the tags of
+TAGCACHE_SIZE = 4096
+
 class PgnBase(ChessFile):
 
     def __init__ (self, games):
         ChessFile.__init__(self, games)
-        self.tagcache = {}
+        self.tagcache = OrderedDict()
 
     def parse_string(self, string, board, position, variation=False):
         """Recursive parses a movelist part of one game.
@@ -89,26 +102,10 @@ class PgnBase(ChessFile):
                     mstr = m.group(MOVE)
                     try:
                         lmove = parseSAN(last_board, mstr)
-                    except ParsingError as e:
+                    except Exception as e:
                         # TODO: save the rest as comment
                         # last_board.children.append(string[m.start():])
-                        notation, reason, boardfen = e.args
-                        ply = last_board.plyCount
-                        if ply % 2 == 0:
-                            moveno = "%d." % (ply//2+1)
-                        else: moveno = "%d..." % (ply//2+1)
-                        errstr1 = _("The game can't be read to end, because of an error parsing move %(moveno)s '%(notation)s'.") % {
-                                    'moveno': moveno, 'notation': notation}
-                        errstr2 = _("The move failed because %s.") % reason
-                        self.error = LoadingError (errstr1, errstr2)
-                        break
-                    except:
-                        ply = last_board.plyCount
-                        if ply % 2 == 0:
-                            moveno = "%d." % (ply//2+1)
-                        else: moveno = "%d..." % (ply//2+1)
-                        errstr1 = _( "Error parsing move %(moveno)s %(mstr)s") % {"moveno": moveno, "mstr": mstr}
-                        self.error = LoadingError (errstr1, "")
+                        self.error = self._move_error(last_board, mstr, e)
                         break
                     
                     new_board = last_board.clone()
@@ -156,18 +153,76 @@ class PgnBase(ChessFile):
 
         return boards #, status
 
+    def parse_mainline(self, string, board, position=-1):
+        """Parses the mainline moves of a movelist, for bulk use.
+        
+           The moves are made on board itself, and variations, comments
+           and nags are skipped, so no board is made per move.
+        
+           Arguments:
+           string - str (movelist)
+           board - lboard (initial position, left at the last move parsed)
+           position - int (maximum ply to parse)
+           Returns an array("H") of the moves"""
+
+        moves = array("H")
+        parenthesis = 0
+        for m in pattern.finditer(string):
+            group = m.lastindex
+            if group == VARIATION_START:
+                parenthesis += 1
+            elif group == VARIATION_END:
+                parenthesis -= 1
+            elif parenthesis:
+                continue
+            elif group == FULL_MOVE:
+                if position != -1 and board.plyCount >= position:
+                    break
+                mstr = m.group(MOVE)
+                try:
+                    lmove = parseSAN(board, mstr)
+                except Exception as e:
+                    self.error = self._move_error(board, mstr, e)
+                    break
+                board.applyMove(lmove)
+                moves.append(lmove)
+            elif group == RESULT:
+                break
+        return moves
+
+    def _move_error(self, board, mstr, e):
+        """ The LoadingError of the move mstr, which failed with e """
+        ply = board.plyCount
+        if ply % 2 == 0:
+            moveno = "%d." % (ply//2+1)
+        else: moveno = "%d..." % (ply//2+1)
+        if isinstance(e, ParsingError):
+            notation, reason, boardfen = e.args
+            errstr1 = _("The game can't be read to end, because of an error parsing move %(moveno)s '%(notation)s'.") % {
+                        'moveno': moveno, 'notation': notation}
+            errstr2 = _("The move failed because %s.") % reason
+            return LoadingError (errstr1, errstr2)
+        errstr1 = _( "Error parsing move %(moveno)s %(mstr)s") % {"moveno": moveno, "mstr": mstr}
+        return LoadingError (errstr1, "")
+
     def _getTag (self, gameno, tagkey):
-        if gameno in self.tagcache:
-            if tagkey in self.tagcache[gameno]:
-                return self.tagcache[gameno][tagkey]
-            else:
+        tags = self.tagcache.get(gameno)
+        if tags is None:
+            if not self.games:
                 return ""
-        else:
-            if self.games:
-                self.tagcache[gameno] = dict(tagre.findall(self.games[gameno][0]))
-                return self._getTag(gameno, tagkey)
+            if tagkey in ROSTER and isinstance(self.games, PgnGames) and \
+                    self.games.rosterOffsets is not None:
+                # Without splitting the game out, for long game lists
+                return self.games.roster(gameno).get(tagkey, "")
+            if isinstance(self.games, PgnGames):
+                tags = self.games.tags(gameno)
             else:
-                return ""
+                tags = dict(tagre.findall(self.games[gameno][0]))
+            self.tagcache[gameno] = tags
+            # The tags of the last TAGCACHE_SIZE games read are kept
+            if len(self.tagcache) > TAGCACHE_SIZE:
+                self.tagcache.popitem(last=False)
+        return tags.get(tagkey, "")
 
     def get_movetext(self, no):
         return self.games[no][1]
@@ -240,11 +295,13 @@ class PgnBase(ChessFile):
 
 tagre = re.compile(r"\[([a-zA-Z]+)[ \t]+['\"](.*?)['\"]\]")
 
-def pgn_load(file, klass=PgnBase):
+def split_games(lines):
+    """ Splits the lines of a PGN file into a [tags, movetext] list per
+        game """
     files = []
     inTags = False
 
-    for line in file:
+    for line in lines:
         line = line.lstrip()
         if not line: continue
         elif line.startswith("%"): continue
@@ -257,6 +314,8 @@ def pgn_load(file, klass=PgnBase):
                 files[-1][0] += line
             else:
                 if not inTags:
+                    if not files:
+                        files.append(["",""])
                     files[-1][1] += line
                 else:
                     print("Warning: ignored invalid tag pair %s" % line)
@@ -268,7 +327,369 @@ def pgn_load(file, klass=PgnBase):
                 files.append(["",""])
             files[-1][1] += line
                 
-    return klass(files)
+    return files
+
+
+# The tag pair lines of split_games, in the bytes of a file, with the first
+# one of a game found by firsttag and the following ones by tagline, and the
+# lines it takes for movetext, or for a game without tags before the first
+# game. headerline finds the tag pair lines in the header of a game, and
+# rawtagre the tags in them, like tagre. Lines may end with "\r" too, as in
+# files opened with universal newlines, but as that makes finding tag lines
+# twice as slow, crtagline is used instead of tagline only in files with
+# lines ending in a "\r" alone, found by lonecr.
+firsttag = re.compile(br"[ \t\r\f\v]*(\[[a-zA-Z]+[ \t]+['\"][^\r\n]*?['\"]\])")
+tagline = re.compile(br"\n[ \t\f\v]*(\[[a-zA-Z]+[ \t]+['\"][^\r\n]*?['\"]\])")
+crtagline = re.compile(br"[\r\n][ \t\f\v]*(\[[a-zA-Z]+[ \t]+['\"][^\r\n]*?['\"]\])")
+lonecr = re.compile(br"\r(?!\n)")
+movetextline = re.compile(br"(?:^|(?<=\r))[ \t\f\v]*[^\s%\[]", re.M)
+contentline = re.compile(br"(?:^|(?<=\r))[ \t\f\v]*[^\s%]", re.M)
+headerline = re.compile(br"(?:^|(?<=\r))[ \t\f\v]*(\[[a-zA-Z]+[ \t]+['\"][^\r\n]*?['\"]\][^\r\n]*)", re.M)
+rawtagre = re.compile(br"\[([a-zA-Z]+)[ \t]+['\"](.*?)['\"]\]")
+
+# Byte offsets are kept in an array of 64 bit items, or of doubles where
+# longs are 32 bits
+OFFSET_TYPE = "L" if array("L").itemsize >= 8 else "d"
+
+def scan_games(data, start=0, offsets=None):
+    """ Returns an array of the byte offsets at which the games of the PGN
+        data (bytes or a mmap) start, as split_games would split them. With
+        offsets and start, the offset of a game, the offsets of the games
+        from start on are appended to them. """
+    if offsets is None:
+        offsets = array(OFFSET_TYPE)
+    pos = start
+    inTags = False
+    
+    match = firsttag.match(data, start)
+    if match is not None:
+        offsets.append(match.start(1))
+        inTags = True
+        pos = match.end()
+    
+    lines = crtagline if lonecr.search(data, start) else tagline
+    for match in lines.finditer(data, pos):
+        if not inTags or movetextline.search(data, pos, match.start()):
+            if not offsets and contentline.search(data, pos, match.start()):
+                # Movetext without tags before the first game
+                offsets.append(start)
+            offsets.append(match.start(1))
+        inTags = True
+        pos = match.end()
+    if not offsets and contentline.search(data, pos):
+        offsets.append(start)
+    return offsets
+
+class PgnGames(object):
+    """ The games of a memory-mapped PGN file, as a sequence of [tags,
+        movetext] like split_games returns. Only the byte offsets of the
+        games are kept, and a game is split out of the file when asked for.
+        
+        The Seven Tag Roster of the games can be kept too, as rosterData,
+        the utf-8 bytes of the ROSTER fields of each game separated by "\0",
+        and rosterOffsets, where the fields of game i are found. """
+
+    def __init__ (self, data, offsets, encoding=PGN_ENCODING,
+                  rosterOffsets=None, rosterData=b""):
+        self.data = data
+        self.offsets = offsets
+        self.encoding = encoding
+        self.rosterOffsets = rosterOffsets
+        self.rosterData = rosterData
+        self._roster = (None, None)
+        self.source = None
+
+    def watch (self, path, stat):
+        """ Makes reading the games raise a LoadingError, once the file at
+            path, which data is a memory map of, no longer has the size and
+            mtime of its os.stat stat. Reading the pages of a map past the
+            end of a truncated file would crash the process. """
+        self.source = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+    def _check (self):
+        path, size, mtime = self.source
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is None or stat.st_size != size or stat.st_mtime != mtime:
+            raise LoadingError(_("The game can't be loaded, because the file was changed since it was opened"), path)
+
+    def __len__ (self):
+        return len(self.offsets)
+
+    def __iter__ (self):
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+    def __getitem__ (self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.offsets)))]
+        return self._split(*self._bounds(index))
+
+    def _bounds (self, index):
+        if self.source is not None:
+            self._check()
+        if index < 0:
+            index += len(self.offsets)
+        if not 0 <= index < len(self.offsets):
+            raise IndexError("game index out of range")
+        start = int(self.offsets[index])
+        if index+1 < len(self.offsets):
+            end = int(self.offsets[index+1])
+        else:
+            end = len(self.data)
+        return start, end
+
+    def _split (self, start, end):
+        text = self.data[start:end].decode(self.encoding, "replace")
+        # Like files opened with universal newlines
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        games = split_games(text.splitlines(True))
+        return games[0] if games else ["",""]
+
+    def rawtags (self, index):
+        """ A dict of the tags of game index, as bytes, read straight from
+            the file without its movetext """
+        start, end = self._bounds(index)
+        match = movetextline.search(self.data, start, end)
+        # The tag pair lines, as split_games keeps them
+        lines = headerline.findall(self.data[start:match.start() if match else end])
+        return dict(rawtagre.findall(b"\n".join(lines)))
+
+    def tags (self, index):
+        """ A dict of the tags of game index, read without its movetext """
+        return dict((key.decode("ascii"), value.decode(self.encoding, "replace"))
+                    for key, value in self.rawtags(index).items())
+
+    def roster (self, index):
+        """ A dict of the ROSTER tags of game index, from rosterData """
+        if index < 0:
+            index += len(self.offsets)
+        # The tags of a game are asked for one by one
+        if self._roster[0] != index:
+            fields = self.rosterData[int(self.rosterOffsets[index]):
+                                     int(self.rosterOffsets[index+1])]
+            self._roster = (index, dict(zip(ROSTER, fields.decode("utf-8").split("\0"))))
+        return self._roster[1]
+
+    def scan_roster (self):
+        """ Reads the ROSTER tags of the games not in rosterData yet """
+        if self.rosterOffsets is None:
+            self.rosterOffsets = array(OFFSET_TYPE, [0])
+            self.rosterData = b""
+        end = self.rosterOffsets[-1]
+        fields = []
+        for i in range(len(self.rosterOffsets)-1, len(self.offsets)):
+            tags = self.tags(i)
+            field = "\0".join(tags.get(tag, "").replace("\0", "")
+                               for tag in ROSTER).encode("utf-8")
+            fields.append(field)
+            end += len(field)
+            self.rosterOffsets.append(end)
+        self.rosterData += b"".join(fields)
+
+# The tags of the Seven Tag Roster, kept in the index of a PGN file
+ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+# Files of at least INDEX_MIN_SIZE bytes get an index, file.pgn.pidx, of their
+# game offsets and rosters, which is reused while the file is unchanged, and
+# brought up to date when games were only appended to the file.
+INDEX_SUFFIX = ".pidx"
+# Files of at least MAP_MIN_SIZE bytes are read through a memory map, smaller
+# ones are copied into memory
+MAP_MIN_SIZE = 16 << 20
+INDEX_MIN_SIZE = 1 << 20
+INDEX_VERSION = 2
+# The index is followed by the encoding, the game offsets, the roster offsets
+# and the roster data. Its fields are: magic, version, offset typecode and
+# byte order, file size, file mtime, _edge_crc of the file, game count,
+# roster data size, encoding size.
+indexstruct = Struct("<4sH2sQdIQQH")
+INDEX_MAGIC = b"PIDX"
+INDEX_EDGE = 4096
+INDEX_LAYOUT = (OFFSET_TYPE + ("<" if sys.byteorder == "little" else ">")).encode("ascii")
+
+def _edge_crc (data, size):
+    """ The crc32 of the first and last INDEX_EDGE bytes of the first size
+        bytes of data, by which appending to a file is told from changing it """
+    crc = zlib.crc32(data[:min(size, INDEX_EDGE)])
+    return zlib.crc32(data[max(INDEX_EDGE, size-INDEX_EDGE):size], crc) & 0xffffffff
+
+def read_index (path, data, mtime, encoding=PGN_ENCODING):
+    """ The PgnGames of data, the mapped file of the index at path, and
+        whether the index was up to date. The games appended to the file
+        since the index was written are scanned. Returns None, None if
+        there is no index for the file. """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(indexstruct.size)
+            if len(header) < indexstruct.size:
+                return None, None
+            magic, version, layout, size, imtime, crc, count, rostersize, \
+                encodingsize = indexstruct.unpack(header)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION or \
+                    layout != INDEX_LAYOUT or size > len(data) or \
+                    f.read(encodingsize) != encoding.encode("ascii", "replace"):
+                return None, None
+            offsets = array(OFFSET_TYPE)
+            offsets.fromfile(f, count)
+            rosterOffsets = array(OFFSET_TYPE)
+            rosterOffsets.fromfile(f, count+1)
+            rosterData = f.read(rostersize)
+            if len(rosterData) != rostersize:
+                return None, None
+    except (IOError, OSError, EOFError):
+        return None, None
+
+    if size == len(data) and imtime == mtime:
+        return PgnGames(data, offsets, encoding, rosterOffsets, rosterData), True
+    if size == len(data) or _edge_crc(data, size) != crc:
+        return None, None
+
+    # The last game may have been continued, so it is scanned again
+    start = 0
+    if offsets:
+        start = int(offsets.pop())
+        rosterOffsets.pop()
+        rosterData = rosterData[:int(rosterOffsets[-1])]
+    games = PgnGames(data, scan_games(data, start, offsets), encoding,
+                     rosterOffsets, rosterData)
+    games.scan_roster()
+    return games, False
+
+def write_index (path, games, mtime):
+    """ Writes the index of games, with their roster, to path. Returns
+        whether it could be written. The index is written to a temporary
+        file next to path, and renamed to it when complete, so a partial
+        index is never left at path. """
+    encoding = games.encoding.encode("ascii", "replace")
+    header = indexstruct.pack(INDEX_MAGIC, INDEX_VERSION, INDEX_LAYOUT,
+                              len(games.data), mtime,
+                              _edge_crc(games.data, len(games.data)),
+                              len(games.offsets), len(games.rosterData),
+                              len(encoding))
+    try:
+        fd, temp = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                    dir=os.path.dirname(path) or ".")
+    except (IOError, OSError):
+        return False
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(encoding)
+            games.offsets.tofile(f)
+            games.rosterOffsets.tofile(f)
+            f.write(games.rosterData)
+        try:
+            os.rename(temp, path)
+        except OSError:
+            # Windows doesn't rename over an existing file
+            os.remove(path)
+            os.rename(temp, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        return False
+    return True
+
+def map_games(file, index=True):
+    """ PgnGames of the file, or None if it isn't a file that can be mapped.
+        If index is True, files of INDEX_MIN_SIZE bytes or more are indexed.
+        Files of MAP_MIN_SIZE bytes or more stay mapped, see PgnGames.watch,
+        smaller ones and files without a path are copied into memory. """
+    try:
+        fileno = file.fileno()
+        stat = os.fstat(fileno)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    encoding = getattr(file, "encoding", None) or PGN_ENCODING
+    if not stat.st_size:
+        # Empty files can't be mapped
+        return PgnGames(b"", array(OFFSET_TYPE), encoding)
+    data = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    path = getattr(file, "name", None)
+    if not isinstance(path, basestring):
+        path = None
+    mapped = path is not None and stat.st_size >= MAP_MIN_SIZE
+    if not mapped:
+        data, mapping = data[:], data
+        mapping.close()
+
+    if not index or stat.st_size < INDEX_MIN_SIZE or path is None:
+        games = PgnGames(data, scan_games(data), encoding)
+    else:
+        games, current = read_index(path + INDEX_SUFFIX, data, stat.st_mtime, encoding)
+        if games is None:
+            games = PgnGames(data, scan_games(data), encoding)
+            games.scan_roster()
+        if not current:
+            write_index(path + INDEX_SUFFIX, games, stat.st_mtime)
+    if mapped:
+        games.watch(path, stat)
+    return games
+
+# Tags of numbers, which scan_tags gives as array('i') columns
+INT_TAGS = ("WhiteElo", "BlackElo", "PlyCount")
+
+def scan_tags (games, tags, start=0, stop=None):
+    """ A dict of a column per tag in tags, of the tags of games[start:stop].
+        The columns of INT_TAGS are array('i'), with 0 for missing numbers,
+        and the others lists of strings, with "" for missing tags.
+        
+        games are the games of a PgnBase. The tags of mapped files are read
+        straight from the bytes of the file, or from its index, and the
+        movetext is skipped. Nothing is cached, so scanning the games in
+        chunks, like iter_scan_tags does, takes bounded memory. """
+
+    start, stop, step = slice(start, stop).indices(len(games))
+    columns = [array("i") if tag in INT_TAGS else [] for tag in tags]
+    pairs = list(zip(tags, columns))
+
+    if isinstance(games, PgnGames):
+        if games.rosterOffsets is not None and all(tag in ROSTER for tag in tags):
+            gettags = games.roster
+        else:
+            rawtags = games.rawtags
+            encoding = games.encoding
+            keys = [(tag, tag.encode("ascii")) for tag in tags]
+            def gettags (index):
+                found = rawtags(index)
+                return dict((tag, found[key].decode(encoding, "replace"))
+                            for tag, key in keys if key in found)
+    else:
+        gettags = lambda index: dict(tagre.findall(games[index][0]))
+
+    for index in range(start, stop):
+        found = gettags(index)
+        for tag, column in pairs:
+            value = found.get(tag, "")
+            if tag in INT_TAGS:
+                value = int(value) if value.isdigit() else 0
+            column.append(value)
+    return dict(zip(tags, columns))
+
+def iter_scan_tags (games, tags, size=4096):
+    """ Yields the columns of scan_tags for chunks of size games """
+    for start in range(0, len(games), size):
+        yield scan_tags(games, tags, start, start+size)
+
+def pgn_load(file, klass=PgnBase):
+    """ Files on disk are mapped into memory, and their games split out on
+        demand. Other files, and lists of lines, are split right away.
+        
+        Files of MAP_MIN_SIZE bytes or more stay mapped for the life of the
+        returned PgnBase. Reading their games raises a LoadingError once the
+        file was changed on disk, and on Windows the file can't be saved
+        over meanwhile. Smaller files are copied into memory, and can be
+        changed freely. """
+    games = map_games(file)
+    if games is None:
+        games = split_games(file)
+    return klass(games)
 
 
 nag2symbolDict = {
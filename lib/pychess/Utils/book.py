@@ -1,7 +1,10 @@
 import os
 import sys
+import mmap
+from bisect import bisect_left
 from struct import Struct
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from threading import RLock
 
 from pychess.Utils.const import *
 from pychess.System import conf
@@ -12,16 +15,9 @@ from pychess.System.Log import log
 
 if getattr(sys, 'frozen', False):
     # pyinstaller specific!
-    path = os.path.join(sys._MEIPASS, "pychess_book.bin")
+    default_path = os.path.join(sys._MEIPASS, "pychess_book.bin")
 else:
     default_path = os.path.join(addDataPrefix("pychess_book.bin"))
-    path = conf.get("opening_file_entry", default_path) 
-
-if os.path.isfile(path):
-    bookfile = True
-else:
-    bookfile= False
-    log.warning("Could not find %s" % path)
 
 # The book probing code is based on that of PolyGlot by Fabien Letouzey.
 # PolyGlot is available under the GNU GPL from http://wbec-ridderkerk.nl
@@ -36,6 +32,106 @@ BookEntry = namedtuple('BookEntry', 'key move weight games score')
 
 entrystruct = Struct(">QHHHH")
 entrysize = entrystruct.size
+keystruct = Struct(">Q")
+
+# The number of positions each book remembers the entries of
+LRU_SIZE = 64
+
+class BookKeys (object):
+    """ The key column of a mapped book, as a sequence for bisect """
+
+    def __init__ (self, data, count):
+        self.data = data
+        self.count = count
+
+    def __len__ (self):
+        return self.count
+
+    def __getitem__ (self, index):
+        return keystruct.unpack_from(self.data, index * entrysize)[0]
+
+class Book (object):
+    """ A Polyglot book, mapped into memory once. The entries of the last
+        LRU_SIZE positions looked up are kept. """
+
+    def __init__ (self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            count = os.fstat(self.file.fileno()).st_size // entrysize
+            # Empty files can't be mapped
+            self.data = count and mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self.file.close()
+            raise
+        self.keys = BookKeys(self.data, count)
+        self.cache = OrderedDict()
+        self.lock = RLock()
+
+    def close (self):
+        with self.lock:
+            if self.data:
+                self.data.close()
+            self.file.close()
+            self.keys = BookKeys(None, 0)
+            self.cache.clear()
+
+    def getEntries (self, key):
+        """ The BookEntries of the position with the hash key """
+
+        with self.lock:
+            if key in self.cache:
+                entries = self.cache.pop(key)
+                self.cache[key] = entries
+                return entries
+
+            entries = []
+            # The first entry whose key is >= the position's hash
+            index = bisect_left(self.keys, key)
+            while index < len(self.keys) and self.keys[index] == key:
+                entries.append(BookEntry._make(
+                    entrystruct.unpack_from(self.data, index * entrysize)))
+                index += 1
+            entries = tuple(entries)
+
+            self.cache[key] = entries
+            if len(self.cache) > LRU_SIZE:
+                self.cache.popitem(last=False)
+            return entries
+
+books = []
+booksLock = RLock()
+# The books used after the one of opening_file_entry
+extraPaths = []
+
+def openBooks (paths=None):
+    """ Replace the books in use by the book of opening_file_entry, followed
+        by the ones at paths, or by the ones of the last call if paths is
+        None. The first book with entries for a position gives its openings.
+        Books which are missing or can't be opened are logged and
+        skipped. """
+
+    global books, extraPaths
+    if paths is not None:
+        extraPaths = list(paths)
+    if getattr(sys, 'frozen', False):
+        mainPath = default_path
+    else:
+        mainPath = conf.get("opening_file_entry", default_path)
+
+    newBooks = []
+    for path in [mainPath] + extraPaths:
+        if not os.path.isfile(path):
+            log.warning("Could not find %s" % path)
+            continue
+        try:
+            newBooks.append(Book(path))
+        except (IOError, OSError, ValueError, mmap.error) as e:
+            log.warning("Could not open %s: %s" % (path, e))
+    with booksLock:
+        oldBooks, books = books, newBooks
+        for book in oldBooks:
+            book.close()
 
 def getOpenings (board):
     """ Return a tuple (move, weight, games, score) for each opening move
@@ -45,37 +141,13 @@ def getOpenings (board):
         scored (with 2 per victory and 1 per draw). However, opening books
         aren't required to keep this information. """
 
-    openings = []
-    if not bookfile:
-        return openings
-    
-    with open(path, "rb") as bookFile:
-        key = board.hash
-        # Find the first entry whose key is >= the position's hash
-        bookFile.seek(0, os.SEEK_END)
-        lo, hi = 0, bookFile.tell() // 16 - 1
-        if hi < 0:
-            return openings
-        while lo < hi:
-            mid = (lo + hi) // 2
-            bookFile.seek(mid * 16)
-            entry = bookFile.read(entrysize)
-            if len(entry) != entrysize:
-                return openings
-            entry = BookEntry._make(entrystruct.unpack(entry))
-            if entry.key < key:
-                lo = mid + 1
-            else:
-                hi = mid
-
-        bookFile.seek(lo * 16)
-        while True:
-            entry = bookFile.read(entrysize)
-            if len(entry) != entrysize:
-                return openings
-            entry = BookEntry._make(entrystruct.unpack(entry))
-            if entry.key != key:
-                break
-            mv = parsePolyglot(board, entry.move)
-            openings.append( ( mv, entry.weight, entry.games, entry.score ) )
-    return openings
+    with booksLock:
+        for book in books:
+            entries = book.getEntries(board.hash)
+            if entries:
+                return [(parsePolyglot(board, entry.move), entry.weight,
+                         entry.games, entry.score) for entry in entries]
+    return []
+
+openBooks()
+conf.notify_add("opening_file_entry", lambda *args: openBooks())
@@ -0,0 +1,295 @@
+""" Builds Polyglot opening books, readable by pychess.Utils.book, from PGN
+    files and from the games of the database.
+
+    The games are parsed in chunks, by a pool of processes if wanted, into
+    counts of the games, wins and draws of each (position, move) from the
+    point of view of the side to move. The counts are merged in memory, and
+    spilled to sorted runs on disk when there are more than maxEntries of
+    them, so books of any size can be built in bounded memory. The runs are
+    merged into the sorted book at the end.
+
+    python -m pychess.Utils.bookbuilder [-p plies] [-g games] [-j processes]
+                                         [--database] book.bin [file.pgn ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import heapq
+import zipfile
+import tempfile
+from array import array
+from struct import Struct
+from multiprocessing import Pool
+
+from pychess.compat import open
+from pychess.Utils.const import *
+from pychess.Utils.book import entrystruct
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import toPolyglot
+from pychess.Savers.pgnbase import PgnBase, pgn_load
+
+# A (position, move) count of a sorted run: key, move, games, wins, draws
+runstruct = Struct(">QHIII")
+
+# The number of records of a run read at a time
+RUN_BLOCK = 4096
+
+# Games handed to a process at a time
+GAMES_CHUNK = 200
+
+def _count (counts, board, move, result):
+    """ Counts move from board for a game with result """
+    key = (board.hash, toPolyglot(board, move))
+    entry = counts.get(key)
+    if entry is None:
+        entry = counts[key] = [0, 0, 0]
+    entry[0] += 1
+    if result == DRAW:
+        entry[2] += 1
+    elif result == (WHITEWON if board.color == WHITE else BLACKWON):
+        entry[1] += 1
+
+def countPgnGames (games, maxply):
+    """ The counts of the mainline moves of games, which are (tags,
+        movetext) pairs as in PgnBase.games, up to ply maxply. Games of
+        other variants than normal chess, and games without a result, are
+        skipped. Games with errors are counted up to the error. """
+
+    counts = {}
+    pgn = PgnBase(games)
+    for i in range(len(games)):
+        result = pgn.get_result(i)
+        if result not in (WHITEWON, BLACKWON, DRAW) or \
+                pgn.get_variant(i) not in ("", "Normal", "Standard"):
+            continue
+        board = LBoard(NORMALCHESS)
+        try:
+            board.applyFen(pgn._getTag(i, "FEN") or FEN_START)
+        except SyntaxError:
+            continue
+        pgn.error = None
+        start = board.clone(history=False)
+        for move in pgn.parse_mainline(pgn.get_movetext(i), board, maxply):
+            _count(counts, start, move, result)
+            start.applyMove(move)
+    return counts
+
+def countMovelists (games, maxply):
+    """ The counts of the mainline moves of games, which are (movelist,
+        fen, result) rows of the game table of the database, up to ply
+        maxply """
+
+    from pychess.Database.dbwalk import COMMENT, VARI_START, VARI_END
+
+    counts = {}
+    for movelist, fen, result in games:
+        if result not in (WHITEWON, BLACKWON, DRAW):
+            continue
+        board = LBoard(NORMALCHESS)
+        board.applyFen(fen or FEN_START)
+        moves = array("H")
+        if hasattr(moves, "frombytes"):
+            moves.frombytes(movelist)
+        else:
+            moves.fromstring(movelist)
+
+        depth = 0
+        for move in moves:
+            if move == VARI_START:
+                depth += 1
+            elif move == VARI_END:
+                depth -= 1
+            elif depth == 0 and move < COMMENT:
+                if board.plyCount >= maxply:
+                    break
+                _count(counts, board, move, result)
+                board.applyMove(move)
+    return counts
+
+def _countChunk (job):
+    counter, games, maxply = job
+    return counter(games, maxply)
+
+def pgnJobs (paths, maxply):
+    """ Yields jobs counting the games of the PGN files, or the PGN files in
+        zip files, at paths """
+
+    for path in paths:
+        if path.lower().endswith(".zip") and zipfile.is_zipfile(path):
+            gamelists = []
+            with zipfile.ZipFile(path, "r") as zf:
+                for name in zf.namelist():
+                    if name.lower().endswith(".pgn"):
+                        with zf.open(name, "r") as f:
+                            # zip members are binary
+                            lines = (line.decode("latin_1") for line in f)
+                            gamelists.append(pgn_load(lines).games)
+        else:
+            # The games of files on disk stay mapped after the file is closed
+            with open(path, encoding="latin_1") as f:
+                gamelists = [pgn_load(f).games]
+        for games in gamelists:
+            for i in range(0, len(games), GAMES_CHUNK):
+                yield countPgnGames, games[i:i+GAMES_CHUNK], maxply
+
+def databaseJobs (maxply):
+    """ Yields jobs counting the normal chess games of the database """
+
+    from sqlalchemy import select
+    from pychess.Database import model as dbmodel
+    from pychess.Database.model import game
+
+    conn = dbmodel.engine.connect()
+    s = select([game.c.movelist, game.c.fen, game.c.result], game.c.variant == None)
+    result = conn.execute(s)
+    while True:
+        rows = result.fetchmany(GAMES_CHUNK)
+        if not rows:
+            break
+        yield countMovelists, [tuple(row) for row in rows], maxply
+    conn.close()
+
+def _writeRun (counts):
+    """ Writes counts, sorted, to a temporary file and returns it """
+    run = tempfile.TemporaryFile()
+    for (key, move), (games, wins, draws) in sorted(counts.items()):
+        run.write(runstruct.pack(key, move, games, wins, draws))
+    run.seek(0)
+    return run
+
+def _readRun (run):
+    size = runstruct.size
+    while True:
+        data = run.read(size * RUN_BLOCK)
+        if not data:
+            break
+        for offset in range(0, len(data), size):
+            yield runstruct.unpack_from(data, offset)
+
+def _mergeRuns (runs):
+    """ Yields the (key, move, games, wins, draws) of the runs in order, with
+        the counts of the same position and move summed """
+    last = None
+    for record in heapq.merge(*[_readRun(run) for run in runs]):
+        if last is not None and record[:2] == last[:2]:
+            last = last[:2] + (last[2]+record[2], last[3]+record[3], last[4]+record[4])
+        else:
+            if last is not None:
+                yield last
+            last = record
+    if last is not None:
+        yield last
+
+def _writeBook (f, records, minGames):
+    """ Writes the book entries of the records of each position, which have
+        at least minGames games. A move is weighted 2 per win and 1 per draw,
+        scaled down to fit 16 bits, and moves without any are left out, like
+        PolyGlot does. Returns the number of entries written. """
+
+    written = 0
+    position = []
+    for record in records:
+        if position and record[0] != position[0][0]:
+            written += _writePosition(f, position)
+            position = []
+        key, move, games, wins, draws = record
+        score = 2*wins + draws
+        if games >= minGames and score:
+            position.append((key, move, score, games))
+    if position:
+        written += _writePosition(f, position)
+    return written
+
+def _writePosition (f, position):
+    scale = max(1., max(score for key, move, score, games in position) / 65535.)
+    position.sort(key=lambda entry: entry[2], reverse=True)
+    for key, move, score, games in position:
+        f.write(entrystruct.pack(key, move, max(1, int(score / scale)),
+                                 min(games, 65535), min(score, 65535)))
+    return len(position)
+
+def buildBook (path, pgnfiles=(), database=False, maxply=40, minGames=1,
+               processes=1, maxEntries=1000000):
+    """ Writes a Polyglot book to path, of the moves of the first maxply
+        plies of the games in pgnfiles, and in the database if database is
+        True. Moves played in fewer than minGames games are left out. With
+        more than one process, the games are parsed by a pool of processes.
+        At most about maxEntries counts are kept in memory.
+        Returns the number of book entries written. """
+
+    def jobs ():
+        for job in pgnJobs(pgnfiles, maxply):
+            yield job
+        if database:
+            for job in databaseJobs(maxply):
+                yield job
+
+    pool = Pool(processes) if processes > 1 else None
+    runs = []
+    counts = {}
+    try:
+        if pool is not None:
+            chunks = pool.imap(_countChunk, jobs())
+        else:
+            chunks = (_countChunk(job) for job in jobs())
+        for chunk in chunks:
+            for key, (games, wins, draws) in chunk.items():
+                entry = counts.get(key)
+                if entry is None:
+                    counts[key] = [games, wins, draws]
+                else:
+                    entry[0] += games
+                    entry[1] += wins
+                    entry[2] += draws
+            if len(counts) >= maxEntries:
+                runs.append(_writeRun(counts))
+                counts = {}
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    try:
+        if runs:
+            if counts:
+                runs.append(_writeRun(counts))
+            records = _mergeRuns(runs)
+        else:
+            records = (key + tuple(value) for key, value in sorted(counts.items()))
+        with open(path, "wb") as f:
+            return _writeBook(f, records, minGames)
+    finally:
+        for run in runs:
+            run.close()
+
+def main (argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m pychess.Utils.bookbuilder",
+        description="Builds a Polyglot opening book from PGN files and the database")
+    parser.add_argument("book", metavar="book.bin")
+    parser.add_argument("files", nargs="*", metavar="file.pgn",
+                        help="PGN files, or zip files of them")
+    parser.add_argument("--database", action="store_true",
+                        help="add the games of the PyChess database")
+    parser.add_argument("-p", "--plies", type=int, default=40,
+                        help="plies of each game to add (default: 40)")
+    parser.add_argument("-g", "--min-games", type=int, default=1,
+                        help="games a move must be played in (default: 1)")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="processes parsing the games (default: 1)")
+    parser.add_argument("-m", "--memory", type=int, default=1000000, metavar="ENTRIES",
+                        help="counts kept in memory before sorting to disk (default: 1000000)")
+    args = parser.parse_args(argv)
+
+    if not args.files and not args.database:
+        parser.error("no PGN files or --database given")
+    entries = buildBook(args.book, args.files, args.database, args.plies,
+                        args.min_games, args.processes, args.memory)
+    print("%d entries written to %s" % (entries, args.book))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
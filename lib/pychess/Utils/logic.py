@@ -21,10 +21,9 @@ from pychess.Variants.threecheck import checkCount
 
 def getDestinationCords (board, cord):
     tcords = []
-    for move in lmovegen.genAllMoves (board.board):
+    for move in lmovegen.genLegalMoves (board.board):
         if FCORD(move) == cord.cord:
-            if not board.board.willLeaveInCheck(move):
-                tcords.append(Cord(TCORD(move)))
+            tcords.append(Cord(TCORD(move)))
     return tcords
 
 def isClaimableDraw (board):
@@ -81,21 +80,7 @@ def getStatus (board):
         if ldraw.testMaterial (lboard):
             return DRAW, DRAW_INSUFFICIENT
     
-    hasMove = False
-    for move in lmovegen.genAllMoves (lboard):
-        if board.variant == ATOMICCHESS:
-            if kingExplode(lboard, move, 1-board.color) and not kingExplode(lboard, move, board.color):
-                hasMove = True
-                break
-            elif kingExplode(lboard, move, board.color):
-                continue
-        lboard.applyMove(move)
-        if lboard.opIsChecked():
-            lboard.popMove()
-            continue
-        hasMove = True
-        lboard.popMove()
-        break
+    hasMove = lmovegen.hasLegalMove(lboard)
 
     if not hasMove:
         if lboard.isChecked():
@@ -138,8 +123,7 @@ def getStatus (board):
     return RUNNING, UNKNOWN_REASON
     
 def standard_validate (board, move):
-    return validateMove (board.board, move.move) and \
-           not board.board.willLeaveInCheck(move.move)
+    return validateMove (board.board, move.move, legal=True)
 
 def validate (board, move):
     if board.variant == LOSERSCHESS:
@@ -208,7 +192,6 @@ def genCastles (board):
 
 def legalMoveCount (board):
     moves = 0
-    for move in lmovegen.genAllMoves (board.board):
-        if not board.board.willLeaveInCheck(move):
-            moves += 1
+    for move in lmovegen.genLegalMoves (board.board):
+        moves += 1
     return moves
@@ -1,11 +1,28 @@
+""" The benchmarks of the built-in engine.
+
+    benchmark() is the search benchmark of the CECP "benchmark" command. The
+    suite of runSuite() times perft, move generation, evaluation, the search
+    and PGN parsing separately, and can be compared with a baseline. Run it
+    from the command line with:
+
+    python -m pychess.Utils.lutils.Benchmark -o results.json -b baseline.json
+"""
+
 from __future__ import print_function
+import pychess
 from pychess.Utils.lutils.LBoard import LBoard
-from pychess.Utils.lutils.leval import clearPawnTable
-from pychess.Utils.lutils.lmove import listToSan
-from pychess.Utils.lutils import lsearch
+from pychess.Utils.lutils.leval import clearPawnTable, clearEvalTable, hitRates, resetHitRates, scorePosition
+from pychess.Utils.lutils.lmove import listToSan, toSAN
+from pychess.Utils.lutils.lmovegen import genAllMoves, genLegalMoves
+from pychess.Utils.lutils.perft import do_perft
+from pychess.Utils.lutils import lsearch, lsmp, ldraw
 from pychess.Utils.const import *
+import json
+import platform
 import sys
-from time import time
+from multiprocessing import cpu_count
+from random import Random
+from time import time, strftime
 
 # For now, we use the benchmark positions from Stockfish.
 benchmarkPositions = [
@@ -28,28 +45,310 @@ benchmarkPositions = [
 ]
     
 def benchmark ():
-    """ Times a search of a static list of positions. """
+    """ Times a search of a static list of positions. Uses as many cores as
+        set by lsmp.setCores. """
     
     suite_time = time()
+    lsmp.resetHelperNodes()
     suite_nodes = lsearch.nodes
     lsearch.endtime = sys.maxsize
     lsearch.searching = True
     for i, fen in enumerate(benchmarkPositions):
         lsearch.table.clear()
         clearPawnTable()
+        clearEvalTable()
+        resetHitRates()
         board = LBoard(NORMALCHESS)
         board.applyFen(fen)
         pos_start_time = time()
-        pos_start_nodes = lsearch.nodes
+        pos_start_nodes = lsearch.nodes + lsmp.getHelperNodes()
+        pos_start_qnodes = lsearch.qnodes
         for depth in range (1, 6):
-            mvs, scr = lsearch.alphaBeta (board, depth)
+            lsmp.startHelpers(board, depth)
+            scr = lsearch.alphaBeta (board, depth)
+            mvs = lsearch.getPV()
+            lsmp.stopHelpers()
             pos_time = time() - pos_start_time
-            pos_nodes = lsearch.nodes - pos_start_nodes
+            pos_nodes = lsearch.nodes + lsmp.getHelperNodes() - pos_start_nodes
             pv = " ".join(listToSan(board, mvs))
             time_cs = int(100 * pos_time)
             print(depth, scr, time_cs, pos_nodes, pv)
-        print("Searched position", i, "at", int(pos_nodes / pos_time), "n/s")
+        pos_qnodes = lsearch.qnodes - pos_start_qnodes
+        print("Searched position", i, "at", int(pos_nodes / pos_time), "n/s,", \
+              pos_qnodes, "quiescence nodes in the main search")
+        print("Eval hash hits: %.1f%%, pawn hash hits: %.1f%%" % hitRates())
     suite_time = time() - suite_time
-    suite_nodes = lsearch.nodes - suite_nodes
+    suite_nodes = lsearch.nodes + lsmp.getHelperNodes() - suite_nodes
     print("Total:", suite_nodes, "nodes in", suite_time, "s: ", suite_nodes / suite_time, "n/s")
-    lsearch.nodes = 0
+    lsearch.resetNodes()
+    lsmp.resetHelperNodes()
+
+def repetitionBenchmark (plies=200, calls=100000):
+    """ Times ldraw.test, which the search calls at every node, at the end of
+        a game of plies half moves. The game is made of random legal moves,
+        always the same for the same number of plies. """
+    
+    rand = Random(plies)
+    board = LBoard(NORMALCHESS)
+    board.applyFen(FEN_START)
+    while board.plyCount < plies:
+        moves = list(genLegalMoves(board))
+        if not moves:
+            break
+        board.applyMove(rand.choice(moves))
+    
+    start_time = time()
+    for i in range(calls):
+        ldraw.test(board)
+    test_time = time() - start_time
+    print("Tested", calls, "times at ply", board.plyCount, "(fifty", \
+          board.fifty, ") in", test_time, "s: ", calls / test_time, "tests/s")
+
+################################################################################
+# Benchmark suite                                                              #
+################################################################################
+
+# Positions, depths and the correct node counts of the perft benchmark
+perftPositions = [
+  (FEN_START, 4, 197281),
+  ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 3, 97862),
+  ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 4, 43238),
+  ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", 3, 9467)
+]
+
+def _bestOf (repeat, func):
+    """ Calls func repeat times. Returns its last result and the least time
+        it took. """
+    best = None
+    for i in range(repeat):
+        start = time()
+        result = func()
+        elapsed = time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+def _boards (fens):
+    boards = []
+    for fen in fens:
+        board = LBoard(NORMALCHESS)
+        board.applyFen(fen)
+        boards.append(board)
+    return boards
+
+def perftBenchmark (repeat=3):
+    boards = _boards(fen for fen, depth, count in perftPositions)
+    depths = [depth for fen, depth, count in perftPositions]
+    
+    def run ():
+        return sum(do_perft(board, depth, 0) for board, depth in zip(boards, depths))
+    
+    nodes, seconds = _bestOf(repeat, run)
+    return {"nodes": nodes, "seconds": seconds, "nps": nodes / seconds,
+            "correct": nodes == sum(count for fen, depth, count in perftPositions)}
+
+def movegenBenchmark (repeat=3, rounds=500):
+    """ Pseudo legal move generation in the benchmark positions """
+    boards = _boards(benchmarkPositions)
+    
+    def run ():
+        moves = 0
+        for i in range(rounds):
+            for board in boards:
+                for move in genAllMoves(board):
+                    moves += 1
+        return moves
+    
+    moves, seconds = _bestOf(repeat, run)
+    return {"moves": moves, "seconds": seconds, "moves_per_second": moves / seconds}
+
+def evalBenchmark (repeat=3, rounds=20):
+    """ The evaluation, without the evaluation hash, of the positions after
+        each legal move in the benchmark positions """
+    boards = []
+    for board in _boards(benchmarkPositions):
+        for move in genLegalMoves(board):
+            child = board.clone(history=False)
+            child.applyMove(move)
+            boards.append(child)
+    
+    def run ():
+        for i in range(rounds):
+            for board in boards:
+                scorePosition(board, board.color)
+        return rounds * len(boards)
+    
+    evals, seconds = _bestOf(repeat, run)
+    return {"evaluations": evals, "seconds": seconds,
+            "evals_per_second": evals / seconds}
+
+def searchBenchmark (repeat=1, depth=4):
+    """ The time to complete each depth in the benchmark positions, in
+        total. The main process searches alone, with cleared tables. """
+    lsearch.endtime = sys.maxsize
+    lsearch.searching = True
+    
+    def run ():
+        times = [0.] * depth
+        nodes = lsearch.nodes
+        for board in _boards(benchmarkPositions):
+            lsearch.table.clear()
+            clearPawnTable()
+            clearEvalTable()
+            start = time()
+            for d in range(1, depth+1):
+                lsearch.alphaBeta(board, d)
+                times[d-1] += time() - start
+        return times, lsearch.nodes - nodes
+    
+    best = None
+    for i in range(repeat):
+        times, nodes = run()
+        if best is None or times[-1] < best[-1]:
+            best = times
+    lsearch.resetNodes()
+    return {"nodes": nodes, "seconds": best[-1],
+            "time_to_depth": dict((str(d+1), t) for d, t in enumerate(best))}
+
+def _randomGames (games, plies=80):
+    """ PGN of games of random legal moves, the same each time """
+    rand = Random(games)
+    pgn = []
+    for game in range(games):
+        board = LBoard(NORMALCHESS)
+        board.applyFen(FEN_START)
+        movetext = []
+        while board.plyCount < plies:
+            moves = list(genLegalMoves(board))
+            if not moves:
+                break
+            move = rand.choice(moves)
+            if board.color == WHITE:
+                movetext.append("%d." % (board.plyCount // 2 + 1))
+            movetext.append(toSAN(board, move))
+            board.applyMove(move)
+        pgn.append('[Event "Benchmark"]\n[Round "%d"]\n[Result "*"]\n\n' % (game+1))
+        pgn.append(" ".join(movetext) + " *\n\n")
+    return "".join(pgn)
+
+def pgnBenchmark (repeat=3, path=None, games=100):
+    """ Reading and parsing the games of the PGN file at path, or of games
+        random games """
+    from pychess.Savers.pgnbase import pgn_load
+    if path:
+        with open(path) as f:
+            lines = f.readlines()
+    else:
+        lines = _randomGames(games).splitlines(True)
+    
+    def run ():
+        pgn = pgn_load(lines)
+        plies = 0
+        for i in range(len(pgn)):
+            board = LBoard(NORMALCHESS)
+            board.applyFen(FEN_START)
+            plies += len(pgn.parse_string(pgn.get_movetext(i), board, -1)) - 1
+        return len(pgn), plies
+    
+    (games, plies), seconds = _bestOf(repeat, run)
+    return {"games": games, "plies": plies, "seconds": seconds,
+            "plies_per_second": plies / seconds}
+
+# The benchmarks of the suite, with the metric compared to the baseline and
+# whether higher values of it are better
+suite = (
+    ("perft", perftBenchmark, "nps", True),
+    ("movegen", movegenBenchmark, "moves_per_second", True),
+    ("eval", evalBenchmark, "evals_per_second", True),
+    ("search", searchBenchmark, "seconds", False),
+    ("pgn", pgnBenchmark, "plies_per_second", True),
+)
+
+def machineInfo ():
+    return {"platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": cpu_count(),
+            "python": "%s %s" % (platform.python_implementation(),
+                                 platform.python_version()),
+            "pychess": pychess.VERSION}
+
+def runSuite (names=None, repeat=3, depth=4, pgnpath=None, log=print):
+    """ Runs the benchmarks of the suite named in names, or all of them.
+        Returns the results, with machine info, as a dict ready for JSON. """
+    benchmarks = {}
+    for name, func, metric, higher in suite:
+        if names and name not in names:
+            continue
+        log("Running %s benchmark" % name)
+        if name == "search":
+            benchmarks[name] = func(repeat=1, depth=depth)
+        elif name == "pgn":
+            benchmarks[name] = func(repeat=repeat, path=pgnpath)
+        else:
+            benchmarks[name] = func(repeat=repeat)
+        log("    %s %.1f" % (metric, benchmarks[name][metric]))
+    return {"date": strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": machineInfo(),
+            "benchmarks": benchmarks}
+
+def compareResults (results, baseline, tolerance=0.1):
+    """ Compares the metrics of the suite in results with baseline. Returns
+        a list of (name, metric, baseline value, value, change, regressed).
+        The change is the relative improvement, and the benchmark has
+        regressed when the change is below -tolerance. """
+    comparison = []
+    for name, func, metric, higher in suite:
+        if name not in results["benchmarks"] or \
+                name not in baseline["benchmarks"]:
+            continue
+        value = results["benchmarks"][name][metric]
+        base = baseline["benchmarks"][name][metric]
+        if higher:
+            change = (value - base) / base
+        else: change = (base - value) / base
+        comparison.append((name, metric, base, value, change, change < -tolerance))
+    return comparison
+
+def main (argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m pychess.Utils.lutils.Benchmark",
+        description="Runs the benchmark suite of the built-in engine.")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help="benchmarks to run, of %s (default: all)" % \
+                             ", ".join(entry[0] for entry in suite))
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("-b", "--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1,
+                        help="allowed slowdown compared with the baseline (default: 0.1)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs of each benchmark, the best is kept (default: 3)")
+    parser.add_argument("-d", "--depth", type=int, default=4,
+                        help="depth of the search benchmark (default: 4)")
+    parser.add_argument("--pgn", help="PGN file to parse, instead of random games")
+    args = parser.parse_args(argv)
+    
+    for name in args.benchmarks:
+        if name not in [entry[0] for entry in suite]:
+            parser.error("unknown benchmark: %s" % name)
+    
+    results = runSuite(args.benchmarks, args.repeat, args.depth, args.pgn)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressed = False
+    for name, metric, base, value, change, worse in \
+            compareResults(results, baseline, args.tolerance):
+        print("%-8s %-18s %12.1f %12.1f %+6.1f%% %s" % (name, metric, base,
+              value, 100 * change, worse and "REGRESSION" or "ok"))
+        regressed = regressed or worse
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,23 +16,64 @@ from .PolyglotHash import *
 # number is not specified
 STRICT_FEN = False
 
+################################################################################
+# Material                                                                     #
+################################################################################
+
+def materialValues (variant):
+    """ The values of the pieces, as summed up in LBoard.material. The pieces
+        in hand (crazyhouse) are not included. """
+    if variant == CRAZYHOUSECHESS:
+        return CRAZY_PIECE_VALUES[:KING] + (0,)
+    elif variant == LOSERSCHESS:
+        return (0, 1, 1, 1, 1, 1, 0)
+    elif variant == SUICIDECHESS:
+        return (0, 1, 1, 1, 1, 1, 1)
+    elif variant == ATOMICCHESS:
+        return ATOMIC_PIECE_VALUES
+    elif variant in ASEAN_VARIANTS:
+        return ASEAN_PIECE_VALUES
+    else:
+        return tuple(PIECE_VALUES[:KING]) + (0,)
+
 ################################################################################
 # LBoard                                                                       #
 ################################################################################
 
-class LBoard:
-    ini_kings = (E1, E8)
-    ini_rooks = ((A1, H1), (A8, H8))
+INI_KINGS = (E1, E8)
+INI_ROOKS = ((A1, H1), (A8, H8))
+
+# Final positions of castled kings and rooks
+FIN_KINGS = ((C1,G1),(C8,G8))
+FIN_ROOKS = ((D1,F1),(D8,F8))
+
+NO_HOLDING = ({PAWN:0, KNIGHT:0, BISHOP:0, ROOK:0, QUEEN:0, KING:0},
+              {PAWN:0, KNIGHT:0, BISHOP:0, ROOK:0, QUEEN:0, KING:0})
 
-    # Final positions of castled kings and rooks
-    fin_kings = ((C1,G1),(C8,G8))
-    fin_rooks = ((D1,F1),(D8,F8))
+# Number of records the undo stack is created with. It grows when needed.
+UNDO_STACK_SIZE = 256
 
-    holding = ({PAWN:0, KNIGHT:0, BISHOP:0, ROOK:0, QUEEN:0, KING:0},
-               {PAWN:0, KNIGHT:0, BISHOP:0, ROOK:0, QUEEN:0, KING:0})
+class LBoard (object):
+    __slots__ = ("variant", "nags", "children", "next", "prev", "pieceBoard",
+                 "fen_was_applied",
+                 "ini_kings", "ini_rooks", "fin_kings", "fin_rooks",
+                 "ini_queens", "is_first_move",
+                 "holding", "promoted", "capture_promoting",
+                 "blocker", "friends", "kings", "boards", "arBoard",
+                 "enpassant", "color", "castling", "hasCastled", "fifty",
+                 "plyCount", "checked", "opchecked", "hash", "pawnhash",
+                 "pieceCount", "pieceTotal", "materialValues", "material",
+                 "tropism",
+                 "undo", "undoLen", "repetitions")
 
     def __init__ (self, variant=NORMALCHESS):
         self.variant = variant
+        
+        self.ini_kings = INI_KINGS
+        self.ini_rooks = INI_ROOKS
+        self.fin_kings = FIN_KINGS
+        self.fin_rooks = FIN_ROOKS
+        self.holding = NO_HOLDING
 
         self.nags = []
         # children can contain comments and variations
@@ -53,23 +94,35 @@ class LBoard:
         
     @property
     def lastMove (self):
-        return self.hist_move[-1] if self.fen_was_applied and len(self.hist_move) > 0 else None
+        return self.undo[self.undoLen-1][0] if self.fen_was_applied and self.undoLen > 0 else None
+
+    # Read only views of the undo stack, in the form of the history lists used
+    # by older code
+    @property
+    def hist_move (self):
+        return [record[0] for record in self.undo[:self.undoLen]]
+
+    @property
+    def hist_hash (self):
+        return [record[4] for record in self.undo[:self.undoLen]]
+
+    @property
+    def hist_capture_promoting (self):
+        return [record[8] for record in self.undo[:self.undoLen]]
+
+    @property
+    def hist_exploding_around (self):
+        return [record[8] for record in self.undo[:self.undoLen]
+                if record[8] is not None]
 
     def repetitionCount (self, drawThreshold=3):
-        rc = 1
-        for ply in range(4, 1+min(len(self.hist_hash), self.fifty), 2):
-            if self.hist_hash[-ply] == self.hash:
-                rc += 1
-                if rc >= drawThreshold: break
-        return rc
+        """ The number of times the position has occurred, counting no
+            further than drawThreshold """
+        return min(1 + self.repetitions.get(self.hash, 0), drawThreshold)
 
-    def iniAtomic(self):
-        self.hist_exploding_around = []
-        
     def iniHouse(self):
         self.promoted = [0]*64
         self.capture_promoting = False
-        self.hist_capture_promoting = []
         self.holding = ({PAWN:0, KNIGHT:0, BISHOP:0, ROOK:0, QUEEN:0, KING:0},
                         {PAWN:0, KNIGHT:0, BISHOP:0, ROOK:0, QUEEN:0, KING:0})
 
@@ -77,7 +130,6 @@ class LBoard:
         self.ini_kings = (D1, E8)
         self.ini_queens = (E1, D8)
         self.is_first_move = {KING: [True, True], QUEEN: [True, True]}
-        self.hist_is_first_move = []
         
     def applyFen (self, fenstr):
         """ Applies the fenstring to the board.
@@ -110,18 +162,31 @@ class LBoard:
         self.hash = 0
         self.pawnhash = 0
         
-        #  Data from the position's history:
-        self.hist_move = []      # The move that was applied to get the position
-        self.hist_tpiece = []    # The piece the move captured, == EMPTY for normal moves
-        self.hist_enpassant = []
-        self.hist_castling = []
-        self.hist_hash = []
-        self.hist_fifty = []
-        self.hist_checked = []
-        self.hist_opchecked = []
+        #  Data from the position's history. Each applied move pushes a record
+        #  (move, tpiece, enpassant, castling, hash, fifty, checked, opchecked,
+        #   extra)
+        #  where tpiece is the piece the move captured (EMPTY for normal moves),
+        #  the next six are the values from before the move, and extra holds
+        #  the variant specific state: capture_promoting in the drop variants,
+        #  the exploded pieces in atomic and is_first_move in cambodian.
+        #  undo[:undoLen] is the history, the rest is room for new records.
+        self.undo = [None] * UNDO_STACK_SIZE
+        self.undoLen = 0
+        #  How many times each hash occurs in the history, so repetitions can
+        #  be found without a scan. Hashes are removed again at zero.
+        self.repetitions = {}
 
         # piece counts
         self.pieceCount = [[0]*7, [0]*7]
+        # The number of pieces on the board, kings and pawns included. Unlike
+        # pieceCount, this is kept by _addPiece and _removePiece.
+        self.pieceTotal = 0
+        
+        # Running sums of the material and the king tropism of each color,
+        # kept up to date by _addPiece and _removePiece, for leval
+        self.materialValues = materialValues(self.variant)
+        self.material = [0, 0]
+        self.tropism = [0, 0]
         
         # initial cords of rooks and kings for castling in Chess960
         if self.variant == FISCHERRANDOMCHESS:
@@ -136,9 +201,6 @@ class LBoard:
         elif self.variant in DROP_VARIANTS:
             self.iniHouse()
 
-        elif self.variant == ATOMICCHESS:
-            self.iniAtomic()
-
         elif self.variant == CAMBODIANCHESS:
             self.iniCambodian()
             
@@ -370,34 +432,61 @@ class LBoard:
     def willLeaveInCheck (self, move):
         if self.variant == SUICIDECHESS:
             return False
-        board_clone = self.clone()
+        board_clone = self.clone(history=False)
         board_clone.applyMove(move)
         return board_clone.opIsChecked()
         
     def _addPiece (self, cord, piece, color):
-        _setBit = setBit
-        self.boards[color][piece] = _setBit(self.boards[color][piece], cord)
-        self.friends[color] = _setBit(self.friends[color], cord)
-        self.blocker = _setBit(self.blocker, cord)
+        bit = bitPosArray[cord]
+        self.boards[color][piece] |= bit
+        self.friends[color] |= bit
+        self.blocker |= bit
+        
+        self.hash ^= pieceHashes[color][piece][cord]
+        self.arBoard[cord] = piece
+        self.pieceTotal += 1
+        self.material[color] += self.materialValues[piece]
         
         if piece == PAWN:
             self.pawnhash ^= pieceHashes[color][PAWN][cord]
         elif piece == KING:
             self.kings[color] = cord
-        self.hash ^= pieceHashes[color][piece][cord]
-        self.arBoard[cord] = piece
+            self._updateTropism(1-color)
+        elif piece != EMPTY:
+            self.tropism[color] += tropisms[piece][cord][self.kings[1-color]]
     
     def _removePiece (self, cord, piece, color):
-        _clearBit = clearBit
-        self.boards[color][piece] = _clearBit(self.boards[color][piece], cord)
-        self.friends[color] = _clearBit(self.friends[color], cord)
-        self.blocker = _clearBit(self.blocker, cord)
-        
-        if piece == PAWN:
-            self.pawnhash ^= pieceHashes[color][PAWN][cord]
+        notbit = notBitPosArray[cord]
+        self.boards[color][piece] &= notbit
+        self.friends[color] &= notbit
+        self.blocker &= notbit
         
         self.hash ^= pieceHashes[color][piece][cord]
         self.arBoard[cord] = EMPTY
+        self.pieceTotal -= 1
+        self.material[color] -= self.materialValues[piece]
+        
+        if piece == PAWN:
+            self.pawnhash ^= pieceHashes[color][PAWN][cord]
+        elif PAWN < piece < KING:
+            self.tropism[color] -= tropisms[piece][cord][self.kings[1-color]]
+    
+    def _updateTropism (self, color):
+        """ Sum up the king tropism of color from scratch. Needed when the
+            enemy king has moved. """
+        _lsb = lsb
+        opking = self.kings[1-color]
+        pieces = self.boards[color]
+        score = 0
+        for piece in range(KNIGHT, KING):
+            bitboard = pieces[piece]
+            tropism = tropisms[piece]
+            # inlined iterBits()
+            while bitboard:
+                bit = bitboard & -bitboard
+                score += tropism[_lsb[bit]][opking]
+                bitboard -= bit
+        self.tropism[color] = score
     
     def setColor (self, color):
         if color == self.color: return
@@ -452,23 +541,35 @@ class LBoard:
         opcolor = 1-self.color
         castling = self.castling
         
-        self.hist_move.append(move)
-        self.hist_enpassant.append(self.enpassant)
-        self.hist_castling.append(self.castling)
-        self.hist_hash.append(self.hash)
-        self.hist_fifty.append(self.fifty)
-        self.hist_checked.append(self.checked)
-        self.hist_opchecked.append(self.opchecked)
+        if flag in (KING_CASTLE, QUEEN_CASTLE, NULL_MOVE):
+            # In FRC, there may be a rook there, but the king doesn't capture it.
+            tpiece = EMPTY
+        
         if self.variant in DROP_VARIANTS:
-            self.hist_capture_promoting.append(self.capture_promoting)
-        if self.variant == CAMBODIANCHESS:
-            self.hist_is_first_move.append({KING: self.is_first_move[KING][:], \
-                                            QUEEN: self.is_first_move[QUEEN][:]})
+            extra = self.capture_promoting
+        elif self.variant == CAMBODIANCHESS:
+            extra = (tuple(self.is_first_move[KING]),
+                     tuple(self.is_first_move[QUEEN]))
+        else:
+            extra = None
+        
+        ply = self.undoLen
+        hash = self.hash
+        record = (move, tpiece, self.enpassant, castling, hash,
+                  self.fifty, self.checked, self.opchecked, extra)
+        try:
+            self.undo[ply] = record
+        except IndexError:
+            self.undo.append(record)
+        self.undoLen = ply + 1
+        repetitions = self.repetitions
+        repetitions[hash] = repetitions.get(hash, 0) + 1
             
         self.opchecked = None
         self.checked = None
 
         if flag == NULL_MOVE:
+            self.setEnpassant(None)
             self.setColor(opcolor)
             return move
 
@@ -482,7 +583,6 @@ class LBoard:
         if flag in (KING_CASTLE, QUEEN_CASTLE):
             side = flag - QUEEN_CASTLE
             fpiece = KING
-            tpiece = EMPTY # In FRC, there may be a rook there, but the king doesn't capture it.
             fcord = self.ini_kings[color]
             if FILE(fcord) == 3 and self.variant in (WILDCASTLECHESS, WILDCASTLESHUFFLECHESS):
                 side = 0 if side == 1 else 1
@@ -516,9 +616,7 @@ class LBoard:
                             castling &= ~CAS_FLAGS[opcolor][0]
                         elif acord == self.ini_rooks[opcolor][1]:
                             castling &= ~CAS_FLAGS[opcolor][1]
-                self.hist_exploding_around.append(apieces)
-            
-        self.hist_tpiece.append(tpiece)
+                self.undo[ply] = record[:8] + (apieces,)
         
         # Remove moving piece(s), then add them at their destination.
         if flag == DROP:
@@ -548,7 +646,7 @@ class LBoard:
                         self._removePiece(acord, apiece, acolor)
                         self.pieceCount[acolor][apiece] -= 1
                         apieces.append((acord, apiece, acolor))
-                self.hist_exploding_around.append(apieces)
+                self.undo[ply] = record[:8] + (apieces,)
         elif flag in PROMOTIONS:
             # Pretend the pawn changes into a piece before reaching its destination.
             fpiece = flag - 2
@@ -613,13 +711,31 @@ class LBoard:
         color = 1 - self.color
         opcolor = self.color
         
-        move = self.hist_move.pop()
-        cpiece = self.hist_tpiece.pop()
+        self.undoLen -= 1
+        move, cpiece, enpassant, castling, hash, fifty, checked, opchecked, \
+            extra = self.undo[self.undoLen]
+        repetitions = self.repetitions
+        count = repetitions[hash]
+        if count == 1:
+            del repetitions[hash]
+        else:
+            repetitions[hash] = count - 1
             
         flag = move >> 12
         
         if flag == NULL_MOVE:
-            self.setColor(color)
+            if self.variant in DROP_VARIANTS:
+                self.capture_promoting = extra
+            if self.variant == CAMBODIANCHESS:
+                self.is_first_move = {KING: list(extra[0]),
+                                      QUEEN: list(extra[1])}
+            self.color = color
+            self.checked = checked
+            self.opchecked = opchecked
+            self.enpassant = enpassant
+            self.castling = castling
+            self.hash = hash
+            self.fifty = fifty
             return
             
         fcord = (move >> 6) & 63
@@ -640,7 +756,8 @@ class LBoard:
             self._removePiece (rookt, ROOK, color)
             self._addPiece (rookf, ROOK, color)
             self.hasCastled[color] = False
-        else:
+        elif tpiece != EMPTY:
+            # In atomic chess the capturing piece explodes too
             self._removePiece (tcord, tpiece, color)
         
         # Put back captured piece
@@ -655,8 +772,7 @@ class LBoard:
                     assert self.holding[color][cpiece] > 0
                     self.holding[color][cpiece] -= 1
             elif self.variant == ATOMICCHESS:
-                apieces = self.hist_exploding_around.pop()
-                for acord, apiece, acolor in apieces:
+                for acord, apiece, acolor in extra:
                     self._addPiece (acord, apiece, acolor)
                     self.pieceCount[acolor][apiece] += 1
                     
@@ -670,8 +786,7 @@ class LBoard:
                 assert self.holding[color][PAWN] > 0
                 self.holding[color][PAWN] -= 1
             elif self.variant == ATOMICCHESS:
-                apieces = self.hist_exploding_around.pop()
-                for acord, apiece, acolor in apieces:
+                for acord, apiece, acolor in extra:
                     self._addPiece (acord, apiece, acolor)
                     self.pieceCount[acolor][apiece] += 1
             
@@ -697,19 +812,19 @@ class LBoard:
                     self.promoted[tcord] = 1
                 else:
                     self.promoted[tcord] = 0
-            self.capture_promoting = self.hist_capture_promoting.pop()
+            self.capture_promoting = extra
         
         if self.variant == CAMBODIANCHESS:
-            self.is_first_move = self.hist_is_first_move.pop()
+            self.is_first_move = {KING: list(extra[0]), QUEEN: list(extra[1])}
             
         self.setColor(color)
         
-        self.checked = self.hist_checked.pop()
-        self.opchecked = self.hist_opchecked.pop()
-        self.enpassant = self.hist_enpassant.pop()
-        self.castling = self.hist_castling.pop()
-        self.hash = self.hist_hash.pop()
-        self.fifty = self.hist_fifty.pop()
+        self.checked = checked
+        self.opchecked = opchecked
+        self.enpassant = enpassant
+        self.castling = castling
+        self.hash = hash
+        self.fifty = fifty
         self.plyCount -= 1
         
     def __hash__ (self):
@@ -856,7 +971,10 @@ class LBoard:
         
         return "".join(fenstr)
     
-    def clone (self):
+    def clone (self, history=True):
+        """ Returns a copy of the board. With history=False the moves leading
+            to the position aren't copied, so the copy is cheaper to make,
+            but it can't popMove them nor find repetitions. """
         copy = LBoard(self.variant)
         copy.blocker = self.blocker
         
@@ -865,6 +983,10 @@ class LBoard:
         copy.boards = [self.boards[WHITE][:], self.boards[BLACK][:]]
         copy.arBoard = self.arBoard[:]
         copy.pieceCount = [self.pieceCount[WHITE][:], self.pieceCount[BLACK][:]]
+        copy.pieceTotal = self.pieceTotal
+        copy.materialValues = self.materialValues
+        copy.material = self.material[:]
+        copy.tropism = self.tropism[:]
         
         copy.color = self.color
         copy.plyCount = self.plyCount
@@ -878,14 +1000,15 @@ class LBoard:
         copy.checked = self.checked
         copy.opchecked = self.opchecked
         
-        copy.hist_move = self.hist_move[:]
-        copy.hist_tpiece = self.hist_tpiece[:]
-        copy.hist_enpassant = self.hist_enpassant[:]
-        copy.hist_castling = self.hist_castling[:]
-        copy.hist_hash = self.hist_hash[:]
-        copy.hist_fifty = self.hist_fifty[:]
-        copy.hist_checked = self.hist_checked[:]
-        copy.hist_opchecked = self.hist_opchecked[:]
+        # The records are tuples, so they can be shared
+        if history:
+            copy.undo = self.undo[:self.undoLen]
+            copy.undoLen = self.undoLen
+            copy.repetitions = self.repetitions.copy()
+        else:
+            copy.undo = []
+            copy.undoLen = 0
+            copy.repetitions = {}
         
         if self.variant == FISCHERRANDOMCHESS:
             copy.ini_kings = self.ini_kings[:]
@@ -898,15 +1021,11 @@ class LBoard:
             copy.promoted = self.promoted[:]
             copy.holding = (self.holding[0].copy(), self.holding[1].copy())
             copy.capture_promoting = self.capture_promoting
-            copy.hist_capture_promoting = self.hist_capture_promoting[:]
-        elif self.variant == ATOMICCHESS:
-            copy.hist_exploding_around = [a[:] for a in self.hist_exploding_around]
         elif self.variant == CAMBODIANCHESS:
             copy.ini_kings = self.ini_kings
             copy.ini_queens = self.ini_queens
             copy.is_first_move = {KING: self.is_first_move[KING][:], \
                                   QUEEN: self.is_first_move[QUEEN][:]}
-            copy.hist_is_first_move = self.hist_is_first_move[:]
         
         copy.fen_was_applied = self.fen_was_applied
         return copy
@@ -1,4 +1,5 @@
-from ctypes import create_string_buffer, memset
+from ctypes import c_char, create_string_buffer, memset
+from multiprocessing.sharedctypes import RawArray
 from struct import Struct, pack_into, unpack_from
 
 from pychess.Utils.const import hashfALPHA, hashfBETA, hashfEXACT, hashfBAD
@@ -13,11 +14,23 @@ from pychess.Utils.lutils.ldata import MATE_VALUE, MAXPLY
 # move        best move (or cutoff move)
 entryType = Struct('=I B B H h H')
 
+# The key is stored xor'ed with the rest of the entry. The table may be shared
+# by several search processes (see lsmp) without any locking, and this way an
+# entry torn by concurrent writes simply doesn't match the key.
+def entryCheck (hashf, depth, score, move):
+    return (move << 16 | score & 0xffff) ^ (depth << 8 | hashf)
+
 class TranspositionTable:
-    def __init__ (self, maxSize):
+    def __init__ (self, maxSize, shared=False):
+        """ maxSize is in bytes. If shared is True, the entries are put in
+            shared memory, to be used by processes forked from this one. """
         assert maxSize > 0
         self.buckets = maxSize // (4 * entryType.size)
-        self.data = create_string_buffer(self.buckets * 4 * entryType.size)
+        self.shared = shared
+        if shared:
+            self.data = RawArray(c_char, self.buckets * 4 * entryType.size)
+        else:
+            self.data = create_string_buffer(self.buckets * 4 * entryType.size)
         self.search_id = 0
         
         self.killer1 = [-1]*80
@@ -27,12 +40,27 @@ class TranspositionTable:
         self.butterfly = [0]*(64*64)
     
     def clear (self):
-        memset(self.data, 0, self.buckets * 4 * entryType.size)
+        memset(self.data, 0, self.size())
         self.killer1 = [-1]*80
         self.killer2 = [-1]*80
         self.hashmove = [-1]*80
         self.butterfly = [0]*(64*64)
     
+    def size (self):
+        """ The size of the table in bytes """
+        return self.buckets * 4 * entryType.size
+    
+    def hashfull (self):
+        """ Permille of the table in use by the current search, estimated
+            from the first 1000 entries """
+        entries = min(1000, self.buckets * 4)
+        used = 0
+        for i in range(entries):
+            key, search_id = entryType.unpack_from(self.data, i * entryType.size)[:2]
+            if key and search_id == self.search_id:
+                used += 1
+        return used * 1000 // entries
+    
     def newSearch (self):
         self.search_id = (self.search_id + 1) & 0xff
         #TODO: consider clearing butterfly table
@@ -42,7 +70,7 @@ class TranspositionTable:
         key = (board.hash // self.buckets) & 0xffffffff
         for i in range(baseIndex, baseIndex + 4):
             tkey, search_id, hashf, tdepth, score, move = entryType.unpack_from(self.data, i * entryType.size)
-            if tkey == key:
+            if tkey ^ entryCheck(hashf, tdepth, score, move) == key:
                 # Mate score bounds are guaranteed to be accurate at any depth.
                 if tdepth < depth and abs(score) < MATE_VALUE-MAXPLY:
                     return move, score, hashfBAD
@@ -61,7 +89,7 @@ class TranspositionTable:
         staleRelevance = 0xffff
         for i in range(baseIndex, baseIndex + 4):
             tkey, search_id, thashf, tdepth, tscore, tmove = entryType.unpack_from(self.data, i * entryType.size)
-            if tkey == 0 or tkey == key:
+            if tkey == 0 or tkey ^ entryCheck(thashf, tdepth, tscore, tmove) == key:
                 staleIndex = i
                 break
             relevance = (0x8000 if search_id != self.search_id and thashf == hashfEXACT else 0) + \
@@ -70,7 +98,9 @@ class TranspositionTable:
             if relevance < staleRelevance:
                 staleIndex = i
                 staleRelevance = relevance
-        entryType.pack_into(self.data, staleIndex * entryType.size, key, self.search_id, hashf, depth, score, move)
+        entryType.pack_into(self.data, staleIndex * entryType.size,
+                            key ^ entryCheck(hashf, depth, score, move),
+                            self.search_id, hashf, depth, score, move)
 
     
     def addKiller (self, ply, move):
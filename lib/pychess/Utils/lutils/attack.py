@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 from .bitboard import *
 from .ldata import *
+from .magic import rookAttacks, rookMasks, bishopAttacks, bishopMasks
 from pychess.Utils.const import *
 
 #
@@ -19,7 +20,6 @@ def isAttacked (board, cord, color, ischecked=False):
     if pboards[KNIGHT] & _moveArray[KNIGHT][cord]:
         return True
     
-    rayto = fromToRay[cord]
     blocker = board.blocker
     
     # Bishops & Queens
@@ -30,33 +30,17 @@ def isAttacked (board, cord, color, ischecked=False):
         if pboards[QUEEN] & _moveArray[ASEAN_QUEEN][cord]:
             return True
     else:
-        bitboard = (pboards[BISHOP] | pboards[QUEEN]) & _moveArray[BISHOP][cord]
-        if bitboard:
-            others = ~bitboard & blocker
-            # inlined iterBits()
-            while bitboard:
-                bit = bitboard & -bitboard
-                ray = rayto[lsb[bit]]
-                # If there is a path and no other piece stand in our way
-                if ray and not ray & others:
-                    return True
-                bitboard -= bit
+        if (pboards[BISHOP] | pboards[QUEEN]) & \
+                bishopAttacks[cord][blocker & bishopMasks[cord]]:
+            return True
 
     # Rooks & Queens
     if board.variant in ASEAN_VARIANTS:
-        bitboard = pboards[ROOK] & _moveArray[ROOK][cord]
+        bitboard = pboards[ROOK]
     else:
-        bitboard = (pboards[ROOK] | pboards[QUEEN]) & _moveArray[ROOK][cord]
-    if bitboard:
-        others = ~bitboard & blocker
-        # inlined iterBits()
-        while bitboard:
-            bit = bitboard & -bitboard
-            ray = rayto[lsb[bit]]
-            # If there is a path and no other piece stand in our way
-            if ray and not ray & others:
-                return True
-            bitboard -= bit
+        bitboard = pboards[ROOK] | pboards[QUEEN]
+    if bitboard & rookAttacks[cord][blocker & rookMasks[cord]]:
+        return True
             
     # Pawns
     # Would a pawn of the opposite color, standing at out kings cord, be able
@@ -89,7 +73,6 @@ def getAttacks (board, cord, color):
     # Pawns
     bits |= pieces[PAWN] & _moveArray[color == WHITE and BPAWN or PAWN][cord]
     
-    rayto = fromToRay[cord]
     blocker = board.blocker
     
     # Bishops and Queens
@@ -99,29 +82,15 @@ def getAttacks (board, cord, color):
 
         bits |= pieces[QUEEN] & _moveArray[ASEAN_QUEEN][cord]
     else:
-        bitboard = (pieces[BISHOP] | pieces[QUEEN]) & _moveArray[BISHOP][cord]
-        # inlined iterBits()
-        while bitboard:
-            bit = bitboard & -bitboard
-            c = lsb[bit]
-            ray = rayto[c]
-            if ray and not clearBit(ray & blocker, c):
-                bits |= bitPosArray[c]
-            bitboard -= bit
+        bits |= (pieces[BISHOP] | pieces[QUEEN]) & \
+                bishopAttacks[cord][blocker & bishopMasks[cord]]
     
     # Rooks and queens
     if board.variant in ASEAN_VARIANTS:
-        bitboard = pieces[ROOK] & _moveArray[ROOK][cord]
+        bits |= pieces[ROOK] & rookAttacks[cord][blocker & rookMasks[cord]]
     else:
-        bitboard = (pieces[ROOK] | pieces[QUEEN]) & _moveArray[ROOK][cord]
-    # inlined iterBits()
-    while bitboard:
-        bit = bitboard & -bitboard
-        c = lsb[bit]
-        ray = rayto[c]
-        if ray and not clearBit(ray & blocker, c):
-            bits |= bitPosArray[c]
-        bitboard -= bit
+        bits |= (pieces[ROOK] | pieces[QUEEN]) & \
+                rookAttacks[cord][blocker & rookMasks[cord]]
     
     return bits
 
@@ -170,6 +139,31 @@ def pinnedOnKing (board, cord, color):
 
     return False
 
+def getPinned (board, color):
+    """ To create a bitboard of pieces of color, which are pinned against
+        their colors king """
+
+    kcord = board.kings[color]
+    opboards = board.boards[1-color]
+
+    # Enemy sliders, which would attack the king on an empty board
+    if board.variant in ASEAN_VARIANTS:
+        snipers = opboards[ROOK] & rookAttacks[kcord][0]
+    else:
+        snipers = (opboards[ROOK] | opboards[QUEEN]) & rookAttacks[kcord][0]
+        snipers |= (opboards[BISHOP] | opboards[QUEEN]) & bishopAttacks[kcord][0]
+
+    pinned = 0
+    blocker = board.blocker
+    friends = board.friends[color]
+    for cord in iterBits(snipers):
+        # A single friendly piece between the king and the slider is pinned
+        between = clearBit(fromToRay[kcord][cord], cord) & blocker
+        if between and not between & (between-1) and between & friends:
+            pinned |= between
+
+    return pinned
+
 def staticExchangeEvaluate (board, moveOrTcord, color=None):
     """ The GnuChess Static Exchange Evaluator (or SEE for short).
     First determine the target square.  Create a bitboard of all squares
@@ -201,9 +195,10 @@ def staticExchangeEvaluate (board, moveOrTcord, color=None):
         ours = getAttacks (board, tcord, color)
         ours = clearBit (ours, fcord)
         theirs = getAttacks (board, tcord, opcolor)
+        occupied = clearBit (board.blocker, fcord)
     
         if xray[board.arBoard[fcord]]:
-            ours, theirs = addXrayPiece (board, tcord, fcord, color, ours, theirs)
+            ours, theirs = addXrayPiece (board, tcord, occupied, color, ours, theirs)
         
         from pychess.Variants import variants
         PROMOTIONS = variants[board.variant].PROMOTIONS
@@ -224,6 +219,7 @@ def staticExchangeEvaluate (board, moveOrTcord, color=None):
         
         ours = getAttacks (board, tcord, color)
         theirs = getAttacks (board, tcord, opcolor)
+        occupied = board.blocker
         
         lastval = -PIECE_VALUES[board.arBoard[tcord]]
     
@@ -233,8 +229,9 @@ def staticExchangeEvaluate (board, moveOrTcord, color=None):
             if r:
                 cord = firstBit(r)
                 theirs = clearBit(theirs, cord)
+                occupied = clearBit(occupied, cord)
                 if xray[piece]:
-                    ours, theirs = addXrayPiece (board, tcord, cord,
+                    ours, theirs = addXrayPiece (board, tcord, occupied,
                                                  color, ours, theirs)
                 swaplist.append(swaplist[-1] + lastval)
                 lastval = PIECE_VALUES[piece]
@@ -248,8 +245,9 @@ def staticExchangeEvaluate (board, moveOrTcord, color=None):
             if r:
                 cord = firstBit(r)
                 ours = clearBit(ours, cord)
+                occupied = clearBit(occupied, cord)
                 if xray[piece]:
-                    ours, theirs = addXrayPiece (board, tcord, cord,
+                    ours, theirs = addXrayPiece (board, tcord, occupied,
                                                  color, ours, theirs)
                 swaplist.append(swaplist[-1] + lastval)
                 lastval = -PIECE_VALUES[piece]
@@ -270,32 +268,29 @@ def staticExchangeEvaluate (board, moveOrTcord, color=None):
 
 xray = (False, True, False, True, True, True, False)
 
-def addXrayPiece (board, tcord, fcord, color, ours, theirs):
+def addXrayPiece (board, tcord, occupied, color, ours, theirs):
     """ This is used by swapOff.
     The purpose of this routine is to find a piece which attack through
     another piece (e.g. two rooks, Q+B, B+P, etc.) Color is the side attacking
-    the square where the swapping is to be done. """
+    the square where the swapping is to be done. Occupied is the blocker
+    board, without the pieces which have already been swapped off. """
     
-    dir = directions[tcord][fcord]
-    a = rays[fcord][dir] & board.blocker
-    if not a: return ours, theirs
-    
-    if tcord < fcord:
-        ncord = firstBit(a)
-    else: ncord = lastBit(a)
-    
-    piece = board.arBoard[ncord]
+    boards = board.boards
     if board.variant in ASEAN_VARIANTS:
-        cond = piece == ROOK and dir > 3
+        bits = rookAttacks[tcord][occupied & rookMasks[tcord]] & \
+               (boards[WHITE][ROOK] | boards[BLACK][ROOK])
     else:
-        cond = piece == QUEEN or (piece == ROOK and dir > 3) or \
-                         (piece == BISHOP and dir < 4)
-    if cond:
-        bit = bitPosArray[ncord]
-        if bit & board.friends[color]:
-            ours |= bit
-        else:
-            theirs |= bit
+        queens = boards[WHITE][QUEEN] | boards[BLACK][QUEEN]
+        bits = rookAttacks[tcord][occupied & rookMasks[tcord]] & \
+               (boards[WHITE][ROOK] | boards[BLACK][ROOK] | queens)
+        bits |= bishopAttacks[tcord][occupied & bishopMasks[tcord]] & \
+                (boards[WHITE][BISHOP] | boards[BLACK][BISHOP] | queens)
+    bits &= occupied
+    
+    if bits:
+        friends = board.friends[color]
+        ours |= bits & friends
+        theirs |= bits & ~friends
     
     return ours, theirs
 
@@ -305,7 +300,7 @@ def defends (board, fcord, tcord):
         Doesn't test check. """
     
     # Work on a board copy, as we are going to change some stuff
-    board = board.clone()
+    board = board.clone(history=False)
     
     if board.friends[WHITE] & bitPosArray[fcord]:
         color = WHITE
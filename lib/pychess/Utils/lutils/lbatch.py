@@ -0,0 +1,147 @@
+from __future__ import absolute_import
+
+################################################################################
+# Evaluation of many positions at a time, for scoring databases and training.  #
+# The positions are turned into columns of features, one array per feature    #
+# with one item per position, and the scores are summed from the columns of    #
+# the evaluation terms.                                                        #
+################################################################################
+
+from array import array
+from multiprocessing import Pool
+
+from pychess.Utils.const import *
+from .ldata import *
+from .LBoard import LBoard
+from .magic import rookAttacks, rookMasks, bishopAttacks, bishopMasks
+from .leval import TERMS, scoreTerms
+
+# Further features: the phase of leval.evalMaterial, the material, mobility
+# and piece counts of each color, and the passed and weak pawns found by
+# leval.cacheablePawnInfo. The pawn masks are lists of bitboards, as array
+# has no 64 bit type in Python 2.
+PIECE_FEATURES = tuple("wb"[color] + reprSign[piece]
+                       for color in (WHITE, BLACK) for piece in range(PAWN, KING+1))
+FEATURES = TERMS + ("phase", "whiteMaterial", "blackMaterial",
+                    "whiteMobility", "blackMobility") + PIECE_FEATURES
+MASKS = ("passed", "weak")
+
+def toBoards (positions, variant=NORMALCHESS):
+    """ Yields the positions, which may be LBoards or fens, as LBoards """
+    for position in positions:
+        if isinstance(position, LBoard):
+            yield position
+        else:
+            board = LBoard(variant)
+            board.applyFen(position)
+            yield board
+
+def mobility (board, color):
+    """ The number of squares the knights, bishops, rooks and queens of color
+        can move to, by the moves of standard chess """
+
+    _moveArray = moveArray
+    pieces = board.boards[color]
+    notfriends = ~board.friends[color]
+    blocker = board.blocker
+
+    count = 0
+    for cord in iterBits(pieces[KNIGHT]):
+        count += bin(_moveArray[KNIGHT][cord] & notfriends).count("1")
+    for cord in iterBits(pieces[BISHOP] | pieces[QUEEN]):
+        count += bin(bishopAttacks[cord][blocker & bishopMasks[cord]] & notfriends).count("1")
+    for cord in iterBits(pieces[ROOK] | pieces[QUEEN]):
+        count += bin(rookAttacks[cord][blocker & rookMasks[cord]] & notfriends).count("1")
+    return count
+
+def extractFeatures (positions, color=None, variant=NORMALCHESS):
+    """ Returns a dict of the FEATURES, each an array('i') with an item per
+        position, and of the MASKS, each a list. positions is an iterable of
+        LBoards or fens of variant. The TERMS are from the point of view of
+        color, or of the side to move in each position if color is None. """
+
+    columns = dict((name, array('i')) for name in FEATURES)
+    columns.update((name, []) for name in MASKS)
+    termColumns = [columns[name] for name in TERMS]
+    pieceColumns = [columns[name] for name in PIECE_FEATURES]
+
+    for board in toBoards(positions, variant):
+        terms, phase, passed, weaked = scoreTerms(board,
+                                   board.color if color is None else color)
+        for column, term in zip(termColumns, terms):
+            column.append(term)
+        columns["phase"].append(phase)
+        columns["whiteMaterial"].append(board.material[WHITE])
+        columns["blackMaterial"].append(board.material[BLACK])
+        columns["whiteMobility"].append(mobility(board, WHITE))
+        columns["blackMobility"].append(mobility(board, BLACK))
+        counts = board.pieceCount[WHITE][PAWN:KING+1] + board.pieceCount[BLACK][PAWN:KING+1]
+        for column, count in zip(pieceColumns, counts):
+            column.append(count)
+        columns["passed"].append(passed)
+        columns["weak"].append(weaked)
+
+    return columns
+
+def scoreFeatures (columns):
+    """ The scores of the positions of the columns from extractFeatures, as
+        the sums of their TERMS, added a column at a time """
+    scores = array('i', columns[TERMS[0]])
+    for name in TERMS[1:]:
+        scores = array('i', [a + b for a, b in zip(scores, columns[name])])
+    return scores
+
+def _chunks (positions, size):
+    chunk = []
+    for position in positions:
+        chunk.append(position)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _evaluateChunk (job):
+    positions, color, variant = job
+    return evaluateBatch(positions, color, variant)
+
+def evaluateBatch (positions, color=None, variant=NORMALCHESS, processes=1,
+                   size=4096):
+    """ The scores of positions, like leval.evaluateComplete would give them.
+        With more than one process, chunks of size positions are evaluated
+        by a pool of processes, which mostly pays off for fens, as parsing
+        them costs more than evaluating them.
+
+        The tolerance is zero: the scores are exactly those of
+        evaluateComplete, unless leval.randomval is set, in which case they
+        are off by randomval.
+        Unlike evaluateComplete, the evaluation hash of the search is neither
+        probed nor filled. """
+
+    if processes > 1:
+        scores = array('i')
+        pool = Pool(processes)
+        try:
+            jobs = ((chunk, color, variant) for chunk in _chunks(positions, size))
+            for chunkScores in pool.imap(_evaluateChunk, jobs):
+                scores.extend(chunkScores)
+        finally:
+            pool.close()
+            pool.join()
+        return scores
+
+    # Only the TERMS columns are needed for the scores
+    columns = dict((name, array('i')) for name in TERMS)
+    termColumns = [columns[name] for name in TERMS]
+    for board in toBoards(positions, variant):
+        terms = scoreTerms(board, board.color if color is None else color)[0]
+        for column, term in zip(termColumns, terms):
+            column.append(term)
+    return scoreFeatures(columns)
+
+def iterBatches (positions, size=4096, color=None, variant=NORMALCHESS):
+    """ Yields the columns of extractFeatures for chunks of size positions,
+        so streams of any length can be scored in bounded memory """
+
+    for chunk in _chunks(positions, size):
+        yield extractFeatures(chunk, color, variant)
@@ -31,10 +31,12 @@ MAXPLY = 10
 # Maximum possible score. Mate in n ply is +/- (MATE_VALUE-n).
 # The hash structure only allows signed 16-bit scores.
 MATE_VALUE = MAXVAL = 32767
+# Scores within MATE_DEPTH of +/- MATE_VALUE are mate scores
+MATE_DEPTH = 255
 def VALUE_AT_PLY(val, ply):
     """ Return the value of scoring val a given number of plies into the future. """
-    if val >= +32512: return val - ply
-    if val <= -32512: return val + ply
+    if val >= +MATE_VALUE-MATE_DEPTH: return val - ply
+    if val <= -MATE_VALUE+MATE_DEPTH: return val + ply
     return val
 
 # How many points does it give to have the piece standing i cords from the
@@ -135,6 +137,39 @@ distance[KNIGHT][H1][G2] = distance[KNIGHT][G2][H1] = 4
 distance[KNIGHT][A8][B7] = distance[KNIGHT][B7][A8] = 4
 distance[KNIGHT][H8][G7] = distance[KNIGHT][G7][H8] = 4
 
+###############################################################################
+# King tropism tables. tropisms[piece][pcord][kcord] is the bonus for having a
+# piece on pcord, close to the enemy king on kcord. LBoard keeps the sum for
+# the knights, bishops, rooks and queens of each color.
+###############################################################################
+
+pawnTropism = [[0]*64 for i in range(64)]
+bishopTropism = [[0]*64 for i in range(64)]
+knightTropism = [[0]*64 for i in range(64)]
+rookTropism = [[0]*64 for i in range(64)]
+queenTropism = [[0]*64 for i in range(64)]
+
+for pcord in range(64):
+    for kcord in range(pcord+1, 64):
+        pawnTropism[pcord][kcord] = pawnTropism[kcord][pcord] = \
+            (14 - taxicab[pcord][kcord])**2 * 10/169 # 0 - 10
+        knightTropism[pcord][kcord] = knightTropism[kcord][pcord] = \
+            (6-distance[KNIGHT][pcord][kcord])**2 * 2 # 0 - 50
+        bishopTropism[pcord][kcord] = bishopTropism[kcord][pcord] = \
+            (14 - distance[BISHOP][pcord][kcord] * sdistance[pcord][kcord])**2 * 30//169 # 0 - 30 
+        rookTropism[pcord][kcord] = rookTropism[kcord][pcord] = \
+            (14 - distance[ROOK][pcord][kcord] * sdistance[pcord][kcord])**2 * 40//169 # 0 - 40
+        queenTropism[pcord][kcord] = queenTropism[kcord][pcord] = \
+            (14 - distance[QUEEN][pcord][kcord] * sdistance[pcord][kcord])**2 * 50//169 # 0 - 50
+
+tropisms = {
+    PAWN: pawnTropism,
+    KNIGHT: knightTropism,
+    BISHOP: bishopTropism,
+    ROOK: rookTropism,
+    QUEEN: queenTropism
+    }
+
 ###############################################################################
 # Boards used for evaluating
 ###############################################################################
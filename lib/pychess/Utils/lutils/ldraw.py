@@ -74,7 +74,10 @@ def testPlayerMatingMaterial (board, color):
 # certain king verus king and pawn posistion is winable.
 
 def test (board):
-    """ Test if the position is drawn. Two-fold repetitions are counted. """
-    return board.repetitionCount (drawThreshold=2) > 1 or \
+    """ Test if the position is drawn. Two-fold repetitions are counted.
+        This is called at every node of the search, so the repetition test is
+        skipped when no position can have repeated since the last irreversible
+        move. """
+    return board.fifty >= 4 and board.repetitionCount (drawThreshold=2) > 1 or \
            testFifty (board) or \
            testMaterial (board)
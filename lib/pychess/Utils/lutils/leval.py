@@ -16,10 +16,70 @@ from struct import Struct, pack_into, unpack_from
 #from random import randint
 randomval = 0 #randint(8,12)/10.
 
+################################################################################
+# Evaluation hash                                                              #
+################################################################################
+
+# The complete evaluation is cached by board.hash, without buckets. Store:
+# hash        the full hash key of the position
+# variant     the variant the position was evaluated for
+# flags       color, and the state of evalDev, which isn't in the hash key
+# score       score from color's point of view
+# The holdings of the drop variants aren't in the hash key either, so their
+# positions aren't cached.
+evalEntryType = Struct('=Q B B i')
+EVAL_HASH_SIZE = 65536
+evalHashSize = EVAL_HASH_SIZE
+evaltable = create_string_buffer(EVAL_HASH_SIZE * evalEntryType.size)
+evalProbes = 0
+evalHits = 0
+
+def clearEvalTable():
+    memset(evaltable, 0, evalHashSize * evalEntryType.size)
+
+def setEvalHashSize (size):
+    """ Replace the evaluation hash by an empty one of about size bytes """
+    global evaltable, evalHashSize
+    evalHashSize = max(1, size // evalEntryType.size)
+    evaltable = create_string_buffer(evalHashSize * evalEntryType.size)
+
+def hitRates ():
+    """ The percentages of the probes of the evaluation and the pawn hash,
+        which were hits, since resetHitRates """
+    return (100. * evalHits / evalProbes if evalProbes else 0.,
+            100. * pawnHits / pawnProbes if pawnProbes else 0.)
+
+def resetHitRates ():
+    global evalProbes, evalHits, pawnProbes, pawnHits
+    evalProbes = evalHits = pawnProbes = pawnHits = 0
+
 def evaluateComplete (board, color):
     """ A detailed evaluation function, taking into account
         several positional factors """
     
+    global evalProbes, evalHits
+    
+    if board.variant in DROP_VARIANTS:
+        return scorePosition (board, color)
+    
+    flags = color
+    if board.plyCount < 38:
+        flags |= 2 | board.hasCastled[WHITE] << 2 | board.hasCastled[BLACK] << 3
+    offset = (board.hash % evalHashSize) * evalEntryType.size
+    evalProbes += 1
+    hash, variant, entryflags, score = evalEntryType.unpack_from(evaltable, offset)
+    if hash == board.hash and variant == board.variant and entryflags == flags:
+        evalHits += 1
+        return score
+    
+    score = scorePosition (board, color)
+    evalEntryType.pack_into(evaltable, offset, board.hash, board.variant, flags, score)
+    return score
+
+def scorePosition (board, color):
+    """ The evaluation of evaluateComplete, without the cache. The terms of
+        scoreTerms are summed inline here, as this is the search's hot path. """
+    
     s, phase = evalMaterial (board, color)
     if board.variant in (LOSERSCHESS, SUICIDECHESS):
         return s
@@ -27,7 +87,7 @@ def evaluateComplete (board, color):
     s += evalRooks (board, color, phase)         - evalRooks (board, 1-color, phase)
     s += evalDoubleQR7 (board, color, phase)     - evalDoubleQR7 (board, 1-color, phase)
     s += evalKing (board, color, phase)          - evalKing (board, 1-color, phase)
-    s += evalKingTropism (board, color, phase)   - evalKingTropism (board, 1-color, phase)
+    s += board.tropism[color]                    - board.tropism[1-color]
     if board.variant in ASEAN_VARIANTS:
         return s
     s += evalDev (board, color, phase)           -  evalDev (board, 1-color, phase)
@@ -42,40 +102,53 @@ def evaluateComplete (board, color):
     
     return s
 
+# The terms of scoreTerms. Their sum, plus randomval for standard chess, is
+# the score of scorePosition.
+TERMS = ("material", "bishops", "rooks", "doubleQR7", "king", "tropism",
+         "development", "pawns", "pawnStructure", "trappedBishops")
+
+def scoreTerms (board, color):
+    """ The TERMS of the evaluation of board, from the point of view of
+        color, as well as the phase and the passed and weak pawn masks.
+        Terms that don't apply to the variant are 0. """
+    
+    opcolor = 1-color
+    terms = [0] * len(TERMS)
+    passed = weaked = 0
+    
+    terms[0], phase = evalMaterial (board, color)
+    if board.variant in (LOSERSCHESS, SUICIDECHESS):
+        return terms, phase, passed, weaked
+    terms[1] = evalBishops (board, color, phase)   - evalBishops (board, opcolor, phase)
+    terms[2] = evalRooks (board, color, phase)     - evalRooks (board, opcolor, phase)
+    terms[3] = evalDoubleQR7 (board, color, phase) - evalDoubleQR7 (board, opcolor, phase)
+    terms[4] = evalKing (board, color, phase)      - evalKing (board, opcolor, phase)
+    terms[5] = board.tropism[color]                - board.tropism[opcolor]
+    if board.variant in ASEAN_VARIANTS:
+        return terms, phase, passed, weaked
+    terms[6] = evalDev (board, color, phase)       - evalDev (board, opcolor, phase)
+    if board.variant == ATOMICCHESS:
+        return terms, phase, passed, weaked
+    pawnScore, passed, weaked = cacheablePawnInfo (board, phase)
+    terms[7] = pawnScore if color == WHITE else -pawnScore
+    terms[8] = evalPawnStructure (board, color, phase, passed, weaked) - \
+               evalPawnStructure (board, opcolor, phase, passed, weaked)
+    terms[9] = evalTrappedBishops (board, color)
+    
+    return terms, phase, passed, weaked
+
 ################################################################################
 # evalMaterial                                                                 #
 ################################################################################
 
 def evalMaterial (board, color):
-    pieceCount = board.pieceCount
     opcolor = 1-color
-    material = [0, 0]
+    material = board.material
     if board.variant == CRAZYHOUSECHESS:
+        material = material[:]
         for piece in range(PAWN, KING):
-            material[WHITE] += CRAZY_PIECE_VALUES[piece] * pieceCount[WHITE][piece]
-            material[BLACK] += CRAZY_PIECE_VALUES[piece] * pieceCount[BLACK][piece]
             material[WHITE] += CRAZY_PIECE_VALUES[piece] * board.holding[WHITE][piece]
             material[BLACK] += CRAZY_PIECE_VALUES[piece] * board.holding[BLACK][piece]
-    elif board.variant == LOSERSCHESS:
-        for piece in range(PAWN, KING):
-            material[WHITE] += pieceCount[WHITE][piece]
-            material[BLACK] += pieceCount[BLACK][piece]
-    elif board.variant == SUICIDECHESS:
-        for piece in range(PAWN, KING+1):
-            material[WHITE] += pieceCount[WHITE][piece]
-            material[BLACK] += pieceCount[BLACK][piece]
-    elif board.variant == ATOMICCHESS:
-        for piece in range(PAWN, KING+1):
-            material[WHITE] += ATOMIC_PIECE_VALUES[piece] * pieceCount[WHITE][piece]
-            material[BLACK] += ATOMIC_PIECE_VALUES[piece] * pieceCount[BLACK][piece]
-    elif board.variant in ASEAN_VARIANTS:
-        for piece in range(PAWN, KING+1):
-            material[WHITE] += ASEAN_PIECE_VALUES[piece] * pieceCount[WHITE][piece]
-            material[BLACK] += ASEAN_PIECE_VALUES[piece] * pieceCount[BLACK][piece]
-    else:
-        for piece in range(PAWN, KING):
-            material[WHITE] += PIECE_VALUES[piece] * pieceCount[WHITE][piece]
-            material[BLACK] += PIECE_VALUES[piece] * pieceCount[BLACK][piece]
     
     phase = max(1, 8 - (material[WHITE] + material[BLACK]) // 1150)
     
@@ -96,7 +169,7 @@ def evalMaterial (board, color):
             return val, phase
         return -val, phase
     
-    pawns = pieceCount[leading][PAWN]
+    pawns = board.pieceCount[leading][PAWN]
     matDiff = material[leading] - material[1-leading]
     val = min(2400, matDiff) + \
           (matDiff * (12000-matTotal) * pawns) // (6400 * (pawns+1))
@@ -110,36 +183,10 @@ def evalMaterial (board, color):
 # evalKingTropism                                                              #
 ################################################################################
 
-pawnTropism = [[0]*64 for i in range(64)]
-bishopTropism = [[0]*64 for i in range(64)]
-knightTropism = [[0]*64 for i in range(64)]
-rookTropism = [[0]*64 for i in range(64)]
-queenTropism = [[0]*64 for i in range(64)]
-
-for pcord in range(64):
-    for kcord in range(pcord+1, 64):
-        pawnTropism[pcord][kcord] = pawnTropism[kcord][pcord] = \
-            (14 - taxicab[pcord][kcord])**2 * 10/169 # 0 - 10
-        knightTropism[pcord][kcord] = knightTropism[kcord][pcord] = \
-            (6-distance[KNIGHT][pcord][kcord])**2 * 2 # 0 - 50
-        bishopTropism[pcord][kcord] = bishopTropism[kcord][pcord] = \
-            (14 - distance[BISHOP][pcord][kcord] * sdistance[pcord][kcord])**2 * 30//169 # 0 - 30 
-        rookTropism[pcord][kcord] = rookTropism[kcord][pcord] = \
-            (14 - distance[ROOK][pcord][kcord] * sdistance[pcord][kcord])**2 * 40//169 # 0 - 40
-        queenTropism[pcord][kcord] = queenTropism[kcord][pcord] = \
-            (14 - distance[QUEEN][pcord][kcord] * sdistance[pcord][kcord])**2 * 50//169 # 0 - 50
-
-tropisms = {
-    PAWN: pawnTropism,
-    KNIGHT: knightTropism,
-    BISHOP: bishopTropism,
-    ROOK: rookTropism,
-    QUEEN: queenTropism
-    }
-    
 def evalKingTropism (board, color, phase):
     """ All other things being equal, having your Knights, Queens and Rooks
-        close to the opponent's king is a good thing """
+        close to the opponent's king is a good thing. LBoard.tropism holds
+        the same sums, kept up to date as moves are made. """
     _tropisms = tropisms
     _lsb = lsb
     opcolor = 1-color
@@ -176,20 +223,32 @@ def evalKingTropism (board, color, phase):
 pawnEntryType = Struct('=H h Q Q')
 PAWN_HASH_SIZE  = 16384
 PAWN_PHASE_KEY  = (0x343d, 0x055d, 0x3d3c, 0x1a1c, 0x28aa, 0x19ee, 0x1538, 0x2a99)
+pawnHashSize = PAWN_HASH_SIZE
 pawntable = create_string_buffer(PAWN_HASH_SIZE * pawnEntryType.size)
+pawnProbes = 0
+pawnHits = 0
     
 def clearPawnTable():
-        memset(pawntable, 0, PAWN_HASH_SIZE * pawnEntryType.size)
+        memset(pawntable, 0, pawnHashSize * pawnEntryType.size)
+
+def setPawnHashSize (size):
+    """ Replace the pawn hash by an empty one of about size bytes """
+    global pawntable, pawnHashSize
+    pawnHashSize = max(1, size // pawnEntryType.size)
+    pawntable = create_string_buffer(pawnHashSize * pawnEntryType.size)
 
 def probePawns (board, phase):
-    index = (board.pawnhash % PAWN_HASH_SIZE) ^ PAWN_PHASE_KEY[phase-1]
+    global pawnProbes, pawnHits
+    pawnProbes += 1
+    index = (board.pawnhash ^ PAWN_PHASE_KEY[phase-1]) % pawnHashSize
     key, score, passed, weaked = pawnEntryType.unpack_from(pawntable, index * pawnEntryType.size)
     if key == (board.pawnhash >> 14) & 0xffff:
+        pawnHits += 1
         return score, passed, weaked
     return None
 
 def recordPawns (board, phase, score, passed, weaked):
-    index = (board.pawnhash % PAWN_HASH_SIZE) ^ PAWN_PHASE_KEY[phase-1]
+    index = (board.pawnhash ^ PAWN_PHASE_KEY[phase-1]) % pawnHashSize
     key = (board.pawnhash >> 14) & 0xffff
     pawnEntryType.pack_into(pawntable, index * pawnEntryType.size, key, score, passed, weaked)
 
@@ -70,7 +70,7 @@ def determineAlgebraicNotation (algnot):
 
 def listToSan (board, moves):
     # Work on a copy to ensure we don't break things
-    board = board.clone()
+    board = board.clone(history=False)
     sanmoves = []
     for move in moves:
         san = toSAN (board, move)
@@ -84,7 +84,7 @@ def listToSan (board, moves):
 
 def listToMoves (board, movstrs, type=None, testvalidate=False, ignoreErrors=False):
     # Work on a copy to ensure we don't break things
-    board = board.clone()
+    board = board.clone(history=False)
     moves = []
 
     for mstr in movstrs:
@@ -122,7 +122,7 @@ def toSAN (board, move, localRepr=False):
         The board should be prior to the move """
 
     def check_or_mate():
-        board_clone = board.clone()
+        board_clone = board.clone(history=False)
         board_clone.applyMove(move)
         sign = ""
         if board_clone.isChecked():
@@ -183,7 +183,7 @@ def toSAN (board, move, localRepr=False):
         xs = []
         ys = []
         
-        board_clone = board.clone()
+        board_clone = board.clone(history=False)
         for altmove in genAllMoves(board_clone, drops=False):
             mfcord = FCORD(altmove)
             if board_clone.arBoard[mfcord] == fpiece and \
@@ -382,7 +382,7 @@ def parseSAN (board, san):
                         continue
                     if ffile != None and ffile != FILE(f):
                         continue
-                    board_clone = board.clone()
+                    board_clone = board.clone(history=False)
                     board_clone.applyMove(move)
                     if board_clone.opIsChecked():
                         continue
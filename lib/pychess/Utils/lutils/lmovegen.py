@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 from .bitboard import *
 from .attack import *
+from .magic import rookAttacks, rookMasks, bishopAttacks, bishopMasks
 from pychess.Utils.const import *
 
 ################################################################################
@@ -70,85 +71,110 @@ def genCastles (board):
 
 def genPieceMoves(board, piece, tcord):
     """"
-    Used by parseSAN only to accelerate it a bit
+    Used by parseSAN only to accelerate it a bit. The pieces that can move
+    to tcord are found by the attacks from tcord, so only the moves to
+    tcord are generated.
     """
     moves = set()
-    friends = board.friends[board.color]
-    notfriends = ~friends
-    if piece == KNIGHT:
-        knights = board.boards[board.color][KNIGHT]
-        knightMoves = moveArray[KNIGHT]
-        for fcord in iterBits(knights):
-            if tcord in iterBits(knightMoves[fcord] & notfriends):
-                moves.add(newMove(fcord, tcord))
+    if board.friends[board.color] & bitPosArray[tcord]:
         return moves
+    pieces = board.boards[board.color][piece]
+
+    if piece == KNIGHT:
+        fcords = moveArray[KNIGHT][tcord] & pieces
         
-    if piece == BISHOP:
-        bishops = board.boards[board.color][BISHOP]
+    elif piece == BISHOP:
         if board.variant in ASEAN_VARIANTS:
-            bishopMoves = moveArray[ASEAN_WBISHOP if board.color == WHITE else ASEAN_BBISHOP]
-            for fcord in iterBits(bishops):
-                if tcord in iterBits(bishopMoves[fcord] & notfriends):
-                    moves.add(newMove(fcord, tcord))
-            return moves
+            # The moves of the bishops of one color are those of the other
+            # color backwards
+            fcords = moveArray[ASEAN_BBISHOP if board.color == WHITE else ASEAN_WBISHOP][tcord] & pieces
         else:
-            blocker = board.blocker
-            for fcord in iterBits(bishops):
-                attackBoard = attack45 [fcord][ray45 [fcord] & blocker] | \
-                              attack135[fcord][ray135[fcord] & blocker]
-                if tcord in iterBits(attackBoard & notfriends):
-                    moves.add(newMove(fcord, tcord))
-            return moves
-        
-    if piece == ROOK:
-        blocker = board.blocker
-        rooks = board.boards[board.color][ROOK]
-        for fcord in iterBits(rooks):
-            attackBoard = attack00[fcord][ray00[fcord] & blocker] | \
-                          attack90[fcord][ray90[fcord] & blocker]
-            if tcord in iterBits(attackBoard & notfriends):
-                moves.add(newMove(fcord, tcord))
-        return moves
+            fcords = bishopAttacks[tcord][board.blocker & bishopMasks[tcord]] & pieces
+        
+    elif piece == ROOK:
+        fcords = rookAttacks[tcord][board.blocker & rookMasks[tcord]] & pieces
 
-    if piece == QUEEN:
-        queens = board.boards[board.color][QUEEN]
+    elif piece == QUEEN:
         if board.variant in ASEAN_VARIANTS:
-            queenMoves = moveArray[ASEAN_QUEEN]
-            for fcord in iterBits(queens):
-                if tcord in iterBits(queenMoves[fcord] & notfriends):
-                    moves.add(newMove(fcord, tcord))
+            fcords = moveArray[ASEAN_QUEEN][tcord] & pieces
             # Cambodian extra first move
             if board.variant == CAMBODIANCHESS:
                 if board.is_first_move[QUEEN][board.color]:
                     if board.color == WHITE:
-                        if not board.arBoard[E3]:
+                        if tcord == E3 and not board.arBoard[E3]:
                             moves.add(newMove(E1, E3))
                     else:
-                        if not board.arBoard[D6]:
+                        if tcord == D6 and not board.arBoard[D6]:
                             moves.add(newMove(D8, D6))
-            return moves
         else:
             blocker = board.blocker
-            for fcord in iterBits(queens):
-                attackBoard = attack45 [fcord][ray45 [fcord] & blocker] | \
-                              attack135[fcord][ray135[fcord] & blocker]
-                if tcord in iterBits(attackBoard & notfriends):
-                    moves.add(newMove(fcord, tcord))
-
-                attackBoard = attack00[fcord][ray00[fcord] & blocker] | \
-                              attack90[fcord][ray90[fcord] & blocker]
-                if tcord in iterBits(attackBoard & notfriends):
-                    moves.add(newMove(fcord, tcord))
-            return moves
-        
-    if board.variant == SUICIDECHESS and piece == KING:
-        kings = board.boards[board.color][KING]
-        if kings:
-            kingMoves = moveArray[KING]
-            for fcord in iterBits(kings):
-                for tcord in iterBits(kingMoves[fcord] & notfriends):
-                    moves.add(newMove(fcord, tcord))
-            return moves
+            fcords = (bishopAttacks[tcord][blocker & bishopMasks[tcord]] | \
+                      rookAttacks[tcord][blocker & rookMasks[tcord]]) & pieces
+        
+    elif board.variant == SUICIDECHESS and piece == KING:
+        fcords = moveArray[KING][tcord] & pieces
+
+    else:
+        return None
+
+    for fcord in iterBits(fcords):
+        moves.add(newMove(fcord, tcord))
+    return moves
+
+def isPseudoLegal (board, move):
+    """ A fast test of whether genAllMoves(board) would yield move.
+        Only normal moves and promotions of the orthodox pieces are
+        recognised. Castling, enpassant and drop moves, as well as the asean
+        pieces, always give False. Used by the search to check hash and killer
+        moves, before any move list is generated. """
+    from pychess.Variants import variants
+
+    flag = move >> 12
+    if flag != NORMAL_MOVE and flag not in PROMOTIONS:
+        return False
+
+    fcord = (move >> 6) & 63
+    tcord = move & 63
+    color = board.color
+    friends = board.friends[color]
+    if not friends & bitPosArray[fcord]:
+        return False
+    tbit = bitPosArray[tcord]
+    if friends & tbit:
+        return False
+
+    fpiece = board.arBoard[fcord]
+    blocker = board.blocker
+
+    if fpiece == PAWN:
+        if tcord in variants[board.variant].PROMOTION_ZONE[color]:
+            if flag not in variants[board.variant].PROMOTIONS:
+                return False
+        elif flag != NORMAL_MOVE:
+            return False
+
+        if board.friends[1-color] & tbit:
+            return bool(moveArray[color == WHITE and PAWN or BPAWN][fcord] & tbit)
+
+        step = color == WHITE and 8 or -8
+        if tcord == fcord + step:
+            return not blocker & tbit
+        if tcord == fcord + 2*step and RANK(fcord) == (color == WHITE and 1 or 6):
+            return not blocker & (tbit | bitPosArray[fcord + step])
+        return False
+
+    if flag != NORMAL_MOVE:
+        return False
+
+    if fpiece in (KNIGHT, KING):
+        return bool(moveArray[fpiece][fcord] & tbit)
+
+    attackBoard = 0
+    if fpiece in (ROOK, QUEEN):
+        attackBoard |= rookAttacks[fcord][blocker & rookMasks[fcord]]
+    if fpiece in (BISHOP, QUEEN):
+        attackBoard |= bishopAttacks[fcord][blocker & bishopMasks[fcord]]
+    return bool(attackBoard & tbit)
 
 def genAllMoves (board, drops=True):
     from pychess.Variants import variants
@@ -201,8 +227,7 @@ def genAllMoves (board, drops=True):
     if board.variant in ASEAN_VARIANTS:
         # Rooks 
         for cord in iterBits(rooks):
-            attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                          attack90[cord][ray90[cord] & blocker]
+            attackBoard = rookAttacks[cord][blocker & rookMasks[cord]]
             for c in iterBits(attackBoard & notfriends):
                 yield newMove(cord, c)
 
@@ -221,15 +246,13 @@ def genAllMoves (board, drops=True):
     else:
         # Rooks and Queens
         for cord in iterBits(rooks | queens):
-            attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                          attack90[cord][ray90[cord] & blocker]
+            attackBoard = rookAttacks[cord][blocker & rookMasks[cord]]
             for c in iterBits(attackBoard & notfriends):
                 yield newMove(cord, c)
     
         # Bishops and Queens
         for cord in iterBits(bishops | queens):
-            attackBoard = attack45 [cord][ray45 [cord] & blocker] | \
-                          attack135[cord][ray135[cord] & blocker]
+            attackBoard = bishopAttacks[cord][blocker & bishopMasks[cord]]
             for c in iterBits(attackBoard & notfriends):
                 yield newMove(cord, c)
     
@@ -415,14 +438,12 @@ def genCaptures (board):
     # Rooks and Queens
     if board.variant in ASEAN_VARIANTS:
         for cord in iterBits(rooks):
-            attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                          attack90[cord][ray90[cord] & blocker]
+            attackBoard = rookAttacks[cord][blocker & rookMasks[cord]]
             for c in iterBits(attackBoard & enemies):
                 yield newMove(cord, c)
     else:
         for cord in iterBits(rooks|queens):
-            attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                          attack90[cord][ray90[cord] & blocker]
+            attackBoard = rookAttacks[cord][blocker & rookMasks[cord]]
             for c in iterBits(attackBoard & enemies):
                 yield newMove(cord, c)
     
@@ -438,8 +459,7 @@ def genCaptures (board):
                 yield newMove(cord, c)
     else:
         for cord in iterBits(bishops|queens):
-            attackBoard = attack45 [cord][ray45 [cord] & blocker] | \
-                          attack135[cord][ray135[cord] & blocker]
+            attackBoard = bishopAttacks[cord][blocker & bishopMasks[cord]]
             for c in iterBits(attackBoard & enemies):
                 yield newMove(cord, c)
     
@@ -601,7 +621,7 @@ def genCheckEvasions (board):
                     for piece in holding:
                         if holding[piece] > 0:
                             if piece == PAWN:
-                                if cord in promotion_zone:
+                                if cord >= 56 or cord <= 7:
                                     continue
                             yield newMove (piece, cord, DROP)
     
@@ -619,6 +639,88 @@ def genCheckEvasions (board):
         if not isAttacked (board, cord, opcolor):
             yield newMove (kcord, cord)
 
+################################################################################
+#   Generate strictly legal moves                                              #
+################################################################################
+
+def genLegalMoves (board):
+    """ Like genAllMoves, but only yields the moves not leaving our own king in
+        check. Instead of applying every move, the pieces pinned on the king
+        are found first. A move is then only tested the slow way, if it is
+        castling or enpassant. """
+    variant = board.variant
+    color = board.color
+    opcolor = 1-color
+
+    if variant == SUICIDECHESS:
+        for move in genAllMoves(board):
+            yield move
+        return
+
+    if variant == ATOMICCHESS or \
+            variant in ASEAN_VARIANTS and board.isChecked():
+        from pychess.Variants.atomic import kingExplode
+        for move in genAllMoves(board):
+            if variant == ATOMICCHESS:
+                # Exploding the opponent king takes precedence over check
+                if kingExplode(board, move, color):
+                    continue
+                if kingExplode(board, move, opcolor):
+                    yield move
+                    continue
+            board.applyMove(move)
+            illegal = board.opIsChecked()
+            board.popMove()
+            if not illegal:
+                yield move
+        return
+
+    if board.isChecked():
+        for move in genCheckEvasions(board):
+            yield move
+        return
+
+    kcord = board.kings[color]
+    kingDirections = directions[kcord]
+    pinned = getPinned(board, color)
+    blocker = board.blocker
+    kingless = clearBit(blocker, kcord)
+
+    for move in genAllMoves(board):
+        flag = move >> 12
+        if flag == DROP:
+            yield move
+            continue
+
+        fcord = (move >> 6) & 63
+        if fcord == kcord:
+            if flag == NORMAL_MOVE:
+                # The king mustn't hide behind itself from a slider
+                board.blocker = kingless
+                attacked = isAttacked(board, move & 63, opcolor)
+                board.blocker = blocker
+                if not attacked:
+                    yield move
+                continue
+        elif flag != ENPASSANT:
+            # Pinned pieces may only move along the pin ray
+            if not pinned & bitPosArray[fcord] or \
+                    kingDirections[move & 63] == kingDirections[fcord]:
+                yield move
+            continue
+
+        board.applyMove(move)
+        illegal = board.opIsChecked()
+        board.popMove()
+        if not illegal:
+            yield move
+
+def hasLegalMove (board):
+    """ Returns True as soon as a legal move is found """
+    for move in genLegalMoves(board):
+        return True
+    return False
+
 
 def genDrops (board):
     color = board.color
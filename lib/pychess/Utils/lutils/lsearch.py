@@ -1,30 +1,103 @@
 from __future__ import absolute_import
+from collections import OrderedDict
 from time import time
 from random import random
-from heapq import heappush, heappop
 
-from .lmovegen import genAllMoves, genCheckEvasions, genCaptures
+from .lmovegen import genAllMoves, genCheckEvasions, genCaptures, newMove
+from .LBoard import LBoard
+from .attack import getPinned
+from .bitboard import bitPosArray
 from .egtb_gaviota import egtb_gaviota
 from pychess.Utils.const import *
-from .leval import evaluateComplete
-from .lsort import getCaptureValue, getMoveValue
+from .leval import evaluateComplete, evalMaterial
+from .lsort import sortMoves, pickMoves, pickCaptures, UNSTAGED_VARIANTS
 from .lmove import toSAN
-from .ldata import MATE_VALUE, VALUE_AT_PLY
+from .ldata import MATE_VALUE, MATE_DEPTH, VALUE_AT_PLY, PAWN_VALUE, PIECE_VALUES, ASEAN_PIECE_VALUES
 from .TranspositionTable import TranspositionTable
 from pychess.Variants.atomic import kingExplode
 from pychess.Variants.kingofthehill import testKingInCenter
 from pychess.Variants.threecheck import checkCount
-from . import ldraw
+from . import ldraw, leval
 
 TIMECHECK_FREQ = 500
+# Default transposition table size in megabytes
+HASH_SIZE = 32
+# The evaluation and the pawn hash of leval get these fractions of the hash
+# memory set by setHashSize, the transposition table gets the rest
+EVAL_HASH_PART = 16
+PAWN_HASH_PART = 64
 
-table = TranspositionTable(32 * 1024 * 1024)
+table = TranspositionTable(HASH_SIZE * 1024 * 1024)
 skipPruneChance = 0
 searching = False
 nodes = 0
+# The part of nodes searched by quiescent
+qnodes = 0
+# The SearchStats, while enableStats is on
+stats = None
 endtime = 0
 timecheck_counter = TIMECHECK_FREQ
 egtb = None
+# Only used in lsmp helper processes. The search is stopped, when the shared
+# generation.value no longer equals the jobgen of the search.
+generation = None
+jobgen = 0
+
+# Forward pruning. Each kind can be switched off for testing.
+NULL_MOVE_PRUNING = True
+LATE_MOVE_REDUCTIONS = True
+FUTILITY_PRUNING = True
+# Variants where the pruning isn't safe, as the evaluation doesn't tell the
+# whole story (the game can be won by material loss, checks, drops etc.)
+UNPRUNED_VARIANTS = (LOSERSCHESS, SUICIDECHESS, ATOMICCHESS,
+                     KINGOFTHEHILLCHESS, THREECHECKCHESS) + DROP_VARIANTS
+# Null move depth reduction
+NULL_MOVE_R = 2
+# Quiet moves searched at full depth before the rest get reduced by one ply
+LMR_FULL_MOVES = 4
+LMR_MIN_DEPTH = 3
+# Margins indexed by the remaining depth
+FUTILITY_MARGIN = (0, 200, 500)
+RAZOR_MARGIN = (0, 300, 500)
+# Quiescence search pruning. Captures losing material by the static exchange
+# evaluation are skipped, as are captures which can't raise alpha even when
+# winning DELTA_MARGIN more than the captured piece. The full evaluation is
+# skipped, when the material balance alone is LAZY_EVAL_MARGIN above beta.
+QUIESCENCE_PRUNING = True
+DELTA_MARGIN = 200
+LAZY_EVAL_MARGIN = 400
+# Scores beyond this are mate scores (see ldata.VALUE_AT_PLY)
+MATE_BOUND = MATE_VALUE - MATE_DEPTH
+# Number of positions kept by the endgame table probe cache
+EGTB_CACHE_SIZE = 65536
+
+# Triangular principal variation table. pvTable[ply][ply:pvLength[ply]] is the
+# best line found from the node at ply. The rows are reused throughout the
+# search, so no lists are built at the nodes.
+PV_SIZE = 128
+pvTable = [[0]*PV_SIZE for i in range(PV_SIZE)]
+pvLength = [0]*PV_SIZE
+
+def _updatePV (ply, move):
+    """ Make move followed by the line of ply+1 the line of ply """
+    row = pvTable[ply]
+    row[ply] = move
+    length = pvLength[ply+1]
+    row[ply+1:length] = pvTable[ply+1][ply+1:length]
+    pvLength[ply] = length
+
+def getPV ():
+    """ The principal variation found by the last alphaBeta call """
+    return pvTable[0][:pvLength[0]]
+
+def _unsafeCords (board):
+    """ A bitboard of the cords, from which a move may leave our own king in
+        check, when we are not in check already. Those are the king and the
+        pieces pinned on it, as well as any enpassant capture. In atomic chess
+        explosions may open lines anywhere, so all cords are unsafe. """
+    if board.variant in (SUICIDECHESS, ATOMICCHESS):
+        return -1
+    return getPinned(board, board.color) | bitPosArray[board.kings[board.color]]
 
 def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     """ This is a alphabeta/negamax/quiescent/iterativedeepend search algorithm
@@ -35,15 +108,18 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
         depth was a capture, it will continue calling itself, only searching for
         captures.
         
-        It returns a tuple of
-        *   a list of the path it found through the search tree (last item being
-            the deepest)
-        *   a score of your standing the the last possition. """
+        It returns the score of your standing the the last possition. The
+        path it found through the search tree is left in pvTable, and can be
+        had from getPV. """
     
     global searching, nodes, table, endtime, timecheck_counter
     foundPv = False
     hashf = hashfALPHA
-    amove = []
+    bestmove = None
+    pvLength[ply] = ply
+    
+    if ply >= PV_SIZE-1:
+        return evaluateComplete(board, board.color)
     
     ############################################################################
     # Mate distance pruning
@@ -53,43 +129,58 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     MATE_IN_1 = MATE_VALUE-ply-1
 
     if beta <= MATED:
-        return [], MATED
+        return MATED
     if beta >= MATE_IN_1:
         beta = MATE_IN_1
         if alpha >= beta:
-            return [], MATE_IN_1    
+            return MATE_IN_1    
 
     if board.variant == ATOMICCHESS:
         if bin(board.boards[board.color][KING]).count("1") == 0:
-            return [], MATED
+            return MATED
     elif board.variant == KINGOFTHEHILLCHESS:
         if testKingInCenter(board):
-            return [], MATED
+            return MATED
     elif board.variant == THREECHECKCHESS:
         if checkCount(board) == 3:
-            return [], MATED
+            return MATED
 
     ############################################################################
     # Look in the end game table
     ############################################################################
     
     global egtb
-    if egtb:
-        tbhits = egtb.scoreAllMoves(board)
-        if tbhits:
-            move, state, steps = tbhits[0]
-            
-            if state == DRAW:
-                score = 0
-            elif board.color == WHITE:
-                if state == WHITEWON:
-                    score = MATE_VALUE-steps
-                else: score = -MATE_VALUE+steps
-            else:
-                if state == WHITEWON:
-                    score = -MATE_VALUE+steps
-                else: score = MATE_VALUE-steps
-            return [move], score
+    if egtb and egtb.supported[board.pieceTotal]:
+        # Only the root needs a move and the depth to mate. Inside the tree
+        # knowing who wins is enough, and much cheaper to look up.
+        if ply == 0:
+            tbhits = egtb.scoreAllMoves(board)
+            if tbhits:
+                move, state, steps = tbhits[0]
+                
+                if state == DRAW:
+                    score = 0
+                elif board.color == WHITE:
+                    if state == WHITEWON:
+                        score = MATE_VALUE-steps
+                    else: score = -MATE_VALUE+steps
+                else:
+                    if state == WHITEWON:
+                        score = -MATE_VALUE+steps
+                    else: score = MATE_VALUE-steps
+                pvTable[ply][ply] = move
+                pvLength[ply] = ply+1
+                return score
+        else:
+            state = egtb.probeResult(board)
+            if state is not None:
+                if state == DRAW:
+                    score = 0
+                elif (state == WHITEWON) == (board.color == WHITE):
+                    score = EndgameTable.WIN_VALUE-ply
+                else: score = -EndgameTable.WIN_VALUE+ply
+                pvLength[ply] = ply
+                return score
     
     ###########################################################################
     # We don't save repetition in the table, so we need to test draw before   #
@@ -99,34 +190,52 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     # We don't adjudicate draws. Clients may have different rules for that.
     if ply > 0:
         if ldraw.test(board):
-            return [], 0
+            return 0
     
     ############################################################################
     # Look up transposition table                                              #
     ############################################################################
     # TODO: add holder to hash
+    hashmove = None
+    # Nodes searched with an open window are on the principal variation. They
+    # take no table cutoffs, as their line is wanted in full: entries stored
+    # by other search processes would cut it short. Nor are they razored or
+    # futility pruned, as a wrong cut there would change the move played.
+    pvnode = beta - alpha > 1
     if board.variant not in DROP_VARIANTS:
         if ply == 0:
             table.newSearch()
 
         table.setHashMove (depth, -1)
         probe = table.probe (board, depth, alpha, beta)
-        hashmove = None
+        if stats:
+            stats.ttProbes += 1
         if probe:
             move, score, hashf = probe
             score = VALUE_AT_PLY(score, ply)
             hashmove = move
             table.setHashMove (depth, move)
+            if stats:
+                stats.ttHits += 1
             
-            if hashf == hashfEXACT:
-                return [move], score
-            elif hashf == hashfBETA:
-                beta = min(score, beta)
-            elif hashf == hashfALPHA:
-                alpha = score
+            if not pvnode:
+                if hashf == hashfEXACT:
+                    pvTable[ply][ply] = move
+                    pvLength[ply] = ply+1
+                    if stats:
+                        stats.ttCutoffs += 1
+                    return score
+                elif hashf == hashfBETA:
+                    beta = min(score, beta)
+                elif hashf == hashfALPHA:
+                    alpha = score
                 
-            if hashf != hashfBAD and alpha >= beta:
-                return [move], score
+                if hashf != hashfBAD and alpha >= beta:
+                    pvTable[ply][ply] = move
+                    pvLength[ply] = ply+1
+                    if stats:
+                        stats.ttCutoffs += 1
+                    return score
     
     ############################################################################
     # Cheking the time                                                         #
@@ -136,6 +245,8 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     if timecheck_counter == 0:
         if time() > endtime:
             searching = False
+        elif generation is not None and generation.value != jobgen:
+            searching = False
         timecheck_counter = TIMECHECK_FREQ
     
     ############################################################################
@@ -143,7 +254,7 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     ############################################################################
     
     if not searching:
-        return [], -evaluateComplete(board, 1-board.color)
+        return -evaluateComplete(board, 1-board.color)
     
     ############################################################################
     # Go for quiescent search                                                  #
@@ -156,10 +267,46 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
             # Being in check is that serious, that we want to take a deeper look
             depth += 1
         elif board.variant in (LOSERSCHESS, SUICIDECHESS, ATOMICCHESS):
-            return [], evaluateComplete(board, board.color)
+            return evaluateComplete(board, board.color)
         else:
-            mvs, val = quiescent(board, alpha, beta, ply)
-            return mvs, val
+            return quiescent(board, alpha, beta, ply)
+    
+    ############################################################################
+    # Forward pruning                                                          #
+    ############################################################################
+    
+    prune = ply > 0 and not isCheck and board.variant not in UNPRUNED_VARIANTS \
+            and -MATE_BOUND < alpha and beta < MATE_BOUND
+    futile = False
+    
+    if prune:
+        staticEval = evaluateComplete(board, board.color)
+        
+        # Null move pruning: if passing still gives a score above beta, a real
+        # move would most likely do too. Not done when we have only pawns
+        # left, as zugzwang is then likely, nor twice in a row.
+        if NULL_MOVE_PRUNING and depth >= 2 and staticEval >= beta and \
+                board.undoLen and board.undo[board.undoLen-1][0]>>12 != NULL_MOVE:
+            counts = board.pieceCount[board.color]
+            if counts[KNIGHT] or counts[BISHOP] or counts[ROOK] or counts[QUEEN]:
+                nodes += 1
+                king = board.kings[board.color]
+                board.applyMove(newMove(king, king, NULL_MOVE))
+                val = -alphaBeta (board, max(0, depth-1-NULL_MOVE_R),
+                                  -beta, -beta+1, ply+1)
+                board.popMove()
+                if val >= beta:
+                    return beta
+        
+        if FUTILITY_PRUNING and not pvnode and depth < len(FUTILITY_MARGIN):
+            # Razoring: far below alpha, only captures may bring us back
+            if hashmove is None and staticEval + RAZOR_MARGIN[depth] <= alpha:
+                val = quiescent(board, alpha, beta, ply)
+                if val <= alpha:
+                    return val
+                pvLength[ply] = ply
+            # Futility pruning: quiet moves can't bring us above alpha
+            futile = staticEval + FUTILITY_MARGIN[depth] <= alpha
     
     ############################################################################
     # Find and sort moves                                                      #
@@ -173,54 +320,76 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
             mlist = eva_cap if eva_cap else evasions
         if not mlist and not isCheck:
             mlist = [m for m in genAllMoves(board)]
-        moves = [(-getMoveValue(board,table,depth,m),m) for m in mlist]
+        moves = sortMoves(board, table, depth, mlist)
     elif board.variant == ATOMICCHESS:
         if isCheck:
             mlist = [m for m in genCheckEvasions(board) if not kingExplode(board, m, board.color)]
         else:
             mlist = [m for m in genAllMoves(board) if not kingExplode(board, m, board.color)]
-        moves = [(-getMoveValue(board,table,depth,m),m) for m in mlist]
+        moves = sortMoves(board, table, depth, mlist)
+    elif isCheck:
+        moves = sortMoves(board, table, depth, list(genCheckEvasions(board)))
+    elif board.variant in UNSTAGED_VARIANTS:
+        moves = sortMoves(board, table, depth, list(genAllMoves(board)))
     else:
-        if isCheck:
-            moves = [(-getMoveValue(board,table,depth,m),m) for m in genCheckEvasions(board)]
-        else:
-            moves = [(-getMoveValue(board,table,depth,m),m) for m in genAllMoves(board)]
-    moves.sort()
+        # Moves are generated lazily, so a cutoff by the hash move or a good
+        # capture saves generating and sorting the quiet moves.
+        moves = pickMoves(board, table, depth, hashmove)
     
     # This is needed on checkmate
     catchFailLow = None
+    movesSearched = 0
+    unsafe = 0 if isCheck else _unsafeCords(board)
     
     ############################################################################
     # Loop moves                                                               #
     ############################################################################
     
     
-    for moveValue, move in moves:
+    for move in moves:
         
         nodes += 1
         
+        quiet = prune and board.arBoard[move&63] == EMPTY and \
+                move>>12 == NORMAL_MOVE
+        
         board.applyMove(move)
-        if not isCheck:
+        if not isCheck and (unsafe & bitPosArray[(move>>6)&63] or
+                            move>>12 == ENPASSANT):
             if board.opIsChecked():
                 board.popMove()
                 continue
         
         catchFailLow = move
+        movesSearched += 1
+        
+        if quiet and not board.isChecked():
+            if futile:
+                board.popMove()
+                continue
+            # Late move reduction: quiet moves ordered late are unlikely to
+            # be good, so try them one ply shallower first.
+            if LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH and \
+                    movesSearched > LMR_FULL_MOVES and move != hashmove and \
+                    not table.isKiller(depth, move):
+                val = -alphaBeta (board, depth-2, -alpha-1, -alpha, ply+1)
+                if val <= alpha:
+                    board.popMove()
+                    continue
         
         if foundPv:
-            mvs, val = alphaBeta (board, depth-1, -alpha-1, -alpha, ply+1)
-            val = -val
+            val = -alphaBeta (board, depth-1, -alpha-1, -alpha, ply+1)
             if val > alpha and val < beta:
-                mvs, val = alphaBeta (board, depth-1, -beta, -alpha, ply+1)
-                val = -val
+                val = -alphaBeta (board, depth-1, -beta, -alpha, ply+1)
         else:
-            mvs, val = alphaBeta (board, depth-1, -beta, -alpha, ply+1)
-            val = -val
+            val = -alphaBeta (board, depth-1, -beta, -alpha, ply+1)
         
         board.popMove()
         
         if val > alpha:
             if val >= beta:
+                if stats:
+                    stats.addCutoff(board, depth, move, hashmove, movesSearched)
                 if searching and move>>12 != DROP:
                     table.record (board, move, VALUE_AT_PLY(beta, -ply), hashfBETA, depth)
                     # We don't want to use our valuable killer move spaces for
@@ -229,10 +398,12 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
                             not move>>12 in PROMOTIONS:
                         table.addKiller (depth, move)
                         table.addButterfly(move, depth)
-                return [move]+mvs, beta
+                _updatePV(ply, move)
+                return beta
             
             alpha = val
-            amove = [move]+mvs
+            bestmove = move
+            _updatePV(ply, move)
             hashf = hashfEXACT
             foundPv = True
     
@@ -240,97 +411,160 @@ def alphaBeta (board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     # Return                                                                   #
     ############################################################################
     
-    if amove:
+    if bestmove is not None:
         if searching:
-            table.record (board, amove[0], VALUE_AT_PLY(alpha, -ply), hashf, depth)
-            if board.arBoard[amove[0]&63] == EMPTY:
-                table.addKiller (depth, amove[0])
-        return amove, alpha
+            table.record (board, bestmove, VALUE_AT_PLY(alpha, -ply), hashf, depth)
+            if board.arBoard[bestmove&63] == EMPTY:
+                table.addKiller (depth, bestmove)
+        return alpha
     
     if catchFailLow:
         if searching:
             table.record (board, catchFailLow, VALUE_AT_PLY(alpha, -ply), hashf, depth)
-        return [catchFailLow], alpha
+        pvTable[ply][ply] = catchFailLow
+        pvLength[ply] = ply+1
+        return alpha
 
     # If no moves were found, this must be a mate or stalemate
     if isCheck:
-        return [], MATED
+        return MATED
     
-    return [], 0
+    return 0
 
 def quiescent (board, alpha, beta, ply):
     
+    pvLength[ply] = ply
+    
     if skipPruneChance and random() < skipPruneChance:
-        return [], (alpha+beta) // 2
+        return (alpha+beta) // 2
+    
+    global nodes, qnodes
     
-    global nodes
+    if ply >= PV_SIZE-1:
+        return evaluateComplete(board, board.color)
     
-    if ldraw.test(board):
-        return [], 0
+    # alphaBeta has tested the position we start from. After a capture or a
+    # pawn move no position can repeat, so only the material may be a draw.
+    if board.fifty == 0:
+        if ldraw.testMaterial(board):
+            return 0
+    elif ldraw.test(board):
+        return 0
     
     isCheck = board.isChecked()
+    prune = QUIESCENCE_PRUNING and board.variant not in UNPRUNED_VARIANTS
     
     # no stand-pat when in check
-    if not isCheck: 
+    if not isCheck:
+        if prune and evalMaterial(board, board.color)[0] - LAZY_EVAL_MARGIN >= beta:
+            return beta
         value = evaluateComplete(board, board.color)
         if value >= beta:
-            return [], beta
+            return beta
         if value > alpha:
             alpha = value
     
-    amove = []
-    
-    heap = []
-    
     if isCheck:
-        someMove = False
-        for move in genCheckEvasions(board):
-            someMove = True
-            # Heap.append is fine, as we don't really do sorting on the few moves
-            heap.append((0, move))
-        if not someMove:
-            return [], -MATE_VALUE+ply
+        # We don't really do sorting on the few evasions
+        moves = list(genCheckEvasions(board))
+        if not moves:
+            return -MATE_VALUE+ply
     else:
-        for move in genCaptures (board):
-            heappush(heap, (-getCaptureValue (board, move), move))
-    
-    while heap:
+        moves = pickCaptures(board, prune)
+        unsafe = _unsafeCords(board)
+        if prune:
+            arBoard = board.arBoard
+            values = ASEAN_PIECE_VALUES if board.variant in ASEAN_VARIANTS else PIECE_VALUES
+            delta = alpha - value - DELTA_MARGIN
+    
+    for move in moves:
         
-        nodes += 1
+        if not isCheck and prune:
+            flag = move >> 12
+            if flag in PROMOTIONS:
+                gain = values[flag-2] - PAWN_VALUE
+            else: gain = 0
+            gain += values[flag == ENPASSANT and PAWN or arBoard[move & 63]]
+            if gain < delta:
+                continue
         
-        v, move = heappop(heap)
+        nodes += 1
+        qnodes += 1
         
         board.applyMove(move)
-        if not isCheck:
+        if not isCheck and (unsafe & bitPosArray[(move>>6)&63] or
+                            move>>12 == ENPASSANT):
             if board.opIsChecked():
                 board.popMove()
                 continue
         
-        mvs, val = quiescent(board, -beta, -alpha, ply+1)
-        val = -val
+        val = -quiescent(board, -beta, -alpha, ply+1)
         
         board.popMove()
         
         if val >= beta:
-            return [move]+mvs, beta
+            _updatePV(ply, move)
+            return beta
         
         if val > alpha:
             alpha = val
-            amove = [move]+mvs
-    
-    if amove:
-        return amove, alpha
+            _updatePV(ply, move)
+            if not isCheck and prune:
+                delta = alpha - value - DELTA_MARGIN
     
-    else:
-        return [], alpha
+    return alpha
+
 
+def setHashSize (mb):
+    """ Divide mb megabytes between the transposition table and the evaluation
+        and pawn hash of leval, and replace them by empty ones. If lsmp
+        helpers are running, lsmp.setCores must be called again to give them
+        the new table. Each helper has its own evaluation and pawn hash. """
+    global table
+    size = mb * 1024 * 1024
+    leval.setEvalHashSize(size // EVAL_HASH_PART)
+    leval.setPawnHashSize(size // PAWN_HASH_PART)
+    size -= size // EVAL_HASH_PART + size // PAWN_HASH_PART
+    if size != table.size():
+        table = TranspositionTable(size, shared=table.shared)
 
 class EndgameTable():
-    def __init__ (self):
-        self.provider = egtb_gaviota()
+    """ The search's access to the Gaviota endgame tables. The game results
+        probed inside the tree are kept in an LRU cache keyed by board.hash,
+        and the hits and misses of the cache are counted. """
     
-    def _pieceCounts (self, board):
-        return sorted([ bin(board.friends[i]).count("1") for i in range(2) ])
+    # The score of a won position, found without a depth to mate. It is kept
+    # below the mate scores, as the mate might be far away.
+    WIN_VALUE = MATE_BOUND - PV_SIZE
+    
+    def __init__ (self, cachesize=EGTB_CACHE_SIZE):
+        self.provider = egtb_gaviota()
+        # supported[n] tells if positions with n pieces are in the tables
+        self.supported = [self.provider.supports((n, 0)) for n in range(33)]
+        self.cache = OrderedDict()
+        self.cachesize = cachesize
+        self.hits = 0
+        self.misses = 0
+    
+    def probeResult (self, lBoard):
+        """ Return the game result (WHITEWON, DRAW or BLACKWON) of the
+            position, or None if it isn't in the tables. """
+        
+        cache = self.cache
+        key = lBoard.hash
+        if key in cache:
+            self.hits += 1
+            # Move it to the end, as the most recently used
+            result = cache.pop(key)
+            cache[key] = result
+            return result
+        
+        self.misses += 1
+        result, depth = self.provider.scoreGame(lBoard, True, False)
+        cache[key] = result
+        if len(cache) > self.cachesize:
+            cache.popitem(last=False)
+        return result
     
     def scoreAllMoves (self, lBoard):
         """ Return each move's result and depth to mate.
@@ -342,11 +576,158 @@ class EndgameTable():
             depth: Depth to mate
         """
         
-        pc = self._pieceCounts(lBoard)
-        if self.provider.supports(pc):
+        if self.supported[lBoard.pieceTotal]:
             return self.provider.scoreAllMoves(lBoard)
         return []
 
 def enableEGTB():
     global egtb
     egtb = EndgameTable()
+
+################################################################################
+# Search statistics                                                            #
+################################################################################
+
+class SearchStats (object):
+    """ Counters of the search in this process, kept while enableStats is on.
+        The node counts are added from nodes and qnodes by resetNodes. """
+    
+    def __init__ (self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.ttCutoffs = 0
+        # Beta cutoffs in alphaBeta, by the kind of move
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.hashMoveCutoffs = 0
+        self.captureCutoffs = 0
+        self.killerCutoffs = 0
+        self.historyCutoffs = 0
+        # Seconds spent in the functions wrapped by enableStats
+        self.times = {"eval": 0., "movegen": 0., "makeunmake": 0.}
+    
+    def addCutoff (self, board, depth, move, hashmove, movesSearched):
+        self.cutoffs += 1
+        if movesSearched == 1:
+            self.firstMoveCutoffs += 1
+        if move == hashmove:
+            self.hashMoveCutoffs += 1
+        elif board.arBoard[move&63] != EMPTY or move>>12 in PROMOTIONS or \
+                move>>12 == ENPASSANT:
+            self.captureCutoffs += 1
+        elif table.isKiller(depth, move):
+            self.killerCutoffs += 1
+        else:
+            # Quiet moves are ordered by the history heuristic
+            self.historyCutoffs += 1
+
+def _timed (func, times, key):
+    def timed (*args):
+        start = time()
+        try:
+            return func(*args)
+        finally:
+            times[key] += time() - start
+    return timed
+
+def _timedGenerator (func, times, key):
+    # The moves are generated lazily, so time each step of the generator
+    def timed (*args):
+        start = time()
+        moves = iter(func(*args))
+        times[key] += time() - start
+        while True:
+            start = time()
+            try:
+                move = next(moves)
+            except StopIteration:
+                times[key] += time() - start
+                return
+            times[key] += time() - start
+            yield move
+    return timed
+
+# The functions timed while the statistics are on, with their originals
+_untimed = {}
+
+def enableStats (enable=True):
+    """ Start (or stop) keeping SearchStats. Apart from a few tests of the
+        stats variable, the counters cost nothing when they are off, as the
+        timed functions are only wrapped while they are on. Don't call this
+        during a search. """
+    global stats
+    if enable and stats is None:
+        stats = SearchStats()
+        times = stats.times
+        globs = globals()
+        for name in ("evaluateComplete", "evalMaterial"):
+            _untimed[name] = globs[name]
+            globs[name] = _timed(globs[name], times, "eval")
+        for name in ("genAllMoves", "genCheckEvasions", "genCaptures",
+                     "pickMoves", "pickCaptures"):
+            _untimed[name] = globs[name]
+            globs[name] = _timedGenerator(globs[name], times, "movegen")
+        _untimed["sortMoves"] = sortMoves
+        globs["sortMoves"] = _timed(sortMoves, times, "movegen")
+        for name in ("applyMove", "popMove"):
+            _untimed[name] = getattr(LBoard, name)
+            setattr(LBoard, name, _timed(_untimed[name], times, "makeunmake"))
+    elif not enable and stats is not None:
+        globs = globals()
+        for name, func in _untimed.items():
+            if name in ("applyMove", "popMove"):
+                setattr(LBoard, name, func)
+            else: globs[name] = func
+        _untimed.clear()
+        stats = None
+
+def resetNodes ():
+    """ Zero nodes and qnodes, after adding them to the statistics """
+    global nodes, qnodes
+    if stats:
+        stats.nodes += nodes
+        stats.qnodes += qnodes
+    nodes = 0
+    qnodes = 0
+
+def resetStats ():
+    if stats:
+        enableStats(False)
+        enableStats(True)
+    if egtb:
+        egtb.hits = egtb.misses = 0
+
+def getStats ():
+    """ The statistics of the search since enableStats or resetStats, as a
+        dict, or None if they are off. Rates are in percent. The nodes of
+        lsmp helpers aren't counted. """
+    if stats is None:
+        return None
+    
+    def rate (part, total):
+        return round(100. * part / total, 1) if total else 0.
+    
+    allNodes = stats.nodes + nodes
+    allQnodes = stats.qnodes + qnodes
+    cutoffs = stats.cutoffs
+    return {
+        "nodes": allNodes,
+        "main_nodes": allNodes - allQnodes,
+        "quiescence_nodes": allQnodes,
+        "tt_probes": stats.ttProbes,
+        "tt_hit_rate": rate(stats.ttHits, stats.ttProbes),
+        "tt_cutoff_rate": rate(stats.ttCutoffs, stats.ttProbes),
+        "cutoffs": cutoffs,
+        "first_move_cutoff_rate": rate(stats.firstMoveCutoffs, cutoffs),
+        "hash_move_cutoff_rate": rate(stats.hashMoveCutoffs, cutoffs),
+        "capture_cutoff_rate": rate(stats.captureCutoffs, cutoffs),
+        "killer_cutoff_rate": rate(stats.killerCutoffs, cutoffs),
+        "history_cutoff_rate": rate(stats.historyCutoffs, cutoffs),
+        "egtb_probes": egtb.misses if egtb else 0,
+        "egtb_cache_hits": egtb.hits if egtb else 0,
+        "eval_time": round(stats.times["eval"], 3),
+        "movegen_time": round(stats.times["movegen"], 3),
+        "makeunmake_time": round(stats.times["makeunmake"], 3),
+    }
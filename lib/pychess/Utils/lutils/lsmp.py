@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+
+################################################################################
+# Lazy SMP. Helper processes search the same root position as the main search, #
+# sharing nothing but the transposition table. They fill it with entries the   #
+# main search then finds, which is what makes it faster. The result is always  #
+# the one of the main search.                                                  #
+################################################################################
+
+from time import sleep
+from ctypes import c_long
+from multiprocessing import Process, Queue
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from pychess.Utils.lutils import lsearch
+from pychess.Utils.lutils.ldata import MAXPLY
+from pychess.Utils.lutils.TranspositionTable import TranspositionTable
+
+helpers = []
+jobs = []
+# The table shared with the helpers
+table = None
+# Incremented whenever the helpers are told to stop. A helper gives up its
+# current job, when this differs from the value at the time the job was given.
+generation = None
+helperNodes = None
+# The generation of the last job each helper finished, and of the last job
+# given to the helpers
+helperDone = None
+lastJob = 0
+
+def _helper (index, jobqueue, table, generation, helperNodes, helperDone):
+    """ The main loop of a helper process """
+    lsearch.table = table
+    lsearch.generation = generation
+    while True:
+        job = jobqueue.get()
+        if job is None:
+            break
+        board, depth, endtime, jobgen = job
+        lsearch.endtime = endtime
+        lsearch.jobgen = jobgen
+        lsearch.nodes = helperNodes[index]
+        lsearch.searching = True
+        lsearch.timecheck_counter = lsearch.TIMECHECK_FREQ
+        # Half of the helpers search one ply deeper than the main search, so
+        # the helpers don't all follow the main search through the same tree.
+        depth += index & 1
+        while lsearch.searching and depth <= MAXPLY:
+            lsearch.alphaBeta(board, depth)
+            helperNodes[index] = lsearch.nodes
+            depth += 1
+        helperDone[index] = jobgen
+
+def getCores ():
+    return len(helpers) + 1
+
+def setCores (cores):
+    """ Use cores processes for searching, i.e. start cores-1 helpers. This
+        replaces lsearch.table by a shared table of the same size, unless it
+        is shared already. Also call this after lsearch.setHashSize, to
+        restart the helpers with the new table. """
+    global table, generation, helperNodes, helperDone, lastJob
+    cores = max(1, cores)
+    if cores == getCores() and lsearch.table is table:
+        return
+    _stopProcesses()
+    if cores == 1:
+        table = None
+        if lsearch.table.shared:
+            lsearch.table = TranspositionTable(lsearch.table.size())
+        return
+
+    if not lsearch.table.shared:
+        lsearch.table = TranspositionTable(lsearch.table.size(), shared=True)
+    table = lsearch.table
+    generation = RawValue(c_long, 0)
+    helperNodes = RawArray(c_long, cores-1)
+    helperDone = RawArray(c_long, cores-1)
+    lastJob = 0
+    for i in range(cores-1):
+        jobqueue = Queue()
+        helper = Process(target=_helper, name="lsmp helper %d" % i,
+                         args=(i, jobqueue, lsearch.table, generation,
+                               helperNodes, helperDone))
+        helper.daemon = True
+        helper.start()
+        helpers.append(helper)
+        jobs.append(jobqueue)
+
+def _stopProcesses ():
+    stopHelpers()
+    for jobqueue in jobs:
+        jobqueue.put(None)
+    for helper in helpers:
+        helper.join()
+    del helpers[:]
+    del jobs[:]
+
+def startHelpers (board, depth):
+    """ Let the helpers search board to depth and beyond, until stopHelpers is
+        called or lsearch.endtime is reached. """
+    global lastJob
+    if not helpers:
+        return
+    generation.value += 1
+    lastJob = generation.value
+    # The queue pickles the board in a background thread, so we mustn't pass
+    # a board the main search is going to change.
+    board = board.clone()
+    for jobqueue in jobs:
+        jobqueue.put((board, depth, lsearch.endtime, generation.value))
+
+def stopHelpers ():
+    """ Stops the helpers, and waits until they have given up their jobs and
+        stored their node counts """
+    if not helpers:
+        return
+    generation.value += 1
+    for i, helper in enumerate(helpers):
+        while helperDone[i] < lastJob and helper.is_alive():
+            sleep(0.001)
+
+def getHelperNodes ():
+    """ The number of nodes searched by the helpers since resetHelperNodes """
+    if not helpers:
+        return 0
+    return sum(helperNodes)
+
+def resetHelperNodes ():
+    """ Only call while the helpers are stopped """
+    if helpers:
+        for i in range(len(helpers)):
+            helperNodes[i] = 0
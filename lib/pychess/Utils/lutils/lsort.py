@@ -3,6 +3,7 @@ from __future__ import print_function
 import sys
 
 from .attack import getAttacks, staticExchangeEvaluate
+from .lmovegen import genAllMoves, genCaptures, isPseudoLegal
 from pychess.Utils.eval import pos as positionValues
 from pychess.Variants.atomic import kingExplode
 
@@ -92,7 +93,113 @@ def getMoveValue (board, table, depth, move):
     
     return score
 
-def sortMoves (board, table, ply, hashmove, moves):
-    f = lambda move: getMoveValue (board, table, ply, hashmove, move)
+def sortMoves (board, table, ply, moves):
+    f = lambda move: getMoveValue (board, table, ply, move)
     moves.sort(key=f, reverse=True)
     return moves
+
+################################################################################
+#   Staged move picking                                                        #
+################################################################################
+
+# Variants which either filter the move list in the search, or have pieces not
+# handled by isPseudoLegal. The search uses sortMoves for those instead.
+UNSTAGED_VARIANTS = ASEAN_VARIANTS + DROP_VARIANTS + \
+                    (LOSERSCHESS, SUICIDECHESS, ATOMICCHESS)
+
+def getCaptureOrder (board, move):
+    """ MVV/LVA order of a capture. If the capturing piece is worth more than
+        the captured one, the static exchange evaluation decides, and a
+        negative value is returned for captures losing material. """
+    flag = move >> 12
+    arBoard = board.arBoard
+    values = ASEAN_PIECE_VALUES if board.variant in ASEAN_VARIANTS else PIECE_VALUES
+    mpV = values[arBoard[move>>6 & 63]]
+    cpV = values[flag == ENPASSANT and PAWN or arBoard[move & 63]]
+    if flag in PROMOTIONS:
+        cpV += values[flag-2] - PAWN_VALUE
+    if mpV > cpV and staticExchangeEvaluate (board, move) < 0:
+        return -1
+    return cpV * 8 - mpV // 100
+
+def pickCaptures (board, prune=False):
+    """ Yield the captures of the position, best first by getCaptureOrder.
+        The static exchange evaluation is done only once a capture is picked,
+        so it is saved for the captures following a cutoff. Losing captures
+        come last, or with prune, aren't yielded at all. """
+    arBoard = board.arBoard
+    values = ASEAN_PIECE_VALUES if board.variant in ASEAN_VARIANTS else PIECE_VALUES
+    captures = []
+    for move in genCaptures(board):
+        flag = move >> 12
+        mpV = values[arBoard[move>>6 & 63]]
+        cpV = values[flag == ENPASSANT and PAWN or arBoard[move & 63]]
+        if flag in PROMOTIONS:
+            cpV += values[flag-2] - PAWN_VALUE
+        captures.append((cpV * 8 - mpV // 100, mpV > cpV, move))
+    
+    badCaptures = []
+    while captures:
+        best = max(captures)
+        captures.remove(best)
+        value, risky, move = best
+        if risky and staticExchangeEvaluate (board, move) < 0:
+            if not prune:
+                badCaptures.append(move)
+            continue
+        yield move
+    
+    for move in badCaptures:
+        yield move
+
+def pickMoves (board, table, depth, hashmove=None):
+    """ Yield the pseudo legal moves of the position in the order they are
+        likely to be best. Each stage is generated only once the previous one
+        is used up, so little work is wasted on a cutoff by an early move.
+        1.  The move from the hash table
+        2.  Winning and equal captures by MVV/LVA, see getCaptureOrder
+        3.  Killers
+        4.  Quiet moves by getMoveValue, that is history and position
+        5.  Losing captures """
+    
+    if hashmove is not None:
+        if isPseudoLegal(board, hashmove):
+            yield hashmove
+        else: hashmove = None
+    
+    badCaptures = []
+    captures = []
+    for move in genCaptures(board):
+        if move == hashmove:
+            continue
+        value = getCaptureOrder(board, move)
+        if value < 0:
+            badCaptures.append(move)
+        else:
+            captures.append((value, move))
+    captures.sort(reverse=True)
+    for value, move in captures:
+        yield move
+    
+    enemies = board.friends[1-board.color]
+    killers = []
+    for move in (table.killer1[depth], table.killer2[depth]):
+        if move != -1 and move != hashmove and \
+                not enemies & bitPosArray[move & 63] and isPseudoLegal(board, move):
+            killers.append(move)
+            yield move
+    
+    quiets = []
+    for move in genAllMoves(board):
+        flag = move >> 12
+        if flag == ENPASSANT or enemies & bitPosArray[move & 63]:
+            continue
+        if move == hashmove or move in killers:
+            continue
+        quiets.append((getMoveValue(board, table, depth, move), move))
+    quiets.sort(reverse=True)
+    for value, move in quiets:
+        yield move
+    
+    for move in badCaptures:
+        yield move
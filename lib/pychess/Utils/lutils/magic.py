@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+################################################################################
+# Attack tables for the sliding pieces.                                        #
+#                                                                              #
+# These work like "fancy magic" bitboards: for each cord, the blockers that    #
+# matter are masked out (those on the piece's lines, not counting the last     #
+# cord of each line), and the result is looked up in a table of all attacks.   #
+# Instead of multiplying by a magic number to get a dense index, we let a dict #
+# do the hashing, as that is cheaper than 64 bit multiplications in Python.    #
+# So the attacks of a rook on cord are:                                        #
+#                                                                              #
+#     rookAttacks[cord][blocker & rookMasks[cord]]                             #
+#                                                                              #
+# which is one lookup, where the rotated bitboards in ldata need two.          #
+################################################################################
+
+from .bitboard import bitPosArray
+from .ldata import attack00, attack45, attack90, attack135, \
+                   ray00, ray45, ray90, ray135, RANK, FILE
+
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+def _relevantMask (cord, directions):
+    """ The cords on the lines from cord, except the last one on each line """
+    mask = 0
+    for df, dr in directions:
+        f = FILE(cord) + df
+        r = RANK(cord) + dr
+        while 0 <= f + df < 8 and 0 <= r + dr < 8:
+            mask |= bitPosArray[r*8 + f]
+            f += df
+            r += dr
+    return mask
+
+def _subsets (mask):
+    """ Yield all subsets of the bits in mask (the Carry-Rippler trick) """
+    sub = 0
+    while True:
+        yield sub
+        sub = (sub - mask) & mask
+        if not sub:
+            break
+
+rookMasks = [_relevantMask(cord, ROOK_DIRECTIONS) for cord in range(64)]
+bishopMasks = [_relevantMask(cord, BISHOP_DIRECTIONS) for cord in range(64)]
+
+rookAttacks = [{} for cord in range(64)]
+bishopAttacks = [{} for cord in range(64)]
+
+# The rotated bitboard tables always have the piece's own cord set
+for cord in range(64):
+    own = bitPosArray[cord]
+    table = rookAttacks[cord]
+    r00 = ray00[cord]
+    r90 = ray90[cord]
+    a00 = attack00[cord]
+    a90 = attack90[cord]
+    for sub in _subsets(rookMasks[cord]):
+        blocker = sub | own
+        table[sub] = a00[r00 & blocker] | a90[r90 & blocker]
+
+    table = bishopAttacks[cord]
+    r45 = ray45[cord]
+    r135 = ray135[cord]
+    a45 = attack45[cord]
+    a135 = attack135[cord]
+    for sub in _subsets(bishopMasks[cord]):
+        blocker = sub | own
+        table[sub] = a45[r45 & blocker] | a135[r135 & blocker]
+
+def rookAttack (cord, blocker):
+    return rookAttacks[cord][blocker & rookMasks[cord]]
+
+def bishopAttack (cord, blocker):
+    return bishopAttacks[cord][blocker & bishopMasks[cord]]
+
+def queenAttack (cord, blocker):
+    return rookAttacks[cord][blocker & rookMasks[cord]] | \
+           bishopAttacks[cord][blocker & bishopMasks[cord]]
@@ -1,23 +1,36 @@
+""" Perft, the count of the leaf nodes of the legal move tree, for testing and
+    timing the move generator.
+
+    To run EPD perft suites like testing/gamefiles/perftsuite.epd:
+
+    python -m pychess.Utils.lutils.perft [-v variant] [-d depth] [-j processes]
+                                         [--hash entries] file.epd ...
+"""
+
 from __future__ import print_function
 
 import sys
+from multiprocessing import Pool
 from time import time
 
-from pychess.Utils.lutils.lmovegen import genAllMoves
+from pychess.Utils.const import *
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmovegen import genLegalMoves
 from pychess.Utils.lutils.lmove import toSAN, toLAN
 
+# Variants with state that isn't in board.hash, but changes the moves: the
+# holdings of the drop variants, and the first moves of the cambodian king
+# and queen. Their node counts can't be cached.
+UNHASHED_VARIANTS = DROP_VARIANTS + (CAMBODIANCHESS,)
+
 
 def do_perft(board, depth, root):
     nodes = 0
     if depth == 0:
         return 1
-    
-    for move in genAllMoves(board):
-        board.applyMove(move)
-        if board.opIsChecked():
-            board.popMove()
-            continue
 
+    for move in genLegalMoves(board):
+        board.applyMove(move)
         count = do_perft(board, depth-1, root-1)
         nodes += count
         board.popMove()
@@ -26,9 +39,160 @@ def do_perft(board, depth, root):
 
     return nodes
 
-def perft(board, depth, root):
+def countNodes (board, depth, table=None):
+    """ Like do_perft, but the moves of the last ply are counted without being
+        made (bulk counting). table is an optional list, in which the counts
+        of subtrees are cached by board.hash and depth. """
+
+    if depth <= 1:
+        if depth == 0:
+            return 1
+        nodes = 0
+        for move in genLegalMoves(board):
+            nodes += 1
+        return nodes
+
+    if table is not None:
+        index = (board.hash + depth) % len(table)
+        entry = table[index]
+        if entry is not None and entry[0] == board.hash and entry[1] == depth:
+            return entry[2]
+
+    nodes = 0
+    for move in genLegalMoves(board):
+        board.applyMove(move)
+        nodes += countNodes(board, depth-1, table)
+        board.popMove()
+
+    if table is not None:
+        table[index] = (board.hash, depth, nodes)
+    return nodes
+
+# The hash table of a pool process, kept between the root moves it counts
+_table = None
+
+def _initProcess (hashentries):
+    global _table
+    _table = [None] * hashentries if hashentries else None
+
+def _countRootMove (job):
+    board, move, depth = job
+    table = _table if board.variant not in UNHASHED_VARIANTS else None
+    board.applyMove(move)
+    return countNodes(board, depth-1, table)
+
+def newPool (processes, hashentries=0):
+    """ A pool of processes for perftCount, each with a hash table of
+        hashentries entries """
+    return Pool(processes, _initProcess, (hashentries,))
+
+def perftCount (board, depth, hashentries=0, pool=None):
+    """ The perft of board to depth. With hashentries, a table of that many
+        entries caches the subtree counts. With a pool from newPool, the root
+        moves are divided among its processes. """
+
+    if board.variant in UNHASHED_VARIANTS:
+        hashentries = 0
+
+    if pool is not None and depth > 1:
+        jobs = [(board, move, depth) for move in genLegalMoves(board)]
+        return sum(pool.map(_countRootMove, jobs, chunksize=1))
+
+    table = [None] * hashentries if hashentries else None
+    return countNodes(board, depth, table)
+
+def perft(board, depth, root, hashentries=0):
     for i in range(depth):
         start_time = time()
-        nodes = do_perft(board, i+1, root)
+        if root > 0:
+            nodes = do_perft(board, i+1, root)
+        else:
+            nodes = perftCount(board, i+1, hashentries)
         ttime = time() -start_time
-        print("%2d %10d %5.2f %12.2fnps" % (i+1, nodes, ttime, nodes / ttime))
+        print("%2d %10d %5.2f %12.2fnps" % (i+1, nodes, ttime, nodes / max(ttime, 1e-6)))
+
+def readEPD (path):
+    """ Yield the fen and the list of (depth, node count) of each line of a
+        perft EPD file, like "<fen> ;D1 20 ;D2 400" """
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(";")
+            depths = []
+            for part in parts[1:]:
+                part = part.strip()
+                if part.startswith("D"):
+                    depth, count = part[1:].split()
+                    depths.append((int(depth), int(count)))
+            yield parts[0].strip(), depths
+
+def perftSuite (path, variant=NORMALCHESS, maxdepth=4, processes=1,
+                hashentries=0, log=print):
+    """ Runs the perft of each position of an EPD file to the depths given,
+        up to maxdepth, and logs whether the node counts are right. Returns
+        the number of passed and failed tests. """
+
+    pool = newPool(processes, hashentries) if processes > 1 else None
+    passed = failed = 0
+    try:
+        for i, (fen, depths) in enumerate(readEPD(path)):
+            board = LBoard(variant)
+            board.applyFen(fen)
+            log("%d %s" % (i+1, fen))
+            for depth, count in depths:
+                if depth > maxdepth:
+                    break
+                start_time = time()
+                nodes = perftCount(board, depth, hashentries, pool)
+                ttime = max(time() - start_time, 1e-6)
+                if nodes == count:
+                    passed += 1
+                    result = "pass"
+                else:
+                    failed += 1
+                    result = "FAIL (expected %d)" % count
+                log("    D%d %12d %8.2fs %10d nps  %s" % (depth, nodes, ttime,
+                                                         nodes / ttime, result))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return passed, failed
+
+def main (argv=None):
+    import argparse
+    from pychess.Variants import variants
+
+    # The cecp names of the variants LBoard supports, for the lowest variant
+    # constant with the name
+    names = dict((variant.cecp_name, key) for key, variant in
+                 sorted(variants.items(), reverse=True))
+
+    parser = argparse.ArgumentParser(
+        prog="python -m pychess.Utils.lutils.perft",
+        description="Runs perft EPD suites, like testing/gamefiles/perftsuite.epd")
+    parser.add_argument("files", nargs="+", metavar="file.epd")
+    parser.add_argument("-v", "--variant", default="normal", choices=sorted(names),
+                        help="variant of the positions (default: normal)")
+    parser.add_argument("-d", "--depth", type=int, default=4,
+                        help="maximum depth to test (default: 4)")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="processes to divide the root moves among (default: 1)")
+    parser.add_argument("--hash", type=int, default=0, metavar="ENTRIES",
+                        help="entries of the perft hash table of each process (default: none)")
+    args = parser.parse_args(argv)
+
+    passed = failed = 0
+    for path in args.files:
+        result = perftSuite(path, names[args.variant], args.depth,
+                            args.processes, args.hash)
+        passed += result[0]
+        failed += result[1]
+    print("%d passed, %d failed" % (passed, failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
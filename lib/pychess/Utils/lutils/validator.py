@@ -1,10 +1,21 @@
 from __future__ import print_function
 
-from pychess.Utils.lutils.lmovegen import genAllMoves
+from pychess.Utils.const import *
+from pychess.Utils.lutils.lmovegen import genAllMoves, genLegalMoves, isPseudoLegal
 
 ################################################################################
 #   Validate move                                                              #
 ################################################################################
 
-def validateMove (board, move):
+def validateMove (board, move, legal=False):
+    """ Tests if move is pseudo legal, or with legal=True, if it is strictly
+        legal. The pseudo legal test is what attack.defends and the atomic
+        rules rely upon, so it stays the default. """
+    if legal:
+        return move in genLegalMoves(board)
+    # isPseudoLegal never gives false positives, but doesn't know the pieces
+    # and king captures of these variants
+    if board.variant not in ASEAN_VARIANTS and board.variant != ATOMICCHESS \
+            and isPseudoLegal(board, move):
+        return True
     return move in genAllMoves(board)
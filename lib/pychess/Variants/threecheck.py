@@ -18,10 +18,10 @@ class ThreeCheckBoard(Board):
 def checkCount(board):
     cc = 0
     lboard = board.clone()
-    while lboard.hist_move:
+    while lboard.undoLen:
         if lboard.isChecked():
             cc += 1
         lboard.popMove()
-        if lboard.hist_move:
+        if lboard.undoLen:
             lboard.popMove()
     return cc
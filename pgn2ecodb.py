@@ -13,6 +13,8 @@ from pychess.Savers.pgn import load
 from pychess.System.protoopen import protoopen
 from pychess.System.prefix import addDataPrefix
 from pychess.Utils.eco import hash_struct
+from pychess.Utils.const import FEN_START
+from pychess.Utils.lutils.LBoard import LBoard
 
     
 path = os.path.join(addDataPrefix("eco.db"))
@@ -32,7 +34,9 @@ if __name__ == '__main__':
         old_eco = ""
         ply_max = 0
         for i, game in enumerate(cf.games):
-            model = cf.loadToModel(i)
+            board = LBoard()
+            board.applyFen(FEN_START)
+            moves = cf.parse_mainline(cf.get_movetext(i), board)
 
             eco = cf._getTag(i, "ECO")[:3]
             
@@ -46,7 +50,7 @@ if __name__ == '__main__':
             
             base = int(old_eco != eco)
             
-            ply = len(model.moves)
+            ply = len(moves)
             ply_max = max(ply_max, ply)
             if ply == 0:
                 cu = conn.cursor()
@@ -55,7 +59,7 @@ if __name__ == '__main__':
                 if res is not None:
                     hash = res[0]
             else:
-                hash = memoryview(hash_struct.pack(model.boards[-1].board.hash))
+                hash = memoryview(hash_struct.pack(board.hash))
                 
             if opening:
                 rows.append((hash, base, unicode(eco), unicode(lang), unicode(opening), unicode(variation)))
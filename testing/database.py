@@ -1,11 +1,16 @@
 from __future__ import print_function
+import os
+import re
 import unittest
+import tempfile
 
 from pychess.Utils.const import *
 from pychess.Savers.database import save, load
 from pychess.Savers.pgn import load as pgnload
 from pychess.Savers.pgn import walk
 from pychess.Database import model
+from pychess.Database import PgnImport
+from pychess.Savers.pgnbase import PgnGames, scan_games
 from pychess.Database.model import set_engine, metadata, collection, event,\
                             site, player, game, annotator, ini_collection
 
@@ -53,6 +58,55 @@ class DbTestCase(unittest.TestCase):
         
         self.assertEqual(in_game, out_game)
             
+class PgnImportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # The Variant tags are dropped, so the Chess960 games are told by
+        # their Event and FEN tags
+        with open('gamefiles/chess960rwch.pgn', 'rb') as f:
+            self.chess960 = f.read()
+        self.stripped = re.sub(br'\[Variant "[^"]*"\]\r?\n', b'', self.chess960)
+        with open('gamefiles/annotated.pgn', 'rb') as f:
+            self.data = self.stripped + b"\n" + f.read()
+
+        self.chunk = PgnImport.GAMES_CHUNK
+        PgnImport.GAMES_CHUNK = 3
+
+    def tearDown(self):
+        PgnImport.GAMES_CHUNK = self.chunk
+
+    def test_chess960_tags(self):
+        """Testing game_rows of Chess960 games without a Variant tag"""
+
+        rows = PgnImport.parse_chunk((None, self.stripped, 0))
+        self.assertEqual(rows, PgnImport.parse_chunk((None, self.chess960, 0)))
+        self.assertTrue(rows)
+        for names, row in rows:
+            self.assertEqual(row["variant"], "Fischerandom")
+            self.assertTrue(row["movelist"])
+
+    def test_chunks(self):
+        """Testing parse_chunk of chunks against the whole file"""
+
+        rows = PgnImport.parse_chunk((None, self.data, 0))
+        games = PgnGames(self.data, scan_games(self.data))
+
+        chunked = []
+        for job in PgnImport.pgn_jobs(games):
+            chunked += PgnImport.parse_chunk(job)
+        self.assertEqual(chunked, rows)
+
+        fd, path = tempfile.mkstemp(suffix=".pgn")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.data)
+            chunked = []
+            for job in PgnImport.pgn_jobs(games, path):
+                chunked += PgnImport.parse_chunk(job)
+        finally:
+            os.remove(path)
+        self.assertEqual(chunked, rows)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -4,6 +4,9 @@ from pychess.Utils.const import *
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.leval import evaluateComplete
 from pychess.Utils.lutils import leval 
+from pychess.Utils.lutils import lbatch
+from pychess.Utils.lutils.lmovegen import genAllMoves
+from pychess.Utils.lutils.ldata import PIECE_VALUES
 
 
 class EvalTestCase(unittest.TestCase):
@@ -55,6 +58,70 @@ class EvalTestCase(unittest.TestCase):
             sb = func(self.board, BLACK, phaseb)
             #print func, sw, sb
             self.assertEqual(sw, sb)
+
+    def test4(self):
+        """Testing the incrementally updated material and king tropism"""
+        board = LBoard(NORMALCHESS)
+        board.applyFen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        
+        def check():
+            for color in (WHITE, BLACK):
+                material = sum(PIECE_VALUES[piece] * board.pieceCount[color][piece]
+                               for piece in range(PAWN, KING))
+                self.assertEqual(board.material[color], material)
+                self.assertEqual(board.tropism[color],
+                                 leval.evalKingTropism(board, color, 0))
+        
+        check()
+        for move in genAllMoves(board):
+            board.applyMove(move)
+            check()
+            for move2 in genAllMoves(board):
+                board.applyMove(move2)
+                check()
+                board.popMove()
+            board.popMove()
+            check()
+
+    def test5(self):
+        """Testing the evaluation hash"""
+        board = LBoard(NORMALCHESS)
+        board.applyFen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        
+        leval.setEvalHashSize(1000)
+        leval.resetHitRates()
+        for move in genAllMoves(board):
+            board.applyMove(move)
+            for color in (WHITE, BLACK):
+                score = leval.scorePosition(board, color)
+                self.assertEqual(evaluateComplete(board, color), score)
+                self.assertEqual(evaluateComplete(board, color), score)
+            board.popMove()
+        self.assertEqual(leval.hitRates()[0], 50)
+        
+        # Another variant doesn't get the cached score
+        board.variant = SUICIDECHESS
+        self.assertEqual(evaluateComplete(board, WHITE),
+                         leval.scorePosition(board, WHITE))
+        leval.setEvalHashSize(leval.EVAL_HASH_SIZE * leval.evalEntryType.size)
+
+    def test6(self):
+        """Testing batch evaluation against evaluateComplete"""
+        with open('gamefiles/perftsuite.epd') as f:
+            fens = [line.split(";")[0] for line in f]
+        boards = list(lbatch.toBoards(fens))
+        for board in boards:
+            for color in (WHITE, BLACK):
+                terms = leval.scoreTerms(board, color)[0]
+                self.assertEqual(sum(terms) + leval.randomval,
+                                 leval.scorePosition(board, color))
+        for color in (None, WHITE, BLACK):
+            scores = [evaluateComplete(board, board.color if color is None else color)
+                      for board in boards]
+            self.assertEqual(list(lbatch.evaluateBatch(fens, color)), scores)
+            columns = lbatch.extractFeatures(boards, color)
+            self.assertEqual(list(lbatch.scoreFeatures(columns)), scores)
+            self.assertEqual(len(columns["passed"]), len(fens))
     
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,7 @@ from pychess.Utils.Move import Move
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.lmove import parseAN, parseSAN, parseFAN, toFAN, ParsingError
 from pychess.Utils.lutils.lmovegen import genAllMoves
+from pychess.Utils.const import FEN_START
 
 
 class MoveTestCase(unittest.TestCase):
@@ -66,6 +67,48 @@ class MoveTestCase(unittest.TestCase):
             fan = toFAN(board, lmove)
             self.assertEqual(parseFAN(board, fan), lmove)
 
+    def test_nullMove(self):
+        """Testing applyMove and popMove with a null move"""
+
+        board = LBoard()
+        board.applyFen("rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3")
+        fen = board.asFen()
+        hash = board.hash
+
+        board.applyMove(parseSAN(board, "--"))
+        self.assertEqual(board.enpassant, None)
+        self.assertEqual(board.asFen(), "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR b KQkq - 0 3")
+
+        board.popMove()
+        self.assertEqual(board.asFen(), fen)
+        self.assertEqual(board.hash, hash)
+        self.assertEqual(len(board.hist_move), len(board.hist_hash))
+
+    def test_clone(self):
+        """Testing LBoard.clone with and without history"""
+
+        board = LBoard()
+        board.applyFen(FEN_START)
+        for san in ("Nf3", "Nf6", "Ng1", "Ng8"):
+            board.applyMove(parseSAN(board, san))
+
+        copy = board.clone()
+        self.assertEqual(copy.hist_move, board.hist_move)
+        self.assertEqual(copy.repetitionCount(), 2)
+        for i in range(4):
+            copy.popMove()
+        self.assertEqual(copy.asFen(), FEN_START)
+        self.assertEqual(len(board.hist_move), 4)
+
+        copy = board.clone(history=False)
+        self.assertEqual(copy.asFen(), board.asFen())
+        self.assertEqual(copy.hash, board.hash)
+        self.assertEqual(copy.lastMove, None)
+        self.assertEqual(copy.repetitionCount(), 1)
+        copy.applyMove(parseSAN(copy, "e4"))
+        copy.popMove()
+        self.assertEqual(copy.asFen(), board.asFen())
+
 
 if __name__ == '__main__':
     unittest.main()
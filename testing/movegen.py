@@ -1,11 +1,12 @@
 from __future__ import print_function
 import unittest
 
-from pychess.Utils.lutils.lmovegen import genAllMoves, genCheckEvasions
+from pychess.Utils.lutils.lmovegen import genAllMoves, genCheckEvasions, genLegalMoves, hasLegalMove
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.bitboard import toString, iterBits
 from pychess.Utils.lutils.ldata import *
 from pychess.Utils.lutils.validator import validateMove
+from pychess.Utils.lutils.perft import readEPD, perftCount
 
 from pychess.Utils.lutils.lmove import toSAN, toAN, parseSAN, ParsingError
 from pychess.Utils.const import *
@@ -98,6 +99,24 @@ class FindMovesTestCase(unittest.TestCase):
                 self.perft(board, depth-1, prevmoves)
                 board.popMove()
     
+    def legalmoves(self, board, depth):
+        nmoves = []
+        for move in genAllMoves(board):
+            board.applyMove(move)
+            if not board.opIsChecked():
+                nmoves.append(move)
+            board.popMove()
+
+        lmoves = list(genLegalMoves(board))
+        self.assertEqual(sorted(nmoves), sorted(lmoves))
+        self.assertEqual(hasLegalMove(board), bool(nmoves))
+
+        if depth > 1:
+            for move in lmoves:
+                board.applyMove(move)
+                self.legalmoves(board, depth-1)
+                board.popMove()
+
     def movegen(self, positions, variant):
         for i, (fen, depths) in enumerate(positions):
             print(i+1, "/", len(positions), "-", fen)
@@ -172,5 +191,32 @@ class FindMovesTestCase(unittest.TestCase):
         self.MAXDEPTH = 3
         self.movegen(positions, MAKRUKCHESS)
 
+    def testLegalMoves(self):
+        """Testing genLegalMoves against the applyMove/opIsChecked filter"""
+        for line in open('gamefiles/perftsuite.epd'):
+            if line.startswith("#"):
+                continue
+            board = LBoard(NORMALCHESS)
+            board.applyFen(line.split(";")[0])
+            self.legalmoves(board, 2)
+
+        for variant, fen in (
+                (SITTUYINCHESS, "8/6k1/6p1/3s2P1/3npR2/2r5/p2N2F1/3K4 b - - 0 49"),
+                (MAKRUKCHESS, "rnsmksnr/8/ppppp1pp/2P5/5p2/PP1PPPPP/8/RNSKMSNR w - - 0 3")):
+            board = LBoard(variant)
+            board.applyFen(fen)
+            self.legalmoves(board, 2)
+
+    def testPerftCount(self):
+        """Testing perftCount with and without the perft hash"""
+        for fen, depths in readEPD('gamefiles/perftsuite.epd'):
+            board = LBoard(NORMALCHESS)
+            board.applyFen(fen)
+            hash = board.hash
+            for depth, count in depths[:3]:
+                self.assertEqual(perftCount(board, depth), count)
+                self.assertEqual(perftCount(board, depth, hashentries=1024), count)
+            self.assertEqual(board.hash, hash)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,20 @@
 from __future__ import print_function
 
+import io
+import os
 import re
 import sys
+import shutil
+import tempfile
 import unittest
 
 from pychess.Savers.pgn import load, walk
-from pychess.Savers.pgnbase import pattern, MOVE
+from pychess.Savers import pgnbase
+from pychess.Savers.pgnbase import pattern, MOVE, pgn_load, split_games, scan_games, PgnGames, \
+    PgnBase, ROSTER, INDEX_SUFFIX, scan_tags, iter_scan_tags
+from pychess.Savers.ChessFile import LoadingError
 from pychess.Utils.const import *
+from pychess.Utils.lutils.LBoard import LBoard
 
 
 class PgnTestCase(unittest.TestCase):
@@ -18,6 +26,118 @@ class PgnTestCase(unittest.TestCase):
         matches = [m[MOVE-1] for m in pattern.findall(moves)] 
         self.assertEqual(' '.join(matches), ' '.join(moves.split()))
 
+    def test_mapped(self):
+        """Testing games split out of mapped files on demand"""
+        for filename in ("world_matches", "chess960rwch", "annotated", "fenSetup"):
+            with io.open('gamefiles/%s.pgn' % filename, encoding="latin_1") as f:
+                games = split_games(f)
+            with io.open('gamefiles/%s.pgn' % filename, encoding="latin_1") as f:
+                pgnfile = pgn_load(f)
+            self.assertTrue(isinstance(pgnfile.games, PgnGames))
+            self.assertEqual(len(pgnfile), len(games))
+            self.assertEqual(list(pgnfile.games), games)
+            self.assertEqual(pgnfile.games[-2:], games[-2:])
+
+        # Lines ending in "\r" alone, or in a mix of line endings
+        for data in (b'[Event "a"]\r1. e4 *\r[Event "b"]\r1. d4 *\r',
+                     b'[Event "a"]\r\n1. e4 *\r\n[Event "b"]\r[White "c"]\n1. d4 *\n'):
+            text = data.decode("latin_1").replace("\r\n", "\n").replace("\r", "\n")
+            games = split_games(text.splitlines(True))
+            self.assertEqual(len(games), 2)
+            self.assertEqual(PgnGames(data, scan_games(data))[:], games)
+
+    def test_index(self):
+        """Testing the index of a PGN file, and appending games to it"""
+        with open('gamefiles/world_matches.pgn', 'rb') as f:
+            data = f.read()
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "games.pgn")
+        min_size = pgnbase.INDEX_MIN_SIZE
+        pgnbase.INDEX_MIN_SIZE = 0
+        try:
+            with open(path, 'wb') as f:
+                f.write(data[:len(data)//2])
+            for append in (False, False, True):
+                if append:
+                    with open(path, 'ab') as f:
+                        f.write(data[len(data)//2:])
+                with io.open(path, encoding="latin_1") as f:
+                    pgnfile = pgn_load(f)
+                with io.open(path, encoding="latin_1") as f:
+                    expected = PgnBase(split_games(f))
+                self.assertEqual(sorted(os.listdir(tmpdir)),
+                                 ["games.pgn", "games.pgn" + INDEX_SUFFIX])
+                self.assertEqual(len(pgnfile), len(expected))
+                self.assertEqual(list(pgnfile.games), expected.games)
+                for i in range(len(expected)):
+                    for tag in ROSTER:
+                        self.assertEqual(pgnfile._getTag(i, tag), expected._getTag(i, tag))
+        finally:
+            pgnbase.INDEX_MIN_SIZE = min_size
+            shutil.rmtree(tmpdir)
+
+    def test_changed_file(self):
+        """Testing games of a PGN file changed after it was loaded"""
+        with open('gamefiles/world_matches.pgn', 'rb') as f:
+            data = f.read()
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "games.pgn")
+        map_size = pgnbase.MAP_MIN_SIZE
+        try:
+            for size in (map_size, 0):
+                pgnbase.MAP_MIN_SIZE = size
+                with open(path, 'wb') as f:
+                    f.write(data)
+                with io.open(path, encoding="latin_1") as f:
+                    pgnfile = pgn_load(f)
+                movetext = pgnfile.get_movetext(len(pgnfile)-1)
+                with open(path, 'wb') as f:
+                    f.write(b'[Event "x"]\n\n1. e4 *\n')
+                if size:
+                    # Copied into memory
+                    self.assertEqual(pgnfile.get_movetext(len(pgnfile)-1), movetext)
+                else:
+                    self.assertRaises(LoadingError, pgnfile.get_movetext, len(pgnfile)-1)
+        finally:
+            pgnbase.MAP_MIN_SIZE = map_size
+            shutil.rmtree(tmpdir)
+
+    def test_scan_tags(self):
+        """Testing tag columns scanned from the game headers"""
+        tags = ("White", "Result", "WhiteElo", "ECO")
+        with open('gamefiles/world_matches.pgn') as f:
+            expected = PgnBase(split_games(f))
+        with open('gamefiles/world_matches.pgn') as f:
+            pgnfile = pgn_load(f)
+        for games in (pgnfile.games, expected.games):
+            columns = scan_tags(games, tags)
+            chunks = list(iter_scan_tags(games, tags, 100))
+            self.assertEqual(len(chunks), 6)
+            self.assertEqual(sum((chunk["ECO"] for chunk in chunks), []), columns["ECO"])
+            for tag in ("White", "Result", "ECO"):
+                self.assertEqual(columns[tag], [expected._getTag(i, tag) for i in range(len(expected))])
+            self.assertEqual(list(columns["WhiteElo"]),
+                             [int(expected._getTag(i, "WhiteElo") or 0) for i in range(len(expected))])
+
+    def test_parse_mainline(self):
+        """Testing mainline parsing against the boards of parse_string"""
+        with open('gamefiles/world_matches.pgn') as f:
+            pgnfile = pgn_load(f)
+        for i in range(len(pgnfile)):
+            board = LBoard(NORMALCHESS)
+            board.applyFen(FEN_START)
+            boards = pgnfile.parse_string(pgnfile.get_movetext(i), board, -1)
+            board = LBoard(NORMALCHESS)
+            board.applyFen(FEN_START)
+            moves = pgnfile.parse_mainline(pgnfile.get_movetext(i), board)
+            self.assertEqual(list(moves), [b.lastMove for b in boards[1:]])
+            self.assertEqual(board.hash, boards[-1].hash)
+
+            board = LBoard(NORMALCHESS)
+            board.applyFen(FEN_START)
+            moves = pgnfile.parse_mainline(pgnfile.get_movetext(i), board, 10)
+            self.assertEqual(len(moves), min(10, len(boards)-1))
+
 def create_test(o, n):
     def test_expected(self):
         for orig, new in zip(o.split(), n.split()):
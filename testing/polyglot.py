@@ -1,7 +1,15 @@
+import os
+import mmap
 import unittest
+import tempfile
+from array import array
 
 from pychess.Utils.Board import Board
 from pychess.Utils.lutils.leval import LBoard
+from pychess.Utils import book, bookbuilder
+from pychess.Utils.const import NORMALCHESS, FEN_START
+from pychess.Savers.pgnbase import pgn_load
+from pychess.Database.dbwalk import COMMENT, VARI_START, VARI_END, NAG
 
 # Examples taken from http://alpha.uhasselt.be/Research/Algebra/Toga/book_format.html
 testcases = [
@@ -26,5 +34,108 @@ class PolyglotTestCase(unittest.TestCase):
             board.applyFen(testcase[0])
             self.assertEqual(board.hash, testcase[1])
 
+    def testBook(self):
+        """Testing the mapped book against a scan of the book file"""
+
+        path = '../pychess_book.bin'
+        with open(path, "rb") as f:
+            data = f.read()
+        entries = [book.entrystruct.unpack_from(data, i)
+                   for i in range(0, len(data), book.entrysize)]
+        book.openBooks([path])
+        
+        board = LBoard(Board)
+        board.applyFen(testcases[0][0])
+        self.assertTrue(book.getOpenings(board))
+        
+        for testcase in testcases:
+            board = LBoard(Board)
+            board.applyFen(testcase[0])
+            moves = [entry[2:] for entry in entries if entry[0] == board.hash]
+            for i in range(2):
+                openings = book.getOpenings(board)
+                self.assertEqual([opening[1:] for opening in openings], moves)
+        book.openBooks([])
+
+    def testBrokenBook(self):
+        """Testing books which can't be opened are skipped"""
+
+        path = '../pychess_book.bin'
+        broken = 'gamefiles/single.epd'
+        Book = book.Book
+        def openBook(bookpath):
+            if bookpath == broken:
+                raise mmap.error("Cannot map %s" % bookpath)
+            return Book(bookpath)
+        book.Book = openBook
+        try:
+            book.openBooks([broken, path])
+        finally:
+            book.Book = Book
+        paths = [b.path for b in book.books]
+        self.assertTrue(path in paths)
+        self.assertFalse(broken in paths)
+
+        board = LBoard(Board)
+        board.applyFen(testcases[0][0])
+        self.assertTrue(book.getOpenings(board))
+        book.openBooks([])
+
+    def testBookBuilder(self):
+        """Testing books built from PGN, in memory and with sorted runs"""
+
+        fd, path = tempfile.mkstemp(".bin")
+        os.close(fd)
+        pgnfiles = ['gamefiles/dortmund.pgn']
+        try:
+            entries = bookbuilder.buildBook(path, pgnfiles, maxply=10)
+            with open(path, "rb") as f:
+                data = f.read()
+            self.assertEqual(len(data), entries * book.entrysize)
+            
+            bookbuilder.buildBook(path, pgnfiles, maxply=10, maxEntries=50)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            
+            book.openBooks([path])
+            board = LBoard(Board)
+            board.applyFen(testcases[0][0])
+            openings = book.getOpenings(board)
+            self.assertTrue(openings)
+            for move, weight, games, score in openings:
+                self.assertEqual(weight, score)
+                self.assertTrue(score <= 2 * games)
+            book.openBooks([])
+        finally:
+            os.remove(path)
+
+    def testCountMovelists(self):
+        """Testing book counts of database movelists against PGN games"""
+
+        def row(moves, result):
+            movelist = moves.tobytes() if hasattr(moves, "tobytes") else moves.tostring()
+            return movelist, None, result
+
+        with open('gamefiles/dortmund.pgn') as f:
+            pgn = pgn_load(f)
+        games = pgn.games[:20]
+        movelists = []
+        for i in range(len(games)):
+            board = LBoard(NORMALCHESS)
+            board.applyFen(FEN_START)
+            movelists.append(pgn.parse_mainline(pgn.get_movetext(i), board))
+        results = [pgn.get_result(i) for i in range(len(games))]
+        counts = bookbuilder.countPgnGames(games, 10)
+        self.assertTrue(counts)
+        rows = [row(moves, result) for moves, result in zip(movelists, results)]
+        self.assertEqual(bookbuilder.countMovelists(rows, 10), counts)
+
+        # Variations, comments and nags aren't counted
+        moves = movelists[0]
+        annotated = array("H", [moves[0], NAG+1, COMMENT, VARI_START, moves[1],
+                                VARI_END]) + moves[1:]
+        rows[0] = row(annotated, results[0])
+        self.assertEqual(bookbuilder.countMovelists(rows, 10), counts)
+
 if __name__ == '__main__':
     unittest.main()